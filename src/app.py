@@ -3,33 +3,51 @@ This module is a program that simulates a remote controlled
 user-interfaced web server.
 """
 from datetime import datetime
-import time
 import threading
 import json
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, render_template, request, redirect, url_for, \
+    jsonify, Response
 from sales_predictor import get_periods, months, sales_data, beers, \
     predict_month_beer_qty, highest_gyle_number_for_beers, \
     predict_week_beer_qty, get_recommended_sales, \
-    update_recommended_sales
+    update_recommended_sales, ensure_sales_loaded, predict_all_beers_qty, \
+    forecast_beers_qty
 from brew_process import status_process_for_tank, \
-    start_process_for_beers, create_process_for_beer, \
+    create_process_for_beer, \
     status_process_for_beer, move_process_to_next_state, \
-    remove_process_for_beer, status_process_for_beer_stock, \
-    restore_beer_process
-from brew_logger import errorLogger, eventLogger
+    remove_process_for_beer, status_process_for_beer_stock
+from brew_logger import errorLogger, eventLogger, configure_logging
+from brew_journal import get_json_from_last_prefix, restore_brewhouse
+from brew_engine import engine
+from brew_scheduler import plan_production
+import brew_metrics
+from brew_shard import LocalShard, LOCAL_SITE, SITES, MOVE_TIMEOUT, \
+    start_shards
 import brew_process_dict
 
-PERIODS = get_periods()
+PERIODS = []
 MONTHS = months
 SALES_DATA = sales_data
 BEERS = beers
 current_month = datetime.now().strftime('%B')
-predicted_beer = predict_month_beer_qty(current_month)
+predicted_beer = {}
 highest_gyle_number = highest_gyle_number_for_beers
+# serialises taking the next gyle numbers and the quantities off the
+# recommended sales, as the app serves requests on many threads
+gyle_number_lock = threading.Lock()
 
 inventory = {}
 SALE_PREDICT = {}
-recommended_sales = get_recommended_sales()
+recommended_sales = {}
+restored_recommended = {}
+
+# the sales dependent data is computed on the first request, or by the
+# warm-up thread, rather than at import
+app_data_lock = threading.Lock()
+app_data = {"ready": False}
+
+# the shard of every site; the other sites are started with the app
+shards = {LOCAL_SITE: LocalShard(LOCAL_SITE)}
 
 tab_no = {"tab": ""}
 period = {"period": current_month}
@@ -39,39 +57,6 @@ eventLogger = eventLogger()
 
 app = Flask(__name__)
 
-def get_json_from_last_prefix(fname: str, prefix_key: str):
-    """
-    This gets the last late in a file.
-    :param fname: a string informing the file name.
-    :param prefix_key: a string containing the prefix key.
-    :return:
-    """
-    errorLogger.debug("GET LAST LINE: %s", fname)
-    # check if the file exists
-    try:
-        file = open(fname, 'r')
-    except IOError:
-        errorLogger.error("Failed to to read log file %s", fname)
-        return None
-    else:
-        with file:
-            lines = file.read().splitlines()
-            if lines:
-                for line in range(len(lines), 1, -1):
-                    # using '@' as a key to split the string
-                    split_data = lines[line - 1].split("@")
-                    if split_data[1] == (prefix_key + " : "):
-                        if len(split_data) <= 1:
-                            errorLogger.error("Event(s) has not found "
-                                              "in the system log: "
-                                              "%s", line)
-                            return
-                        data_line = split_data[2].replace("\'", "\"")
-                        data_line = data_line.replace("True", "true")
-                        data_line = data_line.replace("False", "false")
-                        return json.loads(data_line)
-            return None
-
 def restore_from_log():
     """
     This retrieve the information from log file as json format.
@@ -80,44 +65,54 @@ def restore_from_log():
     errorLogger.debug("RESTORE FROM LOG")
     log_file_name = "log/system.log"
 
-    tanks = get_json_from_last_prefix(log_file_name, "tanks")
     recommended = get_json_from_last_prefix(log_file_name,
                                             "recommended")
-    stock = get_json_from_last_prefix(log_file_name, "stock")
-    states = get_json_from_last_prefix(log_file_name, "state")
-
-    # check if the log file is empty
-    if tanks:
-        brew_process_dict.TANKS = tanks
-    else:
-        errorLogger.warning("System log doesn't the prefix key: "
-                            "tanks.")
+    restore_brewhouse(log_file_name, brew_process_dict.TANKS)
 
     if recommended:
-        for beer in recommended:
-            recommended_sales.update({beer: recommended[beer]})
+        with app_data_lock:
+            restored_recommended.update(recommended)
+            if app_data["ready"]:
+                recommended_sales.update(recommended)
     else:
         errorLogger.warning("System log doesn't the prefix key: "
                             "recommended.")
 
-    if stock:
-        for beer in stock:
-            brew_process_dict.update_beer_stock(beer, stock[beer])
-    else:
-        errorLogger.warning("System log doesn't the prefix key: "
-                            "stock.")
-
-    if states:
-        for state_data in states:
-            restore_beer_process(state_data["gyle"],
-                                 state_data["name"], state_data["qty"],
-                                 state_data["state"],
-                                 state_data["is_allocate"],
-                                 state_data["p_tank"])
-    else:
-        errorLogger.warning("System log doesn't the prefix key: "
-                            "state.")
+def init_app_data():
+    """
+    This computes the periods, the predicted beers and the recommended
+     sales the first time they are needed.
+    """
+    if app_data["ready"]:
+        return
+    ensure_sales_loaded()
+    with app_data_lock:
+        if app_data["ready"]:
+            return
+        errorLogger.debug("INIT APP DATA")
+        PERIODS.extend(get_periods())
+        predicted_beer.update(predict_month_beer_qty(current_month))
+        recommended_sales.update(get_recommended_sales())
+        recommended_sales.update(restored_recommended)
+        app_data.update({"ready": True})
+
+def start_warm_up() -> threading.Thread:
+    """
+    This computes the application data on a background thread.
+    :return thread: the started daemon thread.
+    """
+    thread = threading.Thread(target=init_app_data, name="app-warm-up",
+                              daemon=True)
+    thread.start()
+    return thread
 
+@app.before_request
+def before_request():
+    """
+    This makes sure the application data is ready before a request is
+     handled.
+    """
+    init_app_data()
 
 @app.route('/', methods=['GET'])
 def root() -> redirect:
@@ -136,7 +131,6 @@ def home() -> render_template:
     :return: render_template.
     """
     errorLogger.debug("HOME")
-    time.sleep(0.2)
     return render_template("dashboard.html", PERIODS=PERIODS,
                            SALES_DATA=SALES_DATA, BEERS=BEERS,
                            TANKS=status_process_for_tank(),
@@ -166,6 +160,33 @@ def sales_predictor() -> redirect:
         SALE_PREDICT.update(predict_week_beer_qty(sales_period))
     return redirect(url_for('home'))
 
+@app.route('/salesPredictions', methods=['GET'])
+def sales_predictions():
+    """
+    This returns the predicted quantity of every beer for every month
+     and week as json.
+    :return: a json response of the forecast matrix.
+    """
+    errorLogger.debug("SALES PREDICTIONS")
+    return jsonify(predict_all_beers_qty())
+
+@app.route('/salesForecast/<string:kind>', methods=['GET'])
+def sales_forecast(kind: str):
+    """
+    This returns the forecast of every beer for the months or weeks
+     after the last one with sales as json. The models are fitted in the
+     background, so the forecast is 202 Accepted until they are ready.
+    :param kind: a string of the period kind, "month" or "week".
+    :return: a json response of the forecast.
+    """
+    errorLogger.debug("SALES FORECAST")
+    if kind not in ("month", "week"):
+        return jsonify({"error": "Unknown period: " + kind}), 404
+    forecast = forecast_beers_qty(kind)
+    if forecast is None:
+        return jsonify({"status": "fitting"}), 202
+    return jsonify(forecast)
+
 @app.route('/continueProcess/<string:beer_key>', methods=['POST'])
 def continue_process(beer_key: str) -> redirect:
     """
@@ -177,9 +198,50 @@ def continue_process(beer_key: str) -> redirect:
     errorLogger.debug("CONTROL DASHBOARD")
 
     beer_name, gyle_no, quantity = beer_key.split(":")
-    move_process_to_next_state(int(gyle_no), beer_name, int(quantity))
+    future = move_process_to_next_state(int(gyle_no), beer_name,
+                                        int(quantity))
+    if future is None:
+        errorLogger.warning("No brewing process for %s", beer_key)
+        return redirect(url_for('home'))
+    # the request doesn't wait for the engine, the dashboard and the
+    # process events report the move once it is settled
+    future.add_done_callback(lambda settled: log_move(beer_key, settled))
     return redirect(url_for('home'))
 
+def log_move(beer_key: str, future):
+    """
+    This logs a move that the engine rejected.
+    :param beer_key: a string of the gyle's key.
+    :param future: the settled Future of the move.
+    """
+    if future.cancelled():
+        errorLogger.info("Move of %s was cancelled.", beer_key)
+    elif not future.result()["applied"]:
+        errorLogger.warning("Move of %s was rejected in state %s.",
+                            beer_key, future.result()["state"])
+
+@app.route('/processEvents', methods=['GET'])
+def process_events():
+    """
+    This streams the events of the brewing processes as server-sent
+     events, from a subscription to the engine.
+    :return: a text/event-stream response.
+    """
+    errorLogger.debug("PROCESS EVENTS")
+    if engine.loop is None:
+        return jsonify({"error": "The engine isn't running"}), 503
+    events = engine.subscribe()
+
+    def stream():
+        try:
+            while True:
+                event = engine.call(events.__anext__())
+                yield "data: " + json.dumps(event) + "\n\n"
+        finally:
+            engine.call(events.aclose())
+
+    return Response(stream(), mimetype="text/event-stream")
+
 @app.route('/completeProcess/<string:beer_key>', methods=['POST'])
 def complete_process(beer_key: str) -> redirect:
     """
@@ -205,32 +267,235 @@ def add_brew_process() -> redirect:
 
     beer_name = request.form.get("beer_name")
     qty = int(request.form.get("quantity"))
-    highest_gyle_number.update(
-        {beer_name: (highest_gyle_number[beer_name] + 1)})
-    gyle_number = highest_gyle_number[beer_name]
-
-    update_recommended_sales(recommended_sales, beer_name, qty)
-    create_process_for_beer(gyle_number, beer_name, qty)
+    gyle = take_gyles([(beer_name, qty)])[0]
+    create_process_for_beer(*gyle)
     return redirect(url_for('home'))
 
-def run_event():
-    while True:
+def take_gyles(orders: list) -> list:
+    """
+    This gives each ordered gyle the next gyle number of its beer, and
+     takes its quantity off the recommended sales.
+    :param orders: a list of (beer_name, quantity) tuples.
+    :return gyles: a list of (gyle_no, beer_name, quantity) tuples.
+    """
+    gyles = []
+    with gyle_number_lock:
+        for beer_name, qty in orders:
+            highest_gyle_number.update(
+                {beer_name: (highest_gyle_number[beer_name] + 1)})
+            update_recommended_sales(recommended_sales, beer_name, qty)
+            gyles.append((highest_gyle_number[beer_name], beer_name, qty))
+    return gyles
+
+@app.route('/productionSchedule', methods=['GET'])
+def production_schedule():
+    """
+    This plans the recommended sales still to brew over the current
+     month and the next two, and returns the brew calendar of every gyle
+     and tank as Gantt json.
+    :return: a json response of the plan.
+    """
+    errorLogger.debug("PRODUCTION SCHEDULE")
+    try:
+        return jsonify(plan_production(recommended_sales,
+                                       highest_gyle_number, datetime.now()))
+    except ValueError as error:
+        errorLogger.error("Failed to plan the production: %s", error)
+        return jsonify({"error": str(error)}), 409
+
+def request_list(field: str) -> list:
+    """
+    This gets a list out of the json body of a batch request.
+    :param field: a string of the field holding the list.
+    :return: the list, empty if the body doesn't hold the field.
+    :raises ValueError: if the body isn't an object or the field isn't a
+     list.
+    """
+    body = request.get_json(force=True)
+    if not isinstance(body, dict):
+        raise ValueError("The body must be a json object")
+    entries = body.get(field, [])
+    if not isinstance(entries, list):
+        raise ValueError("The " + field + " must be a list")
+    return entries
+
+def gyles_from_keys(beer_keys: list) -> list:
+    """
+    This parses "beer:gyle:quantity" keys.
+    :param beer_keys: a list of strings of the keys.
+    :return: a list of (gyle_no, beer_name, quantity) tuples.
+    :raises ValueError: if a key is malformed.
+    """
+    gyles = []
+    for beer_key in beer_keys:
+        try:
+            beer_name, gyle_no, quantity = beer_key.split(":")
+            gyles.append((int(gyle_no), beer_name, int(quantity)))
+        except (AttributeError, ValueError):
+            raise ValueError("Malformed key: " + repr(beer_key))
+    return gyles
+
+def orders_from_entries(entries: list) -> list:
+    """
+    This checks the gyles of an addBrewProcesses body, all of them
+     before any is created.
+    :param entries: a list of {"beer_name": str, "quantity": int}.
+    :return: a list of (beer_name, quantity) tuples.
+    :raises ValueError: if an entry isn't a known beer and a positive
+     quantity.
+    """
+    orders = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            raise ValueError("Malformed gyle: " + repr(entry))
+        beer_name = entry.get("beer_name")
+        if beer_name not in highest_gyle_number or \
+                beer_name not in recommended_sales:
+            raise ValueError("Unknown beer: " + repr(beer_name))
         try:
-            start_process_for_beers()
-            time.sleep(0.1)
-        except:
-            errorLogger.error("Failed to create a spread thread for "
-                              "start_process_for_beers method")
+            qty = int(entry.get("quantity"))
+        except (TypeError, ValueError):
+            qty = 0
+        if qty <= 0:
+            raise ValueError("Bad quantity for " + beer_name + ": " +
+                             repr(entry.get("quantity")))
+        orders.append((beer_name, qty))
+    return orders
+
+def shard_for(site: str):
+    """
+    This routes a site to its shard.
+    :param site: a string of the site's name.
+    :return: the shard of the site, or None if there is no such site.
+    """
+    return shards.get(site)
+
+@app.route('/sites', methods=['GET'])
+def sites():
+    """
+    This returns the names of the sites as json.
+    :return: a json response of the site names.
+    """
+    errorLogger.debug("SITES")
+    return jsonify(sorted(shards))
+
+@app.route('/sites/<string:site>/status', methods=['GET'])
+def site_status(site: str):
+    """
+    This returns the tanks, processes and stock of a site as json,
+     tagged with their versions, or 304 Not Modified for a request
+     If-None-Match the versions.
+    :param site: a string of the site's name.
+    :return: a json response of the site's status.
+    """
+    errorLogger.debug("SITE STATUS")
+    shard = shard_for(site)
+    if shard is None:
+        return jsonify({"error": "Unknown site: " + site}), 404
+    versions = shard.call("versions")
+    etag = "{tanks}-{processes}-{stock}".format(**versions)
+    # nothing changed since the client's copy, so nothing is sent
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(shard.call("status"))
+    response.set_etag(etag)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    This returns the telemetry of the engine of every site in the
+     Prometheus text format.
+    :return: a text/plain response.
+    """
+    snapshots = {site: shard.call("metrics")
+                 for site, shard in sorted(shards.items())}
+    return Response(brew_metrics.render(snapshots),
+                    mimetype="text/plain; version=0.0.4")
+
+@app.route('/addBrewProcesses', methods=['POST'],
+           defaults={"site": LOCAL_SITE})
+@app.route('/sites/<string:site>/addBrewProcesses', methods=['POST'])
+def add_brew_processes(site: str):
+    """
+    This creates the brewing processes of many gyles of a site in one
+     batch, from a json body {"gyles": [{"beer_name": str, "quantity":
+     int}]}. Each gyle gets the next gyle number of its beer.
+    :param site: a string of the site's name.
+    :return: a json response of the keys created.
+    """
+    errorLogger.debug("ADD BREW PROCESSES")
+    shard = shard_for(site)
+    if shard is None:
+        return jsonify({"error": "Unknown site: " + site}), 404
+    # every gyle is checked before any gyle number is taken
+    try:
+        orders = orders_from_entries(request_list("gyles"))
+    except ValueError as error:
+        errorLogger.warning("Rejected the gyles: %s", error)
+        return jsonify({"error": str(error)}), 400
+    return jsonify({"created": shard.call("create", take_gyles(orders))})
+
+@app.route('/continueProcesses', methods=['POST'],
+           defaults={"site": LOCAL_SITE})
+@app.route('/sites/<string:site>/continueProcesses', methods=['POST'])
+def continue_processes(site: str):
+    """
+    This moves many gyles of a site to their next state in one batch,
+     from a json body {"keys": ["beer:gyle:quantity"]}, waiting at most
+     MOVE_TIMEOUT, a fraction of a second, for the engine to settle the
+     moves. A move waiting for a tank is reported as pending.
+    :param site: a string of the site's name.
+    :return: a json response of {key: {"applied": bool, "state": str}},
+     {"pending": true} for a move waiting for a tank, or null for a
+     gyle that doesn't exist.
+    """
+    errorLogger.debug("CONTINUE PROCESSES")
+    shard = shard_for(site)
+    if shard is None:
+        return jsonify({"error": "Unknown site: " + site}), 404
+    try:
+        beer_keys = request_list("keys")
+        gyles = gyles_from_keys(beer_keys)
+    except ValueError as error:
+        errorLogger.warning("Rejected the keys: %s", error)
+        return jsonify({"error": str(error)}), 400
+    results = shard.call("move", gyles, MOVE_TIMEOUT)
+    return jsonify(dict(zip(beer_keys, results)))
 
+@app.route('/completeProcesses', methods=['POST'],
+           defaults={"site": LOCAL_SITE})
+@app.route('/sites/<string:site>/completeProcesses', methods=['POST'])
+def complete_processes(site: str):
+    """
+    This removes many gyles of a site in one batch, from a json body
+     {"keys": ["beer:gyle:quantity"]}.
+    :param site: a string of the site's name.
+    :return: a json response of the keys removed.
+    """
+    errorLogger.debug("COMPLETE PROCESSES")
+    shard = shard_for(site)
+    if shard is None:
+        return jsonify({"error": "Unknown site: " + site}), 404
+    try:
+        gyles = gyles_from_keys(request_list("keys"))
+    except ValueError as error:
+        errorLogger.warning("Rejected the keys: %s", error)
+        return jsonify({"error": str(error)}), 400
+    return jsonify({"removed": shard.call("remove", gyles)})
 
 if __name__ == '__main__':
     app.secret_key = 'super secret key'
     app.config['SESSION_TYPE'] = 'filesystem'
+    configure_logging()
     restore_from_log()
+    start_warm_up()
 
-    # start_process_for_beers()
-    thread = threading.Thread(target=run_event)
-    thread.setDaemon(True)
-    thread.start()
+    # the engine sleeps on its event loop until a process is woken up
+    engine.start()
+    shards.update(start_shards(SITES))
 
-    app.run(debug=True)
+    # the reloader would run the app, and so the engine, the shards and
+    # the restore, in a second process
+    app.run(debug=True, threaded=True, use_reloader=False)
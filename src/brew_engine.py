@@ -0,0 +1,268 @@
+"""
+This module is a program that runs the brew engine on an asyncio event
+loop. The loop sleeps until a process is woken up, then evaluates the
+woken processes on a worker thread, so the loop stays responsive. It
+also offers coroutines to create, advance and remove gyles, and to
+subscribe to their state changes; whatever takes the engine lock runs on
+a worker thread too. A move waiting for a tank, or a caller waiting for
+a free tank, is an awaitable resolved when a tank is released; the
+callers are queued with the gyles, and a release hands its tank to the
+one it suits best. Thousands of gyles in flight cost a coroutine frame
+each, not a thread or a poll. The synchronous functions of brew_process
+stay the implementation, so threads and coroutines share one engine.
+"""
+import asyncio
+from contextlib import suppress
+from threading import Thread
+import brew_process
+from brew_process_dict import allocate_tank, release_tank, \
+    wait_for_tank, cancel_tank_wait, STAGE_CAPABILITIES
+from brew_logger import errorLogger
+from process_registry import process_key
+
+errorLogger = errorLogger()
+
+
+class AsyncBrewEngine(object):
+    """
+    This class contains the event loop running the brew engine and the
+    subscribers to the process events.
+    """
+
+    def __init__(self):
+        self.loop = None
+        self._thread = None
+        self._task = None
+        self._wakeup = None
+        self._subscribers = set()
+
+    def on_process_event(self, beer_obj, event: str):
+        """
+        This forwards a process event from any thread to the loop.
+        :param beer_obj: a BrewingProcess.
+        :param event: a string of the event.
+        """
+        message = {"key": process_key(beer_obj.bear_name,
+                                      beer_obj.gyle_no, beer_obj.quantity),
+                   "state": beer_obj.state, "event": event}
+        self.loop.call_soon_threadsafe(self.dispatch, message)
+
+    def dispatch(self, message: dict):
+        """
+        This wakes the engine up or publishes a process event to the
+        subscribers. It runs on the loop.
+        :param message: a dictionary of the key, state and event.
+        """
+        if message["event"] == "woken":
+            self._wakeup.set()
+            return
+        for queue in self._subscribers:
+            queue.put_nowait(message)
+
+    def grant_tank(self, waiter, tank_name: str):
+        """
+        This gives a tank handed over to a caller of allocate. It runs on
+        the loop. A caller that stopped waiting releases the tank again.
+        :param waiter: the caller's asyncio Future.
+        :param tank_name: a string of the tank.
+        """
+        if waiter.done():
+            self.loop.run_in_executor(None, self.give_back_tank, tank_name)
+        else:
+            waiter.set_result(tank_name)
+
+    def take_tank(self, capability: str, quantity: int, waiter, grant):
+        """
+        This allocates a tank and grants it, or queues the caller for the
+        next one released. It blocks on the engine lock, so it runs in
+        the loop's executor.
+        :param capability: a string of the stage, "fermentation" or
+         "conditioning".
+        :param quantity: an integer of the beer quantity.
+        :param waiter: the caller's asyncio Future.
+        :param grant: a function called with the stage and the tank's
+         name.
+        """
+        with brew_process.lock:
+            tank_name = allocate_tank(capability, quantity)
+            if tank_name:
+                grant(capability, tank_name)
+            else:
+                wait_for_tank(capability, quantity, waiter, grant)
+
+    def give_back_tank(self, tank_name: str):
+        """
+        This releases a tank no caller waits for any more. It runs in the
+        loop's executor.
+        :param tank_name: a string of the tank.
+        """
+        with brew_process.lock:
+            release_tank(tank_name)
+
+    def drop_waiter(self, waiter):
+        """
+        This takes a caller that stopped waiting out of the queues. It
+        runs in the loop's executor.
+        :param waiter: the caller's asyncio Future.
+        """
+        with brew_process.lock:
+            cancel_tank_wait(waiter)
+
+    async def run(self):
+        """
+        This evaluates the woken processes whenever the engine is woken
+        up, until it is cancelled. The evaluation blocks on the engine
+        lock, so it runs in the loop's executor.
+        """
+        self.loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        brew_process.process_listeners.append(self.on_process_event)
+        # the processes woken up before the engine started
+        self._wakeup.set()
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                try:
+                    await self.loop.run_in_executor(
+                        None, brew_process.process_pending_beers, 0)
+                except Exception as error:
+                    errorLogger.error("Failed to evaluate the brewing "
+                                      "processes: %s", error)
+        finally:
+            brew_process.process_listeners.remove(self.on_process_event)
+
+    async def create(self, gyle_no: int, beer_name: str,
+                     quantity: int) -> str:
+        """
+        This creates a brewing process.
+        :param gyle_no: an integer showing the batch number.
+        :param beer_name: a string representing the name of the beer.
+        :param quantity: an integer of the beer quantity.
+        :return: a string of the process key.
+        """
+        await self.loop.run_in_executor(
+            None, brew_process.create_process_for_beer, gyle_no, beer_name,
+            quantity)
+        return process_key(beer_name, gyle_no, quantity)
+
+    async def advance(self, gyle_no: int, beer_name: str,
+                      quantity: int) -> dict:
+        """
+        This moves a brewing process to its next state and waits until
+        the engine applied or rejected the move, including the time
+        spent waiting for a tank.
+        :param gyle_no: an integer of the batch number.
+        :param beer_name: a string containing the name of the beer.
+        :param quantity: an integer representing the quantity of the beer.
+        :return: a dictionary {"applied": bool, "state": str}, or None if
+         the process doesn't exist.
+        """
+        future = await self.loop.run_in_executor(
+            None, brew_process.move_process_to_next_state, gyle_no,
+            beer_name, quantity)
+        if future is None:
+            return None
+        return await asyncio.wrap_future(future)
+
+    async def remove(self, gyle_no: int, beer_name: str, quantity: int):
+        """
+        This removes a brewing process.
+        :param gyle_no: an integer of the batch number.
+        :param beer_name: a string containing the name of the beer.
+        :param quantity: an integer representing the quantity of the beer.
+        """
+        await self.loop.run_in_executor(
+            None, brew_process.remove_process_for_beer, gyle_no, beer_name,
+            quantity)
+
+    async def allocate(self, capability: str, quantity: int) -> str:
+        """
+        This allocates a tank, waiting for one to be released when none
+        is free. The caller is queued for the capability with the gyles
+        waiting for a tank, and is handed a released tank in turn.
+        :param capability: a string of the tank's capability.
+        :param quantity: an integer of the beer quantity.
+        :return: a string of the tank, or None for an unknown capability.
+        """
+        # the kettle and the bottling line are never waited for
+        if capability not in STAGE_CAPABILITIES:
+            return allocate_tank(capability, quantity)
+        waiter = self.loop.create_future()
+
+        def grant(stage: str, tank_name: str):
+            self.loop.call_soon_threadsafe(self.grant_tank, waiter,
+                                           tank_name)
+
+        try:
+            await self.loop.run_in_executor(None, self.take_tank, capability,
+                                            quantity, waiter, grant)
+            return await waiter
+        except asyncio.CancelledError:
+            # a tank granted to the cancelled waiter is given back by
+            # grant_tank
+            waiter.cancel()
+            self.loop.run_in_executor(None, self.drop_waiter, waiter)
+            raise
+
+    async def subscribe(self):
+        """
+        This yields the events of the brewing processes as they happen.
+        :return: an asynchronous iterator of dictionaries of the key,
+         state and event ("created", "state" or "removed").
+        """
+        queue = asyncio.Queue()
+        self._subscribers.add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._subscribers.discard(queue)
+
+    def start(self):
+        """
+        This starts the engine on an event loop in a daemon thread.
+        """
+        self.loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+        self._task = self.call(self.spawn())
+
+    async def spawn(self):
+        """
+        This starts the engine as a task of the loop.
+        :return: the asyncio Task running the engine.
+        """
+        return asyncio.ensure_future(self.run())
+
+    async def cancel(self):
+        """
+        This cancels the engine's task and waits until it stopped.
+        """
+        self._task.cancel()
+        with suppress(asyncio.CancelledError):
+            await self._task
+
+    def call(self, coroutine):
+        """
+        This runs a coroutine on the engine's loop from another thread.
+        :param coroutine: a coroutine of this engine.
+        :return: the result of the coroutine.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine,
+                                                self.loop).result()
+
+    def stop(self):
+        """
+        This stops the engine and its loop.
+        """
+        if self._thread is None:
+            return
+        self.call(self.cancel())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        self._thread = None
+
+
+engine = AsyncBrewEngine()
@@ -0,0 +1,127 @@
+"""
+This module is a program that restores a brewhouse from its system log:
+the tanks, the beer stock and the brewing processes journaled by
+brew_process and brew_process_dict. The app restores its own site from
+log/system.log, and a shard restores its site from the site's journal.
+"""
+import json
+import brew_process_dict
+from brew_logger import errorLogger
+from brew_process import restore_beer_process
+
+errorLogger = errorLogger()
+
+
+def get_json_from_last_prefix(fname: str, prefix_key: str):
+    """
+    This gets the last late in a file.
+    :param fname: a string informing the file name.
+    :param prefix_key: a string containing the prefix key.
+    :return:
+    """
+    errorLogger.debug("GET LAST LINE: %s", fname)
+    # check if the file exists
+    try:
+        file = open(fname, 'r')
+    except IOError:
+        errorLogger.error("Failed to to read log file %s", fname)
+        return None
+    else:
+        with file:
+            lines = file.read().splitlines()
+            if lines:
+                for line in range(len(lines), 1, -1):
+                    # using '@' as a key to split the string
+                    split_data = lines[line - 1].split("@")
+                    if split_data[1] == (prefix_key + " : "):
+                        if len(split_data) <= 1:
+                            errorLogger.error("Event(s) has not found "
+                                              "in the system log: "
+                                              "%s", line)
+                            return
+                        return parse_log_json(split_data[2])
+            return None
+
+
+def parse_log_json(data_line: str):
+    """
+    This parses the data of a system log line, written as a python
+     literal, as json.
+    :param data_line: a string of the data.
+    :return: the parsed data.
+    """
+    data_line = data_line.replace("\'", "\"")
+    data_line = data_line.replace("True", "true")
+    data_line = data_line.replace("False", "false")
+    return json.loads(data_line)
+
+
+def get_tanks_from_log(fname: str, tanks: dict):
+    """
+    This replays the tank records of a log file over some tanks. Each
+     record holds one tank that changed; a record of all the tanks, as
+     older logs have, replaces them.
+    :param fname: a string informing the file name.
+    :param tanks: a dictionary of the tanks, in the layout of TANKS.
+    :return tanks: a dictionary of the restored tanks, or None if the log
+     has no tank record.
+    """
+    errorLogger.debug("REPLAY TANKS: %s", fname)
+    try:
+        file = open(fname, 'r')
+    except IOError:
+        errorLogger.error("Failed to to read log file %s", fname)
+        return None
+    restored = dict(tanks)
+    found = False
+    with file:
+        for line in file:
+            split_data = line.rstrip("\n").split("@")
+            if len(split_data) == 4 and split_data[1] == "tank : ":
+                restored.update({split_data[2][:-len(" : ")]:
+                                 parse_log_json(split_data[3])})
+                found = True
+            elif len(split_data) == 3 and split_data[1] == "tanks : ":
+                restored = parse_log_json(split_data[2])
+                found = True
+    return restored if found else None
+
+
+def restore_brewhouse(fname: str, tanks: dict):
+    """
+    This restores the tanks, the stock and the brewing processes of a
+     brewhouse from its system log.
+    :param fname: a string informing the file name.
+    :param tanks: a dictionary of the tanks the tank records are
+     replayed over, in the layout of TANKS.
+    """
+    tanks = dict(tanks)
+    restored = get_tanks_from_log(fname, tanks)
+    stock = get_json_from_last_prefix(fname, "stock")
+    states = get_json_from_last_prefix(fname, "state")
+
+    # check if the log file is empty
+    if restored:
+        brew_process_dict.reset_tanks(restored)
+    else:
+        errorLogger.warning("System log doesn't the prefix key: "
+                            "tank.")
+        brew_process_dict.reset_tanks(tanks)
+
+    if stock:
+        for beer in stock:
+            brew_process_dict.update_beer_stock(beer, stock[beer])
+    else:
+        errorLogger.warning("System log doesn't the prefix key: "
+                            "stock.")
+
+    if states:
+        for state_data in states:
+            restore_beer_process(state_data["gyle"],
+                                 state_data["name"], state_data["qty"],
+                                 state_data["state"],
+                                 state_data["is_allocate"],
+                                 state_data["p_tank"])
+    else:
+        errorLogger.warning("System log doesn't the prefix key: "
+                            "state.")
@@ -1,14 +1,65 @@
 import os
 import logging.config
 import logging
+from threading import Lock
 
-# checks if the 'log' directory exists
-try:
-    os.mkdir("log")
-except:
-    print("")
+LOGGER_NAMES = ('BarnabysBrewhouseLogs', 'BarnabysBrewhouseEventsLog')
 
-logging.config.fileConfig('logging.conf', disable_existing_loggers=False)
+config_lock = Lock()
+config_state = {"configured": False}
+
+
+def configure_logging():
+    """
+    This creates the 'log' directory and configures the file handlers
+     from logging.conf, once. Entry points call it at startup, before
+     anything is logged.
+    """
+    with config_lock:
+        if config_state["configured"]:
+            return
+        config_state.update({"configured": True})
+        os.makedirs("log", exist_ok=True)
+        logging.config.fileConfig('logging.conf',
+                                  disable_existing_loggers=False)
+
+
+def site_journal(site: str) -> str:
+    """
+    This gets the file name of the journal of a shard's site.
+    :param site: a string of the site's name.
+    :return: a string of the file name.
+    """
+    return "log/system-" + site + ".log"
+
+
+def configure_site_logging(site: str):
+    """
+    This configures the logging of a shard process: the log records are
+     appended to the error log, and the journal goes to a file of the
+     site's own, so the sites' journals don't mix.
+    :param site: a string of the site's name.
+    """
+    with config_lock:
+        config_state.update({"configured": True})
+    os.makedirs("log", exist_ok=True)
+    formats = {LOGGER_NAMES[0]: ("log/error.log", "%(asctime)s - "
+                                 "%(name)s - %(levelname)s - %(message)s"),
+               LOGGER_NAMES[1]: (site_journal(site),
+                                 "%(asctime)s - %(message)s")}
+    for logger_name, (file_name, log_format) in formats.items():
+        handler = logging.FileHandler(file_name, 'a')
+        handler.setFormatter(logging.Formatter(log_format))
+        logging.getLogger(logger_name).handlers = [handler]
+
+
+# until an entry point calls configure_logging, or configure_site_logging
+# in a shard, the records are dropped, so importing a module doesn't
+# touch the file system; configuring replaces the NullHandler
+for logger_name in LOGGER_NAMES:
+    logging.getLogger(logger_name).setLevel(logging.DEBUG)
+    logging.getLogger(logger_name).propagate = False
+    logging.getLogger(logger_name).addHandler(logging.NullHandler())
 
 
 def errorLogger():
@@ -16,4 +67,4 @@ def errorLogger():
 
 
 def eventLogger():
-    return logging.getLogger('BarnabysBrewhouseEventsLog')
\ No newline at end of file
+    return logging.getLogger('BarnabysBrewhouseEventsLog')
@@ -0,0 +1,194 @@
+"""
+This module is a program that records the telemetry of the brew engine
+(histograms, counters and gauges) and renders it in the Prometheus text
+format. Recording a value costs a dictionary lookup, a bisect and two
+additions, so it stays on in production. The values are recorded by the
+engine under its lock. A snapshot of them is a plain dictionary, so the
+snapshots of the shard processes can be rendered with the local one,
+labelled by site.
+"""
+from bisect import bisect_left
+
+# the buckets, in seconds, of the histograms
+STATE_BUCKETS = (1, 10, 60, 600, 3600, 6 * 3600, 86400, 3 * 86400,
+                 7 * 86400, 14 * 86400, 28 * 86400)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 5, 60, 3600)
+TICK_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01,
+                0.05, 0.1, 0.5, 1)
+
+# every metric by name, in the order they are rendered
+METRICS = {}
+
+
+class Histogram(object):
+    """
+    This class contains the bucket counts and the sum of the observed
+    values for each value of a label.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, label: str,
+                 buckets: tuple):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, label_value: str, value: float):
+        """
+        This records a value.
+        :param label_value: a string of the label's value, such as the
+         state.
+        :param value: a float of the value, such as seconds.
+        """
+        series = self.series.get(label_value)
+        if series is None:
+            series = self.series.setdefault(
+                label_value, [[0] * (len(self.buckets) + 1), 0.0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def snapshot(self) -> dict:
+        """
+        This copies the recorded values.
+        :return: a dictionary {label value: (bucket counts, sum)}.
+        """
+        return {label_value: (list(counts), total) for label_value,
+                (counts, total) in list(self.series.items())}
+
+    def render(self, samples: dict, labels: str) -> list:
+        """
+        This renders the samples of a snapshot.
+        :param samples: a dictionary as returned by snapshot.
+        :param labels: a string of the other labels, such as 'site="x",'.
+        :return lines: a list of strings.
+        """
+        lines = []
+        for label_value, (counts, total) in sorted(samples.items()):
+            series = '{}{}="{}"'.format(labels, self.label, label_value)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                    self.name, series, bound, cumulative))
+            lines.append("{}_sum{{{}}} {}".format(self.name, series, total))
+            lines.append("{}_count{{{}}} {}".format(self.name, series,
+                                                    cumulative))
+        return lines
+
+
+class Counter(object):
+    """
+    This class contains a count for each value of a label.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, label: str):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.series = {}
+
+    def inc(self, label_value: str, amount: int = 1):
+        """
+        This adds to a count.
+        :param label_value: a string of the label's value.
+        :param amount: an integer to add.
+        """
+        self.series[label_value] = self.series.get(label_value, 0) + amount
+
+    def snapshot(self) -> dict:
+        """
+        This copies the counts.
+        :return: a dictionary {label value: count}.
+        """
+        return dict(self.series)
+
+    def render(self, samples: dict, labels: str) -> list:
+        """
+        This renders the samples of a snapshot.
+        :param samples: a dictionary as returned by snapshot.
+        :param labels: a string of the other labels.
+        :return: a list of strings.
+        """
+        return ['{}{{{}{}="{}"}} {}'.format(self.name, labels, self.label,
+                                            label_value, value)
+                for label_value, value in sorted(samples.items())]
+
+
+class Gauge(Counter):
+    """
+    This class contains a value for each value of a label, read from a
+    function when a snapshot is taken.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, label: str,
+                 read):
+        super().__init__(name, description, label)
+        self.read = read
+
+    def snapshot(self) -> dict:
+        """
+        This reads the current values.
+        :return: a dictionary {label value: value}.
+        """
+        return dict(self.read())
+
+
+def register(metric):
+    """
+    This registers a metric.
+    :param metric: a Histogram, Counter or Gauge.
+    :return metric: the metric.
+    """
+    METRICS.update({metric.name: metric})
+    return metric
+
+
+def snapshot() -> dict:
+    """
+    This copies the values of every metric.
+    :return: a dictionary {metric name: samples}.
+    """
+    return {name: metric.snapshot() for name, metric in METRICS.items()}
+
+
+def render(snapshots: dict) -> str:
+    """
+    This renders the snapshots of some sites in the Prometheus text
+    format.
+    :param snapshots: a dictionary {site: snapshot}.
+    :return: a string of the exposition.
+    """
+    lines = []
+    for name, metric in METRICS.items():
+        lines.append("# HELP {} {}".format(name, metric.description))
+        lines.append("# TYPE {} {}".format(name, metric.kind))
+        for site, samples in snapshots.items():
+            lines.extend(metric.render(samples.get(name, {}),
+                                       'site="{}",'.format(site)))
+    return "\n".join(lines) + "\n"
+
+
+time_in_state = register(Histogram(
+    "brew_time_in_state_seconds",
+    "Time a gyle spent in a state before leaving it.", "state",
+    STATE_BUCKETS))
+transition_latency = register(Histogram(
+    "brew_transition_latency_seconds",
+    "Time from a move being requested to the state change, including "
+    "the wait for a tank.", "state", LATENCY_BUCKETS))
+engine_tick = register(Histogram(
+    "brew_engine_tick_seconds",
+    "Time the engine took to evaluate the woken processes.", "engine",
+    TICK_BUCKETS))
+evaluations = register(Counter(
+    "brew_engine_evaluations_total",
+    "Evaluations of a process by the engine.", "engine"))
+allocation_failures = register(Counter(
+    "brew_tank_allocation_failures_total",
+    "Evaluations that found no free tank of a capability.",
+    "capability"))
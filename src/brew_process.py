@@ -2,36 +2,184 @@
 This module is a program that simulates brew process for a given gyle
 number, beer and quantity.
 """
-import time
-from threading import Lock
-from transitions import Machine
+from concurrent.futures import Future
+from threading import Condition, Lock, RLock
+from time import monotonic
 from brew_process_dict import allocate_tank, release_tank, \
-    tank_status, update_beer_stock, beer_stock_status
+    tank_status, update_beer_stock, beer_stock_status, \
+    STAGE_CAPABILITIES, tank_waiters, wait_for_tank, is_waiting_for_tank, \
+    cancel_tank_wait
 from brew_logger import errorLogger, eventLogger
-
-lock = Lock()
-beers_producer_queue = []
+from process_registry import ProcessRegistry, process_key
+from brew_metrics import Gauge, register, time_in_state, \
+    transition_latency, engine_tick, evaluations
+from status_snapshot import VersionedSnapshot
+import brew_process_dict
+
+# serialises the evaluation of the processes, which allocate and
+# release the tanks; re-entrant, as releasing a tank during a
+# transition wakes the waiters
+lock = RLock()
+# thread-safe on its own, so finding processes and counting their
+# states doesn't wait for the engine; creating, moving and removing
+# them take the lock, as the engine must not evaluate them meanwhile
+beers_producer_queue = ProcessRegistry()
+
+# the engine only evaluates the processes that were woken up: by a
+# new gyle, set_move_next, a state change or a tank handed over. The
+# queue has its own lock, always taken after the evaluation lock. The
+# processes waiting for a tank are queued in brew_process_dict.
+engine_wakeup = Condition(Lock())
+pending_processes = {}
+
+# the hours a gyle spends in a state once it holds the tank of its next
+# transition: the kettle in start, a fermenter in hot_brew, a
+# conditioner in fermentation and the bottling line in conditioning
+STAGE_HOURS = {"start": 8, "hot_brew": 7 * 24, "fermentation": 14 * 24,
+               "conditioning": 8}
+
+# set when a process took or was handed a tank, for the engine to journal
+# the processes once at the end of its pass, so a restored process holds
+# the tank the tank records hold for it. Guarded by the evaluation lock.
+allocations = {"journal": False}
+
+# functions called with a process and the event whenever a process is
+# "created", "woken" up, changes "state" or is "removed"
+process_listeners = []
 
 errorLogger = errorLogger()
 eventLogger = eventLogger()
 
 # InventoryManagement
+def advance_process(beer_obj) -> bool:
+    """
+    This evaluates the transition of a process from its current state.
+     The caller must hold the lock.
+    :param beer_obj: a BrewingProcess.
+    :return: True if the process changed state.
+    """
+    state = beer_obj.state
+    is_allocate = beer_obj.is_allocate
+    if state == "start":
+        beer_obj.hot_brew_process()
+    elif state == "hot_brew":
+        beer_obj.fermentation_process()
+    elif state == "fermentation":
+        beer_obj.conditioning_and_carbonation_process()
+    elif state == "conditioning":
+        beer_obj.bottling_and_labelling_process()
+    elif state == "bottling":
+        beer_obj.finish_process()
+    beers_producer_queue.update_state(beer_obj)
+    if beer_obj.state != state or beer_obj.is_allocate != is_allocate:
+        process_snapshot.invalidate()
+    settle_move(beer_obj, beer_obj.state != state)
+    if beer_obj.state != state:
+        notify_process_listeners(beer_obj, "state")
+    return beer_obj.state != state
+
+def notify_process_listeners(beer_obj, event: str):
+    """
+    This tells the process listeners about an event of a process.
+    :param beer_obj: a BrewingProcess.
+    :param event: a string of the event, "created", "woken", "state" or
+     "removed".
+    """
+    for listener in process_listeners:
+        listener(beer_obj, event)
+
+def settle_move(beer_obj, changed: bool):
+    """
+    This resolves the pending move of a process once the engine applied
+     it, or rejects it when the process has no next state. A move waiting
+     for a tank stays pending.
+    :param beer_obj: a BrewingProcess.
+    :param changed: True if the last evaluation changed the state.
+    """
+    future = beer_obj.move_future
+    if future is None or future.done():
+        return
+    if changed and not beer_obj.can_move_next:
+        future.set_result({"applied": True, "state": beer_obj.state})
+    elif beer_obj.state == "finish":
+        with beer_obj.lock:
+            beer_obj.can_move_next = False
+        future.set_result({"applied": False, "state": beer_obj.state})
+
 def start_process_for_beers():
     """
     This method starts the beer process.
     """
     with lock:
         for beer_obj in beers_producer_queue:
-            if beer_obj.state == "start":
-                beer_obj.hot_brew_process()
-            elif beer_obj.state == "hot_brew":
-                beer_obj.fermentation_process()
-            elif beer_obj.state == "fermentation":
-                beer_obj.conditioning_and_carbonation_process()
-            elif beer_obj.state == "conditioning":
-                beer_obj.bottling_and_labelling_process()
-            elif beer_obj.state == "bottling":
-                beer_obj.finish_process()
+            advance_process(beer_obj)
+
+def wake_process_for_beer(beer_obj):
+    """
+    This queues a process to be evaluated by the engine.
+    :param beer_obj: a BrewingProcess.
+    """
+    wake_processes_for_beers([beer_obj])
+
+def wake_processes_for_beers(beer_objs: list):
+    """
+    This queues processes to be evaluated by the engine, waking it up
+     once.
+    :param beer_objs: a list of BrewingProcess objects.
+    """
+    if not beer_objs:
+        return
+    with engine_wakeup:
+        pending_processes.update(dict.fromkeys(beer_objs, True))
+        engine_wakeup.notify()
+    for beer_obj in beer_objs:
+        notify_process_listeners(beer_obj, "woken")
+
+register(Gauge("brew_processes", "Gyles in each state.", "state",
+               lambda: beers_producer_queue.state_counts()))
+register(Gauge("brew_engine_queue_depth",
+               "Processes woken up and waiting for the engine, and "
+               "processes waiting for a tank.", "queue",
+               lambda: {"pending": len(pending_processes),
+                        "waiting_for_tank": sum(map(len,
+                                                    tank_waiters.values()))}))
+
+def process_pending_beers(timeout: float = None) -> int:
+    """
+    This waits until processes are woken up and evaluates them, and
+     evaluates again the ones that changed state, until none is left.
+    :param timeout: a float of the seconds to wait for a wake up, or
+     None to wait indefinitely.
+    :return evaluated: an integer of the number of evaluations.
+    """
+    evaluated = 0
+    with engine_wakeup:
+        if not pending_processes:
+            engine_wakeup.wait(timeout)
+    started = monotonic()
+    while True:
+        with engine_wakeup:
+            if not pending_processes:
+                break
+            beer_obj = next(iter(pending_processes))
+            del pending_processes[beer_obj]
+        if beer_obj not in beers_producer_queue:
+            continue
+        evaluated += 1
+        with lock:
+            changed = advance_process(beer_obj)
+        if changed:
+            with engine_wakeup:
+                pending_processes.update({beer_obj: True})
+    with lock:
+        journal = allocations["journal"]
+        allocations.update({"journal": False})
+    if journal:
+        eventLogger.critical("@state : @%s", store_beer_process_data())
+    if evaluated:
+        engine_tick.observe("engine", monotonic() - started)
+        evaluations.inc("engine", evaluated)
+    return evaluated
 
 def create_process_for_beer(gyle_no: int, beer_name: str,
                             quantity: int):
@@ -43,20 +191,37 @@ def create_process_for_beer(gyle_no: int, beer_name: str,
     """
     errorLogger.info("Creating a brewing process for a given batch of "
                      "beer.")
-    if not find_process_for_beer(gyle_no, beer_name, quantity):
-        with lock:
-            beers_producer_queue.append(BrewingProcess(gyle_no,
-                                                       beer_name,
-                                                       quantity,
-                                                       {},
-                                                       False,
-                                                       "start",
-                                                       "start"))
-            eventLogger.critical("@state : @%s",
-                                 store_beer_process_data())
-    else:
+    if not create_processes_for_beers([(gyle_no, beer_name, quantity)]):
         errorLogger.warning("Beer process already exists")
 
+def create_processes_for_beers(gyles: list) -> list:
+    """
+    This creates the brewing processes of many gyles at once, under one
+     acquisition of the lock, and journals them in one record.
+    :param gyles: a list of (gyle_no, beer_name, quantity) tuples.
+    :return created: a list of the created BrewingProcess objects; the
+     gyles that already exist are skipped.
+    """
+    errorLogger.info("Creating the brewing processes of %d gyles.",
+                     len(gyles))
+    created = []
+    with lock:
+        for gyle_no, beer_name, quantity in gyles:
+            beer_obj = BrewingProcess(gyle_no, beer_name, quantity, {},
+                                      False, "start", "start")
+            # adding is atomic, so two requests for the same gyle
+            # create one
+            if beers_producer_queue.add(beer_obj):
+                created.append(beer_obj)
+        if created:
+            process_snapshot.invalidate()
+    if created:
+        eventLogger.critical("@state : @%s", store_beer_process_data())
+        for beer_obj in created:
+            notify_process_listeners(beer_obj, "created")
+        wake_processes_for_beers(created)
+    return created
+
 def find_process_for_beer(gyle_no: int, beer_name: str, quantity: int):
     """
     This method finds the beer which is taking part in a process.
@@ -65,12 +230,25 @@ def find_process_for_beer(gyle_no: int, beer_name: str, quantity: int):
     :param quantity: an integer representing the quantity of the beer.
     """
     errorLogger.info("Finding a given beer from the brewing process.")
-    for beer_obj in beers_producer_queue:
-        if beer_obj.gyle_no == gyle_no and \
-                beer_obj.bear_name == beer_name and \
-                beer_obj.quantity == quantity:
-            return beer_obj
-    return None
+    return beers_producer_queue.get(process_key(beer_name, gyle_no,
+                                                quantity))
+
+def find_processes_in_state(state: str) -> list:
+    """
+    This finds the beers in a state of the brewing process, such as
+     every gyle in fermentation.
+    :param state: a string of the state.
+    :return: a list of the BrewingProcess objects.
+    """
+    return beers_producer_queue.in_state(state)
+
+def find_processes_for_beer(beer_name: str) -> list:
+    """
+    This finds every gyle of a beer in the brewing process.
+    :param beer_name: a string containing the name of the beer.
+    :return: a list of the BrewingProcess objects.
+    """
+    return beers_producer_queue.for_beer(beer_name)
 
 def move_process_to_next_state(gyle_no: int, beer_name: str,
                                quantity: int):
@@ -80,14 +258,62 @@ def move_process_to_next_state(gyle_no: int, beer_name: str,
     :param gyle_no: an integer of the batch number.
     :param beer_name: a string containing the name of the beer.
     :param quantity: an integer representing the quantity of the beer.
+    :return future: a Future resolving to {"applied": bool, "state":
+     str} once the engine applied or rejected the move, or None if the
+     process doesn't exist.
     """
     errorLogger.info("Moving a given beer in the brewing process to "
                      "the next stage.")
-    beer_obj = find_process_for_beer(gyle_no, beer_name, quantity)
-    if beer_obj:
-        beer_obj.set_move_next()
-        time.sleep(0.2)
-        eventLogger.critical("@state : @%s", store_beer_process_data())
+    return move_processes_to_next_state([(gyle_no, beer_name,
+                                          quantity)])[0]
+
+def move_processes_to_next_state(gyles: list) -> list:
+    """
+    This moves many gyles to their next state at once, under one
+     acquisition of the lock, and journals them in one record once every
+     move was settled.
+    :param gyles: a list of (gyle_no, beer_name, quantity) tuples.
+    :return futures: a list with, for each gyle, a Future resolving to
+     {"applied": bool, "state": str}, or None if the process doesn't
+     exist.
+    """
+    errorLogger.info("Moving %d gyles to their next stage.", len(gyles))
+    futures = []
+    moved = []
+    with lock:
+        for gyle_no, beer_name, quantity in gyles:
+            beer_obj = beers_producer_queue.get(
+                process_key(beer_name, gyle_no, quantity))
+            if beer_obj:
+                futures.append(beer_obj.request_move())
+                moved.append(beer_obj)
+            else:
+                futures.append(None)
+    log_moves([future for future in futures if future])
+    wake_processes_for_beers(moved)
+    return futures
+
+def log_moves(futures: list):
+    """
+    This journals the processes once every move of a batch was settled,
+     if any of them was applied.
+    :param futures: a list of the Futures of the moves.
+    """
+    remaining = {"moves": len(futures), "applied": False}
+    remaining_lock = Lock()
+
+    def settled(future: Future):
+        with remaining_lock:
+            remaining["moves"] -= 1
+            if not future.cancelled() and future.result()["applied"]:
+                remaining["applied"] = True
+            done = remaining["moves"] == 0 and remaining["applied"]
+        if done:
+            eventLogger.critical("@state : @%s",
+                                 store_beer_process_data())
+
+    for future in futures:
+        future.add_done_callback(settled)
 
 
 def remove_process_for_beer(gyle_no: int, beer_name: str,
@@ -100,32 +326,77 @@ def remove_process_for_beer(gyle_no: int, beer_name: str,
     :param quantity: an integer representing the quantity of the beer.
     """
     errorLogger.info("Removing a given beer in the brewing process.")
-    beer_obj = find_process_for_beer(gyle_no, beer_name, quantity)
-    if beer_obj:
-        beers_producer_queue.remove(beer_obj)
-        eventLogger.critical("@state : @%s", store_beer_process_data())
+    remove_processes_for_beers([(gyle_no, beer_name, quantity)])
+
+def remove_processes_for_beers(gyles: list) -> list:
+    """
+    This removes many gyles at once, under one acquisition of the lock,
+     and journals them in one record.
+    :param gyles: a list of (gyle_no, beer_name, quantity) tuples.
+    :return removed: a list of the removed BrewingProcess objects; the
+     gyles that don't exist are skipped.
+    """
+    errorLogger.info("Removing %d gyles from the brewing process.",
+                     len(gyles))
+    removed = []
+    with lock:
+        for gyle_no, beer_name, quantity in gyles:
+            beer_obj = beers_producer_queue.get(
+                process_key(beer_name, gyle_no, quantity))
+            if beer_obj and beers_producer_queue.remove(beer_obj):
+                removed.append(beer_obj)
+        with engine_wakeup:
+            for beer_obj in removed:
+                pending_processes.pop(beer_obj, None)
+        for beer_obj in removed:
+            cancel_tank_wait(beer_obj)
+        if removed:
+            process_snapshot.invalidate()
+    if not removed:
+        return removed
+    for beer_obj in removed:
+        with beer_obj.lock:
+            future = beer_obj.move_future
+            if future and not future.done():
+                future.set_result({"applied": False,
+                                   "state": beer_obj.state})
+        notify_process_listeners(beer_obj, "removed")
+    eventLogger.critical("@state : @%s", store_beer_process_data())
+    return removed
 
 
 def status_process_for_beer() -> dict:
     """
     This gets the status of the current beers in process.
+    :return: a read-only copy of the status, built again only after a
+     process changed.
     """
     errorLogger.info("Retrieving the status of a given beer in the "
                      "brewing process.")
-    with lock:
-        beer_queue = {}
-        for beer_obj in beers_producer_queue:
-            key = beer_obj.bear_name + ":" + str(beer_obj.gyle_no) + \
-                  ":" + str(beer_obj.quantity)
-            tmp = {key: {
-                "gyle_no": beer_obj.gyle_no,
-                "beer_name": beer_obj.bear_name,
-                "quantity": beer_obj.quantity,
-                "process_tank": beer_obj.process_tanks,
-                "is_allocate": beer_obj.is_allocate
-            }}
-            beer_queue.update(tmp)
-        return beer_queue
+    return process_snapshot.read()[1]
+
+def build_process_status() -> dict:
+    """
+    This builds the status of the current beers in process. The caller
+     must hold the lock.
+    :return beer_queue: a dictionary of the status of each process.
+    """
+    beer_queue = {}
+    for beer_obj in beers_producer_queue:
+        key = process_key(beer_obj.bear_name, beer_obj.gyle_no,
+                          beer_obj.quantity)
+        tmp = {key: {
+            "gyle_no": beer_obj.gyle_no,
+            "beer_name": beer_obj.bear_name,
+            "quantity": beer_obj.quantity,
+            "process_tank": beer_obj.process_tanks,
+            "is_allocate": beer_obj.is_allocate
+        }}
+        beer_queue.update(tmp)
+    return beer_queue
+
+# the copy of the status of the processes the routes and templates get
+process_snapshot = VersionedSnapshot(build_process_status, lock)
 
 def status_process_for_tank() -> dict:
     """
@@ -144,6 +415,17 @@ def status_process_for_beer_stock() -> dict:
                      "stock.")
     return beer_stock_status()
 
+def status_versions() -> dict:
+    """
+    This gets the versions of the status of the tanks, processes and
+     stock, which change whenever they do.
+    :return: a dictionary of the "tanks", "processes" and "stock"
+     versions.
+    """
+    return {"tanks": brew_process_dict.tank_snapshot.version,
+            "processes": process_snapshot.version,
+            "stock": brew_process_dict.stock_snapshot.version}
+
 def store_beer_process_data() -> list:
     """
     Storing beer process data
@@ -174,22 +456,89 @@ def restore_beer_process(gyle_no, beer_name, qty, p_state, is_allocate,
     state = p_state
     for p in p_tank:
         state = p
-    beers_producer_queue.append(BrewingProcess(gyle_no, beer_name, qty,
-                                               p_tank, is_allocate,
-                                               p_state, state))
+    beer_obj = BrewingProcess(gyle_no, beer_name, qty, p_tank,
+                              is_allocate, p_state, state)
+    if beers_producer_queue.add(beer_obj):
+        with lock:
+            process_snapshot.invalidate()
+        wake_process_for_beer(beer_obj)
+
+# (trigger, source, destination, conditions, after) of every transition;
+# a trigger tries its transitions in order and takes the first one whose
+# conditions hold. Leaving for 'incomplete' goes back to the source state
+# (see do_on_enter), so a failed condition leaves the state unchanged.
+TRANSITIONS = [
+    # Hot Brew
+    ("hot_brew_process", "start", "hot_brew",
+     ["has_cooks_ingredients_complete"],
+     ["cooks_ingredients_process_complete"]),
+    ("hot_brew_process", "start", "incomplete", [], []),
+    # Fermentation
+    ("fermentation_process", "hot_brew", "fermentation",
+     ["has_fermentation_complete"], ["fermentation_process_complete"]),
+    ("fermentation_process", "hot_brew", "incomplete", [], []),
+    # Conditioning
+    ("conditioning_and_carbonation_process", "fermentation",
+     "conditioning", ["has_conditioning_and_carbonation_complete"],
+     ["conditioning_and_carbonation_process_complete"]),
+    ("conditioning_and_carbonation_process", "fermentation",
+     "incomplete", [], []),
+    # Bottling
+    ("bottling_and_labelling_process", "conditioning", "bottling",
+     ["has_bottling_and_labelling_complete"],
+     ["bottling_and_labelling_process_complete"]),
+    ("bottling_and_labelling_process", "conditioning", "incomplete", [],
+     []),
+    ("finish_process", "bottling", "finish", [],
+     ["finish_process_complete"]),
+]
+
+# the states whose enter and exit callbacks are do_on_enter and
+# do_on_exit
+CALLBACK_STATES = ["start", "hot_brew", "fermentation", "conditioning",
+                   "bottling", "incomplete"]
+
+
+def compile_transitions(model_class, transitions: list) -> dict:
+    """
+    This compiles a transition table into the functions of a class, once
+     for every instance.
+    :param model_class: the class the callbacks are methods of.
+    :param transitions: a list of (trigger, source, destination,
+     conditions, after) tuples.
+    :return table: a dictionary {(trigger, source): [(destination,
+     condition functions, after functions)]}.
+    """
+    table = {}
+    for trigger, source, dest, conditions, after in transitions:
+        table.setdefault((trigger, source), []).append(
+            (dest, tuple(getattr(model_class, name) for name in conditions),
+             tuple(getattr(model_class, name) for name in after)))
+    return table
+
 
 class BrewingProcess(object):
     """
-    This class contain a state machine for the brew processes.
+    This class contain a state machine for the brew processes. The
+    transition table is compiled once and shared by every gyle, which
+    only holds its own attributes.
     """
     states = ["start", "hot_brew", "fermentation", "conditioning",
               "bottling", "finish", "incomplete"]
 
+    __slots__ = ("gyle_no", "bear_name", "quantity", "process_tanks",
+                 "can_move_next", "lock", "prev_state", "cur_state",
+                 "is_allocate", "state", "move_future", "entered_at",
+                 "move_requested_at")
+
+    # filled in by compile_transitions once the class is defined
+    table = {}
+    on_enter = {}
+    on_exit = {}
+
     # Initialize the state machine
     def __init__(self, gyle_no, beer_name, quantity, process_tanks,
                  is_allocate, p_state, c_state):
-        super(BrewingProcess)
-
         self.gyle_no = gyle_no
         self.bear_name = beer_name
         self.quantity = quantity
@@ -199,132 +548,96 @@ class BrewingProcess(object):
         self.prev_state = p_state
         self.cur_state = c_state
         self.is_allocate = is_allocate
+        self.state = p_state
+        self.move_future = None
+        self.entered_at = monotonic()
+        self.move_requested_at = None
+
+    def trigger(self, trigger: str) -> bool:
+        """
+        This fires a trigger from the current state: the source state's
+         exit callback, the state change, the destination state's enter
+         callback and the transition's after callbacks, in that order.
+         Triggers that don't apply to the current state are ignored.
+        :param trigger: a string of the trigger's name.
+        :return: True if a transition was taken.
+        """
+        for dest, conditions, after in \
+                self.table.get((trigger, self.state), ()):
+            if not all(condition(self) for condition in conditions):
+                continue
+            exit_callback = self.on_exit.get(self.state)
+            if exit_callback:
+                exit_callback(self)
+            self.state = dest
+            enter_callback = self.on_enter.get(dest)
+            if enter_callback:
+                enter_callback(self)
+            for callback in after:
+                callback(self)
+            return True
+        return False
+
+    def set_state(self, state: str):
+        """
+        This sets the state without any callback.
+        :param state: a string of the state.
+        """
+        self.state = state
+
+    def hot_brew_process(self) -> bool:
+        """
+        This fires the hot brew trigger.
+        """
+        return self.trigger("hot_brew_process")
 
-        self.machine = Machine(
-            model=self,
-            states=BrewingProcess.states,
-            initial=self.prev_state,
-            ignore_invalid_triggers=True,
-            auto_transitions=True,
-            # ordered_transitions=True
-        )
-
-        # Hot Brew
-        self.machine.add_transition(
-            trigger="hot_brew_process",
-            source="start",
-            dest="hot_brew",
-
-            # we check only enter 'hot_brew' state if the
-            # 'has_cooks_ingredients_complete' is competed
-
-            # otherwise we go to 'incomplete', as you can see in the
-            # next transition
-            conditions=['has_cooks_ingredients_complete'],
-            after="cooks_ingredients_process_complete",
-        )
-
-        self.machine.add_transition(
-            trigger='hot_brew_process',
-            source='start',
-            dest='incomplete',
-        )
-
-        # Fermentation
-        self.machine.add_transition(
-            trigger="fermentation_process",
-            source="hot_brew",
-            dest="fermentation",
-
-            # we check only enter 'fermentation' state if the
-            # 'has_fermentation_complete' is competed
-
-            # otherwise we go to 'incomplete', as you can see in the
-            # next transition
-            conditions=['has_fermentation_complete'],
-            after="fermentation_process_complete",
-        )
-
-        self.machine.add_transition(
-            trigger='fermentation_process',
-            source='hot_brew',
-            dest='incomplete',
-        )
-
-        # Conditioning
-        self.machine.add_transition(
-            trigger="conditioning_and_carbonation_process",
-            source="fermentation",
-            dest="conditioning",
-
-            # we check only enter 'conditioning' state if the
-            # 'has_conditioning_and_carbonation_complete' is completed
-
-            # otherwise we go to 'incomplete', as you can see in the
-            # next transition
-            conditions=['has_conditioning_and_carbonation_complete'],
-            after="conditioning_and_carbonation_process_complete"
-        )
-
-        self.machine.add_transition(
-            trigger='conditioning_and_carbonation_process',
-            source='fermentation',
-            dest='incomplete',
-        )
-
-        # Bottling
-        self.machine.add_transition(
-            trigger="bottling_and_labelling_process",
-            source="conditioning",
-            dest="bottling",
-
-            # we check only enter 'bottling' state if the
-            # 'has_bottling_and_labelling_complete' is completed
-
-            # otherwise we go to 'incomplete', as you can see in the
-            # next transition
-            conditions=['has_bottling_and_labelling_complete'],
-            after="bottling_and_labelling_process_complete"
-        )
-
-        self.machine.add_transition(
-            trigger='bottling_and_labelling_process',
-            source='conditioning',
-            dest='incomplete',
-        )
-
-        self.machine.add_transition(
-            trigger='finish_process',
-            source='bottling',
-            dest='finish',
-            after="finish_process_complete"
-        )
-
-        # we notify the states whenever we enter/exit each state,
-
-        # callbacks declared on the 'destination' state on
-        # 'add_transition'
-        self.machine.on_enter_start('do_on_enter')
-        self.machine.on_enter_hot_brew('do_on_enter')
-        self.machine.on_enter_fermentation('do_on_enter')
-        self.machine.on_enter_conditioning('do_on_enter')
-        self.machine.on_enter_bottling('do_on_enter')
-        self.machine.on_enter_incomplete('do_on_enter')
-
-        # callbacks declared on the 'source ' state on 'add_transition'
-        self.machine.on_exit_start('do_on_exit')
-        self.machine.on_exit_hot_brew('do_on_exit')
-        self.machine.on_exit_fermentation('do_on_exit')
-        self.machine.on_exit_conditioning('do_on_exit')
-        self.machine.on_exit_bottling('do_on_exit')
-        self.machine.on_exit_incomplete('do_on_exit')
-
-    def set_move_next(self):
+    def fermentation_process(self) -> bool:
+        """
+        This fires the fermentation trigger.
+        """
+        return self.trigger("fermentation_process")
+
+    def conditioning_and_carbonation_process(self) -> bool:
+        """
+        This fires the conditioning and carbonation trigger.
+        """
+        return self.trigger("conditioning_and_carbonation_process")
+
+    def bottling_and_labelling_process(self) -> bool:
+        """
+        This fires the bottling and labelling trigger.
+        """
+        return self.trigger("bottling_and_labelling_process")
+
+    def finish_process(self) -> bool:
+        """
+        This fires the finish trigger.
+        """
+        return self.trigger("finish_process")
+
+    def set_move_next(self) -> Future:
         """
         This method initialise move next.
+        :return move_future: a Future settled by the engine once the
+         move was applied or rejected, shared by the moves requested
+         before it is settled.
+        """
+        future = self.request_move()
+        wake_process_for_beer(self)
+        return future
+
+    def request_move(self) -> Future:
+        """
+        This requests a move without waking the engine up.
+        :return move_future: the Future of the move, as set_move_next.
         """
         with self.lock:
             self.can_move_next = True
+            if self.move_future is None or self.move_future.done():
+                self.move_future = Future()
+            if self.move_requested_at is None:
+                self.move_requested_at = monotonic()
+            return self.move_future
 
     def do_on_exit(self):
         """
@@ -338,9 +651,23 @@ class BrewingProcess(object):
         This does on enter.
         """
         if self.state == "incomplete":
-            self.machine.set_state(self.prev_state)
+            self.set_state(self.prev_state)
         else:
             self.cur_state = self.state
+            self.record_state_change()
+
+    def record_state_change(self):
+        """
+        This records the time spent in the previous state and, if a move
+         was requested, the time the move took.
+        """
+        now = monotonic()
+        time_in_state.observe(self.prev_state, now - self.entered_at)
+        self.entered_at = now
+        if self.move_requested_at is not None:
+            transition_latency.observe(self.state,
+                                       now - self.move_requested_at)
+            self.move_requested_at = None
 
     def check_state(self):
         """
@@ -351,18 +678,45 @@ class BrewingProcess(object):
                 self.can_move_next = False
                 return True
 
+    def allocate_stage_tank(self, stage: str) -> bool:
+        """
+        This allocates the tank of a stage, unless the process holds one
+         or waits for one. A process that finds no fermenter or
+         conditioner is queued and handed the next one released that
+         holds it, rather than trying again on every evaluation.
+        :param stage: a string of the stage, such as "fermentation".
+        :return is_allocate: True if the process holds the tank.
+        """
+        if not self.is_allocate and not is_waiting_for_tank(self):
+            tank_name = allocate_tank(stage, self.quantity)
+            if tank_name:
+                self.is_allocate = True
+                self.process_tanks.update({stage: {"tank_name": tank_name}})
+                allocations.update({"journal": True})
+            elif stage in STAGE_CAPABILITIES:
+                wait_for_tank(stage, self.quantity, self,
+                              self.tank_handed_over)
+        return self.is_allocate
+
+    def tank_handed_over(self, stage: str, tank_name: str):
+        """
+        This gives the process the tank released for it, and wakes it up.
+        :param stage: a string of the stage.
+        :param tank_name: a string of the tank's name.
+        """
+        self.is_allocate = True
+        self.process_tanks.update({stage: {"tank_name": tank_name}})
+        allocations.update({"journal": True})
+        process_snapshot.invalidate()
+        wake_process_for_beer(self)
+
     def has_cooks_ingredients_complete(self):
         """
         This checks if the cook ingredient has completed.
         """
         try:
-            if not self.is_allocate:
-                tank_name = allocate_tank("hot_brew", self.quantity)
-                if tank_name:
-                    self.is_allocate = True
-                    self.process_tanks.update(
-                        {"hot_brew": {"tank_name": tank_name}})
-            return self.is_allocate and self.check_state()
+            return self.allocate_stage_tank("hot_brew") and \
+                self.check_state()
         except:
             return False
 
@@ -377,14 +731,8 @@ class BrewingProcess(object):
         This checks if the fermentation process has completed.
         """
         try:
-            if not self.is_allocate:
-                tank_name = allocate_tank("fermentation",
-                                          self.quantity)
-                if tank_name:
-                    self.is_allocate = True
-                    self.process_tanks.update(
-                        {"fermentation": {"tank_name": tank_name}})
-            return self.is_allocate and self.check_state()
+            return self.allocate_stage_tank("fermentation") and \
+                self.check_state()
         except:
             return False
 
@@ -401,14 +749,8 @@ class BrewingProcess(object):
          completed.
         """
         try:
-            if not self.is_allocate:
-                tank_name = allocate_tank("conditioning",
-                                          self.quantity)
-                if tank_name:
-                    self.is_allocate = True
-                    self.process_tanks.update(
-                        {"conditioning": {"tank_name": tank_name}})
-            return self.is_allocate and self.check_state()
+            return self.allocate_stage_tank("conditioning") and \
+                self.check_state()
         except:
             return False
 
@@ -425,13 +767,8 @@ class BrewingProcess(object):
          completed.
         """
         try:
-            if not self.is_allocate:
-                tank_name = allocate_tank("bottling", self.quantity)
-                if tank_name:
-                    self.is_allocate = True
-                    self.process_tanks.update(
-                        {"bottling": {"tank_name": tank_name}})
-            return self.is_allocate and self.check_state()
+            return self.allocate_stage_tank("bottling") and \
+                self.check_state()
         except:
             return False
 
@@ -448,3 +785,11 @@ class BrewingProcess(object):
         """
         self.process_tanks.update({"finish": {"tank_name": 'Empty'}})
         update_beer_stock(self.bear_name, self.quantity)
+        self.record_state_change()
+
+
+BrewingProcess.table = compile_transitions(BrewingProcess, TRANSITIONS)
+BrewingProcess.on_enter = {state: BrewingProcess.do_on_enter
+                           for state in CALLBACK_STATES}
+BrewingProcess.on_exit = {state: BrewingProcess.do_on_exit
+                          for state in CALLBACK_STATES}
@@ -4,10 +4,32 @@ as allocating and releasing tanks. Also, storing each tanks
 specification.
 """
 from brew_logger import errorLogger, eventLogger
+from brew_metrics import allocation_failures
+from tank_pool import TankPool
+from status_snapshot import VersionedSnapshot
 
 errorLogger = errorLogger()
 eventLogger = eventLogger()
 
+# functions called with the tank's name whenever a tank is released
+tank_listeners = []
+
+# the capability of the tanks a stage is brewed in, for the stages that
+# share the fermenters and conditioners
+STAGE_CAPABILITIES = {"fermentation": "fermenter",
+                      "conditioning": "conditioner"}
+
+# the litres of tank a unit of beer quantity takes
+VOLUME_PER_UNIT = 0.5
+
+# the gyles waiting for a tank, by capability, in the order they came:
+# {capability: {waiter: (volume, stage, grant)}}. A released tank is
+# offered to the conditioner waiters first, so the gyles in flight finish
+# before new ones take the shared tanks, and then goes to the gyle it
+# suits best. The caller must hold the engine lock.
+HANDOVER_ORDER = ("conditioner", "fermenter")
+tank_waiters = {capability: {} for capability in HANDOVER_ORDER}
+
 def update_tank_used_capacity(tank_name: str, volume: int):
     """
     This method updates the used_capacity in the TANKS dictionary.
@@ -16,14 +38,17 @@ def update_tank_used_capacity(tank_name: str, volume: int):
     """
     errorLogger.info("Updating the used capacity in the TANKS "
                      "dictionary.")
-    TANKS.update({
-        tank_name: {
-            "volume": TANKS[tank_name]["volume"],
-            "capability": TANKS[tank_name]["capability"],
-            "used_capacity": volume
-        }
-    })
-    eventLogger.critical("@tanks : @%s", TANKS)
+    TANKS[tank_name]["used_capacity"] = volume
+    journal_tank(tank_name)
+    tank_snapshot.publish_item(tank_name, TANKS[tank_name])
+
+def journal_tank(tank_name: str):
+    """
+    This writes the specification of a tank that changed to the system
+     log, for restore_from_log to apply over the other tanks.
+    :param tank_name: a string containing the name of the tank.
+    """
+    eventLogger.critical("@tank : @%s : @%s", tank_name, TANKS[tank_name])
 
 def get_tank_for_capability(capability: str, volume: int) -> str:
     """
@@ -34,13 +59,10 @@ def get_tank_for_capability(capability: str, volume: int) -> str:
     """
     errorLogger.info("Getting a tank that is compatible with the "
                      "capability.")
-    for tank in TANKS:
-        if capability in TANKS[tank]["capability"]:
-            if volume <= TANKS[tank]["volume"] and \
-                    TANKS[tank]["used_capacity"] == 0:
-                update_tank_used_capacity(tank, volume)
-                return tank
-    return None
+    tank = tank_pool.take(capability, volume)
+    if tank is not None:
+        update_tank_used_capacity(tank, volume)
+    return tank
 
 def allocate_tank(capability: str, quantity: int) -> str:
     """
@@ -50,41 +72,129 @@ def allocate_tank(capability: str, quantity: int) -> str:
     :return: a string of the tank.
     """
     errorLogger.info("Allocating a tank.")
-    volume = quantity * 0.5
+    volume = quantity * VOLUME_PER_UNIT
+    tank = None
     if capability == "hot_brew":
-        return "Kettle"
-    elif capability == "fermentation":
-        return get_tank_for_capability("fermenter", volume)
-    elif capability == "conditioning":
-        return get_tank_for_capability("conditioner", volume)
+        tank = "Kettle"
+    elif capability in STAGE_CAPABILITIES:
+        tank = get_tank_for_capability(STAGE_CAPABILITIES[capability],
+                                       volume)
     elif capability == "bottling":
-        return "bottling"
-    return None
+        tank = "bottling"
+    if tank is None:
+        allocation_failures.inc(capability)
+    return tank
+
+def wait_for_tank(stage: str, quantity: int, waiter, grant):
+    """
+    This queues a gyle that found no free tank, instead of it trying
+     again on every evaluation.
+    :param stage: a string of the stage, "fermentation" or
+     "conditioning".
+    :param quantity: an integer of the beer quantity.
+    :param waiter: the hashable gyle waiting, such as a BrewingProcess.
+    :param grant: a function called with the stage and the tank's name
+     when a released tank is handed to the gyle.
+    """
+    tank_waiters[STAGE_CAPABILITIES[stage]].update(
+        {waiter: (quantity * VOLUME_PER_UNIT, stage, grant)})
+
+def is_waiting_for_tank(waiter) -> bool:
+    """
+    This checks that a gyle is queued for a tank.
+    :param waiter: the gyle.
+    :return: True if the gyle is waiting.
+    """
+    return any(waiter in queue for queue in tank_waiters.values())
+
+def cancel_tank_wait(waiter):
+    """
+    This takes a gyle out of the queues, such as when it is removed.
+    :param waiter: the gyle.
+    """
+    for queue in tank_waiters.values():
+        queue.pop(waiter, None)
+
+def count_tanks_fitting(capability: str, volume: float,
+                        other_than: str) -> int:
+    """
+    This counts the other tanks of a capability big enough for a volume,
+     free or not.
+    :param capability: a string of the tank's capability.
+    :param volume: the litres the gyle takes.
+    :param other_than: a string of the tank's name left out.
+    :return: an integer of the tanks.
+    """
+    return sum(1 for name, spec in TANKS.items()
+               if name != other_than and capability in spec["capability"]
+               and volume <= spec["volume"])
+
+def hand_over_tank(tank: str) -> bool:
+    """
+    This hands a released tank to the waiting gyle it suits best: the one
+     the fewest other tanks hold, then the one it fits the tightest, then
+     the one that waited longest. A gyle too big for the tank is skipped.
+    :param tank: a string of the tank's name.
+    :return: True if a gyle took the tank.
+    """
+    spec = TANKS[tank]
+    for capability in HANDOVER_ORDER:
+        if capability not in spec["capability"]:
+            continue
+        queue = tank_waiters[capability]
+        fitting = [(count_tanks_fitting(capability, volume, tank),
+                    spec["volume"] - volume, order, waiter)
+                   for order, (waiter, (volume, _, _))
+                   in enumerate(queue.items())
+                   if volume <= spec["volume"]]
+        if fitting:
+            waiter = min(fitting)[3]
+            volume, stage, grant = queue.pop(waiter)
+            update_tank_used_capacity(tank, volume)
+            grant(stage, tank)
+            return True
+    return False
 
 def release_tank(tank: str):
     """
-    This allow to release tank.
+    This allow to release tank. The tank goes straight to the next
+     waiting gyle it holds, or else back to the free pool.
     :param tank: a string representing the tank's name.
     :return: boolean
     """
     errorLogger.info("Releasing a tank.")
-    TANKS.update({
-        tank: {
-            "volume": TANKS[tank]["volume"],
-            "capability": TANKS[tank]["capability"],
-            "used_capacity": 0
-        }
-    })
-    eventLogger.critical("@tanks : @%s", TANKS)
+    TANKS[tank]["used_capacity"] = 0
+    if not tank_pool.is_free(tank):
+        if not hand_over_tank(tank):
+            tank_pool.give(tank)
+    journal_tank(tank)
+    tank_snapshot.publish_item(tank, TANKS[tank])
+    for listener in tank_listeners:
+        listener(tank)
     return True
 
+def reset_tanks(tanks: dict):
+    """
+    This replaces the tanks, such as with the ones restored from the
+     log, and builds the free pools again.
+    :param tanks: a dictionary of the tanks, in the layout of TANKS.
+    """
+    errorLogger.info("Resetting the tanks.")
+    TANKS.clear()
+    TANKS.update({tank: {"volume": spec["volume"],
+                         "capability": list(spec["capability"]),
+                         "used_capacity": spec["used_capacity"]}
+                  for tank, spec in tanks.items()})
+    tank_pool.rebuild()
+    tank_snapshot.publish(TANKS)
+
 def tank_status() -> dict:
     """
     Gets the TANKS' status.
-    :return: a dictionary of the TANKS.
+    :return: a read-only copy of the TANKS, as last published.
     """
     errorLogger.info("Getting the tanks' status.")
-    return TANKS
+    return tank_snapshot.read()[1]
 
 TANKS = {
     "Gertrude": {
@@ -134,7 +244,15 @@ TANKS = {
     }
 }
 
+# the free tanks of each capability, ordered by volume
+tank_pool = TankPool(TANKS)
+# the copies of the tanks and the stock the status reads get, published
+# whenever they change
+tank_snapshot = VersionedSnapshot()
+tank_snapshot.publish(TANKS)
+
 beer_stock = {}
+stock_snapshot = VersionedSnapshot()
 
 def update_beer_stock(beer_name: str, quantity: int):
     """
@@ -152,11 +270,22 @@ def update_beer_stock(beer_name: str, quantity: int):
         temp = quantity
     beer_stock.update({beer_name: temp})
     eventLogger.critical("@stock : @%s", beer_stock)
+    stock_snapshot.publish(beer_stock)
+
+def reset_beer_stock(stock: dict):
+    """
+    This replaces the beer stock, such as after a simulation.
+    :param stock: a dictionary of the quantity of each beer.
+    """
+    errorLogger.info("Resetting the beer stock.")
+    beer_stock.clear()
+    beer_stock.update(stock)
+    stock_snapshot.publish(beer_stock)
 
 def beer_stock_status():
     """
     Getting the beer stock status.
-    :return beer_stock: a dictionary of the beer stock.
+    :return: a read-only copy of the beer stock, as last published.
     """
     errorLogger.info("Retrieving the status of the beer stock.")
-    return beer_stock
+    return stock_snapshot.read()[1]
@@ -0,0 +1,271 @@
+"""
+This module is a program that plans the production of a quarter. It
+splits the quantity of every beer still to brew, month by month, into
+gyles that fit the tanks, and gives each gyle a fermenter and a
+conditioner over time, the gyles due first brewed first. The plan is a
+brew calendar of every gyle and every tank, in hours from its start,
+and is rendered as Gantt json for the app. Each gyle is placed once, on
+the tanks that free up first, so a quarter of the brewhouse is planned
+in milliseconds and can be planned again on every request.
+"""
+import math
+from datetime import datetime, timedelta
+from time import monotonic
+import brew_process
+from brew_process import STAGE_HOURS as STATE_HOURS
+from brew_process_dict import STAGE_CAPABILITIES, VOLUME_PER_UNIT
+from sales_predictor import predict_month_beer_qty, period_name
+
+# the stage that follows each state, run in the tank the state holds
+NEXT_STAGE = {"start": "hot_brew", "hot_brew": "fermentation",
+              "fermentation": "conditioning", "conditioning": "bottling"}
+
+# the hours of each stage, as the simulator runs them: the brew in the
+# kettle, then fermentation, conditioning and bottling
+STAGE_HOURS = {NEXT_STAGE[state]: hours for state, hours in
+               STATE_HOURS.items()}
+
+# the months planned, from the current one
+HORIZON_MONTHS = 3
+
+
+def gyle_quantity(tanks: dict, stage_hours: dict = STAGE_HOURS) -> int:
+    """
+    This gets the gyle quantity that brews the most litres per hour. A
+    big gyle fills a big tank, but fits in fewer of them.
+    :param tanks: a dictionary of the tanks, in the layout of TANKS.
+    :param stage_hours: a dictionary of the hours of each stage.
+    :return quantity: an integer of the quantity of a gyle.
+    :raises ValueError: if the tanks have no fermenter or no
+     conditioner, so no gyle can be brewed.
+    """
+    best, quantity = 0.0, 0
+    for volume in sorted({spec["volume"] for spec in tanks.values()}):
+        # the litres per hour of the slowest of the tank stages
+        rate = min(sum(volume for spec in tanks.values()
+                       if capability in spec["capability"] and
+                       spec["volume"] >= volume) / stage_hours[stage]
+                   for stage, capability in STAGE_CAPABILITIES.items())
+        if rate > best:
+            best, quantity = rate, int(volume / VOLUME_PER_UNIT)
+    if quantity <= 0:
+        raise ValueError("No gyle fits the tanks: a fermenter and a "
+                         "conditioner are needed.")
+    return quantity
+
+
+def split_gyles(horizons: list, quantity: int,
+                gyle_numbers: dict = None) -> list:
+    """
+    This splits the quantities of every horizon into gyles of at most a
+    quantity, of even sizes. The gyles of a horizon take turns between
+    the beers.
+    :param horizons: a list of (due, {beer: quantity}) tuples, with due
+     the hours from the start of the plan, in order.
+    :param quantity: an integer of the largest quantity of a gyle.
+    :param gyle_numbers: a dictionary of the last gyle number of each
+     beer.
+    :return gyles: a list of dictionaries of the "beer_name", "gyle_no",
+     "quantity" and "due" of each gyle, in the order to brew them.
+    :raises ValueError: if the quantity isn't positive.
+    """
+    if quantity <= 0:
+        raise ValueError("The gyle quantity must be positive, not "
+                         "{}.".format(quantity))
+    numbers = dict(gyle_numbers or {})
+    gyles = []
+    for due, quantities in horizons:
+        batches = []
+        for beer, total in quantities.items():
+            if total <= 0:
+                continue
+            count = math.ceil(total / quantity)
+            batches.append([(beer, total // count + (index < total % count))
+                            for index in range(count)])
+        for turn in range(max(map(len, batches), default=0)):
+            for batch in batches:
+                if turn < len(batch):
+                    beer, gyle_qty = batch[turn]
+                    numbers.update({beer: numbers.get(beer, 0) + 1})
+                    gyles.append({"beer_name": beer,
+                                  "gyle_no": numbers[beer],
+                                  "quantity": gyle_qty, "due": due})
+    return gyles
+
+
+def schedule(horizons: list, tanks: dict, stage_hours: dict = STAGE_HOURS,
+             quantity: int = None, busy_until: dict = None,
+             gyle_numbers: dict = None) -> dict:
+    """
+    This plans the gyles of some horizons on the tanks. Each gyle starts
+    fermenting as soon as a fermenter is free and a conditioner is free
+    once it has fermented, and takes the smallest of those tanks that
+    holds it, and of those the least versatile. The kettle and the
+    bottling line take any number of gyles, as in the engine.
+    :param horizons: a list of (due, {beer: quantity}) tuples, with due
+     the hours from the start of the plan, in order.
+    :param tanks: a dictionary of the tanks, in the layout of TANKS.
+    :param stage_hours: a dictionary of the hours of each stage.
+    :param quantity: an integer of the largest quantity of a gyle, by
+     default the gyle_quantity of the tanks.
+    :param busy_until: a dictionary of the hour each busy tank is free.
+    :param gyle_numbers: a dictionary of the last gyle number of each
+     beer.
+    :return plan: a dictionary of the "gyles", each with its "stages",
+     the "tanks", each with the stages it runs, the gyles "unscheduled"
+     as no tank holds them, and the "end" of the plan, in hours.
+    :raises ValueError: if no gyle fits the tanks.
+    """
+    quantity = quantity or gyle_quantity(tanks, stage_hours)
+    free_at = {tank: 0.0 for tank in tanks}
+    free_at.update(busy_until or {})
+    order = {tank: index for index, tank in enumerate(tanks)}
+    capable = {stage: [tank for tank, spec in tanks.items()
+                       if capability in spec["capability"]]
+               for stage, capability in STAGE_CAPABILITIES.items()}
+    brew, ferment, condition, bottle = (stage_hours[stage] for stage in
+                                        ("hot_brew", "fermentation",
+                                         "conditioning", "bottling"))
+    plan = {"gyles": [], "tanks": {tank: [] for tank in tanks},
+            "unscheduled": [], "end": 0.0}
+
+    def fit(tank: str) -> tuple:
+        return (tanks[tank]["volume"], len(tanks[tank]["capability"]),
+                order[tank])
+
+    for gyle in split_gyles(horizons, quantity, gyle_numbers):
+        volume = gyle["quantity"] * VOLUME_PER_UNIT
+        fermenters = [tank for tank in capable["fermentation"]
+                      if tanks[tank]["volume"] >= volume]
+        conditioners = [tank for tank in capable["conditioning"]
+                        if tanks[tank]["volume"] >= volume]
+        if not fermenters or not conditioners:
+            plan["unscheduled"].append(gyle)
+            continue
+        start = max(brew, min(free_at[tank] for tank in fermenters),
+                    min(free_at[tank] for tank in conditioners) - ferment)
+        fermenter = min((tank for tank in fermenters
+                         if free_at[tank] <= start), key=fit)
+        conditioner = min((tank for tank in conditioners
+                           if free_at[tank] <= start + ferment), key=fit)
+        free_at.update({fermenter: start + ferment})
+        free_at.update({conditioner: start + ferment + condition})
+        stages = [("hot_brew", "Kettle", start - brew, start),
+                  ("fermentation", fermenter, start, start + ferment),
+                  ("conditioning", conditioner, start + ferment,
+                   start + ferment + condition),
+                  ("bottling", "bottling", start + ferment + condition,
+                   start + ferment + condition + bottle)]
+        gyle.update({"stages": [{"stage": stage, "tank": tank,
+                                 "start": begin, "end": end}
+                                for stage, tank, begin, end in stages],
+                     "late": stages[-1][3] > gyle["due"]})
+        plan["gyles"].append(gyle)
+        for stage, tank, begin, end in stages[1:3]:
+            plan["tanks"][tank].append({"beer_name": gyle["beer_name"],
+                                        "gyle_no": gyle["gyle_no"],
+                                        "stage": stage, "start": begin,
+                                        "end": end})
+        plan["end"] = max(plan["end"], stages[-1][3])
+    return plan
+
+
+def gantt(plan: dict, start: datetime) -> dict:
+    """
+    This dates the hours of a plan.
+    :param plan: a dictionary as returned by schedule.
+    :param start: a datetime of the start of the plan.
+    :return: a dictionary of the plan, with its "start" and every hour
+     as an ISO 8601 string.
+    """
+    def date(hours: float) -> str:
+        return (start + timedelta(hours=hours)).isoformat(timespec="minutes")
+
+    def dated(bar: dict) -> dict:
+        return dict(bar, start=date(bar["start"]), end=date(bar["end"]))
+
+    return {"start": date(0), "end": date(plan["end"]),
+            "gyles": [dict(gyle, due=date(gyle["due"]),
+                           stages=[dated(bar) for bar in gyle["stages"]])
+                      for gyle in plan["gyles"]],
+            "tanks": {tank: [dated(bar) for bar in bars]
+                      for tank, bars in plan["tanks"].items()},
+            "unscheduled": [dict(gyle, due=date(gyle["due"]))
+                            for gyle in plan["unscheduled"]]}
+
+
+def monthly_horizons(start: datetime, remaining: dict) -> list:
+    """
+    This gets the predicted sales of the current month and the next
+    ones, each due at the end of its month. What was already brewed of
+    the recommended sales comes off the earliest months.
+    :param start: a datetime of the start of the plan.
+    :param remaining: a dictionary of the recommended sales still to
+     brew, such as the app's recommended_sales.
+    :return horizons: a list of (due, {beer: quantity}) tuples.
+    """
+    months = []
+    first = datetime(start.year, start.month, 1)
+    for _ in range(HORIZON_MONTHS):
+        following = (first + timedelta(days=32)).replace(day=1)
+        months.append((first.month, (following - start).total_seconds()
+                       / 3600))
+        first = following
+    predictions = [predict_month_beer_qty(period_name("month", month))
+                   for month, _ in months]
+    brewed = {beer: max(0, sum(prediction.get(beer, 0)
+                               for prediction in predictions) - quantity)
+              for beer, quantity in remaining.items()}
+    horizons = []
+    for (_, due), prediction in zip(months, predictions):
+        quantities = {}
+        for beer in remaining:
+            taken = min(prediction.get(beer, 0), brewed[beer])
+            brewed[beer] -= taken
+            quantities.update({beer: prediction.get(beer, 0) - taken})
+        horizons.append((due, quantities))
+    return horizons
+
+
+def busy_tanks(stage_hours: dict = STAGE_HOURS) -> dict:
+    """
+    This estimates when the tanks held by the gyles in the brewhouse are
+    free, from the time each gyle has been in its state. A tank in use
+    by no gyle is taken to be free after the longest tank stage. The
+    caller must hold the engine lock.
+    :param stage_hours: a dictionary of the hours of each stage.
+    :return busy_until: a dictionary of the hour each busy tank is free.
+    """
+    now = monotonic()
+    busy_until = {tank: max(stage_hours[stage] for stage in
+                            STAGE_CAPABILITIES)
+                  for tank, spec in brew_process.tank_status().items()
+                  if spec["used_capacity"]}
+    for beer_obj in brew_process.beers_producer_queue:
+        stage = NEXT_STAGE.get(beer_obj.state)
+        if stage in STAGE_CAPABILITIES and beer_obj.is_allocate:
+            tank = beer_obj.process_tanks[stage]["tank_name"]
+            busy_until.update({tank: max(0.0, stage_hours[stage] -
+                                         (now - beer_obj.entered_at) / 3600)})
+    return busy_until
+
+
+def plan_production(remaining: dict, gyle_numbers: dict,
+                    start: datetime) -> dict:
+    """
+    This plans the recommended sales still to brew on the tanks of the
+    brewhouse, after the gyles in it.
+    :param remaining: a dictionary of the recommended sales still to
+     brew.
+    :param gyle_numbers: a dictionary of the last gyle number of each
+     beer.
+    :param start: a datetime of the start of the plan, such as now.
+    :return: a dictionary of the dated plan, as returned by gantt.
+    """
+    with brew_process.lock:
+        tanks = {tank: dict(spec) for tank, spec in
+                 brew_process.tank_status().items()}
+        busy_until = busy_tanks()
+    plan = schedule(monthly_horizons(start, remaining), tanks,
+                    busy_until=busy_until, gyle_numbers=gyle_numbers)
+    return gantt(plan, start)
@@ -0,0 +1,256 @@
+"""
+This module is a program that runs every brewhouse site as a shard. A
+shard owns its site's processes, tanks, stock, lock and engine thread.
+The site served by the app's own engine is a LocalShard. Every other
+site runs in a process of its own, where the module state of brew_process
+and brew_process_dict is that site's alone, so the sites run in parallel
+on as many cores. The shards take the same batch operations, so the app
+routes an operation to a site without knowing where the site runs.
+"""
+from concurrent.futures import wait
+import multiprocessing
+from threading import Event, Lock, Thread
+import brew_metrics
+import brew_process
+from brew_journal import restore_brewhouse
+from brew_logger import errorLogger, configure_site_logging, site_journal
+from process_registry import process_key
+
+# the name of the site served by the app's own engine
+LOCAL_SITE = "barnabys"
+
+# the tanks of the sites run as shard processes, by site name, in the
+# layout of brew_process_dict.TANKS
+SITES = {}
+
+# the seconds a batch of moves waits for the engine to settle them. The
+# engine is woken by a move and applies it within a cycle, well under
+# this; a move still pending after it is waiting for a tank, and its
+# completion is reported by the status and the process events
+MOVE_TIMEOUT = 0.05
+
+errorLogger = errorLogger()
+
+
+def keys_of(beer_objs: list) -> list:
+    """
+    This gets the keys of brewing processes.
+    :param beer_objs: a list of BrewingProcess objects.
+    :return: a list of strings of the keys.
+    """
+    return [process_key(beer_obj.bear_name, beer_obj.gyle_no,
+                        beer_obj.quantity) for beer_obj in beer_objs]
+
+
+def create_gyles(gyles: list) -> list:
+    """
+    This creates the brewing processes of a batch of gyles.
+    :param gyles: a list of (gyle_no, beer_name, quantity) tuples.
+    :return: a list of the keys created.
+    """
+    return keys_of(brew_process.create_processes_for_beers(gyles))
+
+
+def move_gyles(gyles: list, timeout: float = MOVE_TIMEOUT) -> list:
+    """
+    This moves a batch of gyles to their next state and waits for the
+    engine to settle the moves.
+    :param gyles: a list of (gyle_no, beer_name, quantity) tuples.
+    :param timeout: a float of the seconds to wait.
+    :return results: a list with, for each gyle, {"applied": bool,
+     "state": str}, {"pending": True} for a move waiting for a tank, or
+     None for a gyle that doesn't exist.
+    """
+    futures = brew_process.move_processes_to_next_state(gyles)
+    wait([future for future in futures if future], timeout=timeout)
+    results = []
+    for future in futures:
+        if future is None:
+            results.append(None)
+        elif future.done():
+            results.append(future.result())
+        else:
+            results.append({"pending": True})
+    return results
+
+
+def remove_gyles(gyles: list) -> list:
+    """
+    This removes a batch of gyles.
+    :param gyles: a list of (gyle_no, beer_name, quantity) tuples.
+    :return: a list of the keys removed.
+    """
+    return keys_of(brew_process.remove_processes_for_beers(gyles))
+
+
+def site_status() -> dict:
+    """
+    This gets the status of the site's tanks, processes and stock.
+    :return: a dictionary of the read-only "tanks", "processes" and
+     "stock".
+    """
+    return {"tanks": brew_process.status_process_for_tank(),
+            "processes": brew_process.status_process_for_beer(),
+            "stock": brew_process.status_process_for_beer_stock()}
+
+
+# the operations a shard takes, by name
+OPERATIONS = {"create": create_gyles, "move": move_gyles,
+              "remove": remove_gyles, "status": site_status,
+              "versions": brew_process.status_versions,
+              "metrics": brew_metrics.snapshot}
+
+
+class LocalShard(object):
+    """
+    This class contains the site served by the engine of this process.
+    """
+
+    def __init__(self, site: str):
+        self.site = site
+
+    def call(self, operation: str, *args):
+        """
+        This runs an operation on the site.
+        :param operation: a string of the operation's name.
+        :param args: the arguments of the operation.
+        :return: the result of the operation.
+        """
+        return OPERATIONS[operation](*args)
+
+    def stop(self):
+        """
+        This does nothing, the engine of this process isn't the shard's.
+        """
+
+
+def drive_engine(stopping: Event):
+    """
+    This evaluates the woken processes of the shard until it is stopping.
+    The processes woken up by then are evaluated first, so the journal
+    has their last records when the shard exits.
+    :param stopping: an Event set, under the engine_wakeup condition, to
+     stop the engine.
+    """
+    wakeup = brew_process.engine_wakeup
+    while True:
+        with wakeup:
+            while not (brew_process.pending_processes or
+                       stopping.is_set()):
+                wakeup.wait()
+            if not brew_process.pending_processes:
+                return
+        try:
+            brew_process.process_pending_beers(0)
+        except Exception as error:
+            errorLogger.error("Failed to evaluate the brewing processes: "
+                              "%s", error)
+
+
+def run_shard(site: str, tanks: dict, connection):
+    """
+    This runs a site in a shard process: it takes the site's tanks,
+    restores the site from its journal, so a restarted shard carries on
+    where it stopped, starts the engine thread and runs the operations
+    received on the connection until it receives None. The engine then
+    finishes the processes woken up, and stops.
+    :param site: a string of the site's name.
+    :param tanks: a dictionary of the site's tanks.
+    :param connection: the shard's end of a multiprocessing Pipe.
+    """
+    configure_site_logging(site)
+    restore_brewhouse(site_journal(site),
+                      {tank: dict(spec, used_capacity=0)
+                       for tank, spec in tanks.items()})
+    stopping = Event()
+    engine_thread = Thread(target=drive_engine, args=(stopping,),
+                           daemon=True)
+    engine_thread.start()
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        operation, args = message
+        try:
+            connection.send(("ok", OPERATIONS[operation](*args)))
+        except Exception as error:
+            errorLogger.error("Failed to run %s on %s: %s", operation,
+                              site, error)
+            connection.send(("error", repr(error)))
+    with brew_process.engine_wakeup:
+        stopping.set()
+        brew_process.engine_wakeup.notify_all()
+    engine_thread.join()
+    connection.close()
+
+
+class BrewShard(object):
+    """
+    This class contains a site running in a shard process, and the
+    connection the operations are sent on. The operations of a shard are
+    run one at a time; different shards run in parallel.
+    """
+
+    def __init__(self, site: str, tanks: dict):
+        self.site = site
+        self.tanks = tanks
+        self._lock = Lock()
+        self._connection = None
+        self._process = None
+
+    def start(self):
+        """
+        This starts the shard process.
+        """
+        # spawned, so the shard doesn't inherit the parent's processes
+        # or engine
+        context = multiprocessing.get_context("spawn")
+        self._connection, shard_connection = context.Pipe()
+        self._process = context.Process(
+            target=run_shard, args=(self.site, self.tanks,
+                                    shard_connection),
+            name="shard-" + self.site, daemon=True)
+        self._process.start()
+        shard_connection.close()
+
+    def call(self, operation: str, *args):
+        """
+        This runs an operation in the shard process.
+        :param operation: a string of the operation's name.
+        :param args: the arguments of the operation.
+        :return: the result of the operation.
+        :raises RuntimeError: if the operation failed in the shard.
+        """
+        with self._lock:
+            self._connection.send((operation, args))
+            status, result = self._connection.recv()
+        if status == "error":
+            raise RuntimeError("{} failed on {}: {}".format(
+                operation, self.site, result))
+        return result
+
+    def stop(self):
+        """
+        This stops the shard process.
+        """
+        if self._process is None:
+            return
+        with self._lock:
+            self._connection.send(None)
+            self._process.join()
+            self._connection.close()
+        self._process = None
+
+
+def start_shards(sites: dict) -> dict:
+    """
+    This starts a shard process for every site.
+    :param sites: a dictionary of the tanks of each site.
+    :return shards: a dictionary of the BrewShard of each site.
+    """
+    shards = {}
+    for site, tanks in sites.items():
+        shard = BrewShard(site, tanks)
+        shard.start()
+        shards.update({site: shard})
+    return shards
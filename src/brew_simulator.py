@@ -0,0 +1,306 @@
+"""
+This module is a program that simulates the brewhouse under load. It
+runs on a virtual clock. Synthetic gyles, drawn from the recipes and
+gyle quantities of the sales csv file, arrive at a fixed interval and go
+through start, hot_brew, fermentation, conditioning, bottling and finish
+on the real engine, with the real tank allocation, in a process of its
+own, so the brewhouse it is called from isn't touched. It reports the
+engine evaluations per second, the utilisation of each tank, the
+queueing delay of each stage and the wall time per simulated day. Use it
+to size the brewery or to catch performance regressions in the engine.
+
+    python brew_simulator.py [--gyles N] [--interval HOURS] [--seed S]
+"""
+import argparse
+import heapq
+import itertools
+import multiprocessing
+import random
+import time
+import brew_process
+import brew_process_dict
+from brew_process import STAGE_HOURS
+from brew_process_dict import VOLUME_PER_UNIT
+from sales_ingest import read_rows, parse_row
+
+SALES_CSV_FILE = "Barnabys_sales_fabriacted_data.csv"
+
+# the capabilities of the tanks
+TANK_CAPABILITIES = ("fermenter", "conditioner")
+
+
+def read_recipes(file_name: str = SALES_CSV_FILE) -> list:
+    """
+    This reads the recipe and total quantity of every gyle sold.
+    :param file_name: a string of the sales csv file.
+    :return: a list of (recipe, quantity) tuples in order of gyle.
+    """
+    gyles = {}
+    with open(file_name, newline="", encoding="utf-8-sig") as csvfile:
+        for row in read_rows(csvfile):
+            parsed = parse_row(row)
+            if parsed is None:
+                continue
+            _, recipe, gyle, quantity = parsed
+            gyles[(recipe, gyle)] = gyles.get((recipe, gyle), 0) + quantity
+    return [(recipe, quantity) for (recipe, _), quantity in gyles.items()]
+
+
+def fits_tanks(quantity: int) -> bool:
+    """
+    This checks that a gyle fits in a tank of every capability.
+    :param quantity: an integer of the gyle quantity.
+    :return: True if the gyle can ever be allocated.
+    """
+    tanks = brew_process_dict.TANKS.values()
+    return all(any(capability in tank["capability"] and
+                   quantity * VOLUME_PER_UNIT <= tank["volume"]
+                   for tank in tanks)
+               for capability in TANK_CAPABILITIES)
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    This gets a percentile of some values.
+    :param values: a list of numbers.
+    :param fraction: a float between 0 and 1.
+    :return: a float of the percentile, or 0 if there are no values.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return float(values[min(len(values) - 1, int(fraction * len(values)))])
+
+
+class VirtualClock(object):
+    """
+    This class contains the simulated time, in hours, and the events
+    scheduled to happen at a later time.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self._events = []
+        self._sequence = itertools.count()
+
+    def schedule(self, delay: float, callback, *args):
+        """
+        This schedules a callback.
+        :param delay: a float of the hours from now.
+        :param callback: a function to call.
+        :param args: the arguments of the callback.
+        """
+        heapq.heappush(self._events, (self.now + delay,
+                                      next(self._sequence), callback,
+                                      args))
+
+    def step(self) -> bool:
+        """
+        This moves the clock on to the next event and runs it.
+        :return: False if there was no event left.
+        """
+        if not self._events:
+            return False
+        self.now, _, callback, args = heapq.heappop(self._events)
+        callback(*args)
+        return True
+
+
+class BrewSimulation(object):
+    """
+    This class contains the state of a simulation: the clock, the gyles
+    in flight and the measurements.
+    """
+
+    def __init__(self, recipes: list, gyles: int, interval: float,
+                 seed: int = 0):
+        self.clock = VirtualClock()
+        self.random = random.Random(seed)
+        self.recipes = [recipe for recipe in recipes if fits_tanks(recipe[1])]
+        self.gyles = gyles
+        self.interval = interval
+        self.evaluations = 0
+        self.engine_seconds = 0.0
+        self.finished = 0
+        self.entered = {}
+        self.started = {}
+        self.touched = {}
+        self.delays = {state: [] for state in STAGE_HOURS}
+        self.busy_since = {}
+        self.busy_hours = {tank: 0.0 for tank in brew_process_dict.TANKS}
+
+    def on_process_event(self, beer_obj, event: str):
+        """
+        This notes the processes that changed state or were woken up.
+        :param beer_obj: a BrewingProcess.
+        :param event: a string of the event.
+        """
+        if event == "state":
+            self.entered.update({beer_obj: self.clock.now})
+        if event in ("state", "woken"):
+            self.touched.update({beer_obj: True})
+
+    def arrive(self, gyle_no: int):
+        """
+        This creates a gyle and schedules the next arrival.
+        :param gyle_no: an integer of the synthetic gyle number.
+        """
+        recipe, quantity = self.random.choice(self.recipes)
+        brew_process.create_process_for_beer(gyle_no, recipe, quantity)
+        beer_obj = brew_process.find_process_for_beer(gyle_no, recipe,
+                                                      quantity)
+        self.entered.update({beer_obj: self.clock.now})
+        if gyle_no + 1 < self.gyles:
+            self.clock.schedule(self.interval, self.arrive, gyle_no + 1)
+
+    def complete(self, beer_obj):
+        """
+        This moves a gyle on once the work of its state is done.
+        :param beer_obj: a BrewingProcess.
+        """
+        brew_process.move_process_to_next_state(
+            beer_obj.gyle_no, beer_obj.bear_name, beer_obj.quantity)
+
+    def settle(self):
+        """
+        This runs the engine on the woken processes and starts the work
+        of the gyles that got the tank of their state.
+        """
+        started = time.perf_counter()
+        self.evaluations += brew_process.process_pending_beers(0)
+        self.engine_seconds += time.perf_counter() - started
+        touched, self.touched = self.touched, {}
+        for beer_obj in touched:
+            state = beer_obj.state
+            if state == "finish":
+                self.finished += 1
+                self.started.pop(beer_obj, None)
+                self.entered.pop(beer_obj, None)
+                brew_process.remove_process_for_beer(
+                    beer_obj.gyle_no, beer_obj.bear_name, beer_obj.quantity)
+            elif state in STAGE_HOURS and beer_obj.is_allocate and \
+                    self.started.get(beer_obj) != state:
+                self.started.update({beer_obj: state})
+                self.delays[state].append(self.clock.now -
+                                          self.entered[beer_obj])
+                self.clock.schedule(STAGE_HOURS[state], self.complete,
+                                    beer_obj)
+        for tank, spec in brew_process_dict.TANKS.items():
+            busy = spec["used_capacity"] != 0
+            if busy and tank not in self.busy_since:
+                self.busy_since.update({tank: self.clock.now})
+            elif not busy and tank in self.busy_since:
+                self.busy_hours[tank] += self.clock.now - \
+                    self.busy_since.pop(tank)
+
+    def run(self) -> dict:
+        """
+        This runs the simulation until every gyle finished or no event
+        is left.
+        :return report: a dictionary of the measurements.
+        """
+        if self.gyles and self.recipes:
+            self.clock.schedule(0, self.arrive, 0)
+        started = time.perf_counter()
+        while self.clock.step():
+            self.settle()
+        wall = time.perf_counter() - started
+        hours = self.clock.now
+        days = hours / 24
+        return {
+            "gyles": self.gyles,
+            "finished": self.finished,
+            "simulated_days": days,
+            "wall_seconds": wall,
+            "wall_seconds_per_day": wall / days if days else 0.0,
+            "evaluations": self.evaluations,
+            "evaluations_per_second":
+                self.evaluations / self.engine_seconds
+                if self.engine_seconds else 0.0,
+            "utilisation": {tank: busy / hours if hours else 0.0
+                            for tank, busy in self.busy_hours.items()},
+            "queueing_hours": {state: {"mean": sum(delays) / len(delays)
+                                       if delays else 0.0,
+                                       "p95": percentile(delays, 0.95),
+                                       "max": max(delays, default=0.0)}
+                               for state, delays in self.delays.items()},
+        }
+
+
+def run_simulation(tanks: dict, recipes: list, gyles: int,
+                   interval: float, seed: int) -> dict:
+    """
+    This runs a simulation in the process of its own simulate started,
+    on the given tanks.
+    :param tanks: a dictionary of the tanks, in the layout of TANKS.
+    :param recipes: a list of (recipe, quantity) tuples.
+    :param gyles: an integer of the number of gyles.
+    :param interval: a float of the hours between two arrivals.
+    :param seed: an integer seeding the draw of the recipes.
+    :return: a dictionary of the measurements.
+    """
+    brew_process_dict.reset_tanks(tanks)
+    simulation = BrewSimulation(recipes, gyles, interval, seed)
+    brew_process.process_listeners.append(simulation.on_process_event)
+    # the logs and the journal aren't part of the engine's throughput
+    for logger in (brew_process.errorLogger, brew_process.eventLogger,
+                   brew_process_dict.errorLogger,
+                   brew_process_dict.eventLogger):
+        logger.disabled = True
+    return simulation.run()
+
+
+def simulate(gyles: int, interval: float, seed: int = 0,
+             recipes: list = None) -> dict:
+    """
+    This runs a simulation on empty tanks of the brewhouse's layout, in
+    a process of its own, like a shard. The registry, the tanks, the
+    gyles waiting for them, the stock, the logs and the engine of the
+    caller are its own, so a running app carries on undisturbed.
+    :param gyles: an integer of the number of gyles.
+    :param interval: a float of the hours between two arrivals.
+    :param seed: an integer seeding the draw of the recipes.
+    :param recipes: a list of (recipe, quantity) tuples, by default the
+     gyles of the sales csv file.
+    :return: a dictionary of the measurements.
+    """
+    with brew_process.lock:
+        tanks = {tank: dict(spec, used_capacity=0) for tank, spec in
+                 brew_process_dict.TANKS.items()}
+    # spawned, so the simulation doesn't inherit the caller's processes
+    # or engine
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1) as pool:
+        return pool.apply(run_simulation, (tanks, recipes or read_recipes(),
+                                           gyles, interval, seed))
+
+
+def main():
+    """
+    This runs the simulation and prints its report.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--gyles", type=int, default=1000)
+    parser.add_argument("--interval", type=float, default=24.0,
+                        help="hours between two gyles")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    report = simulate(args.gyles, args.interval, args.seed)
+    print("{} of {} gyles finished in {:.1f} simulated days".format(
+        report["finished"], report["gyles"], report["simulated_days"]))
+    print("{:<24} {:12.0f}".format("evaluations/s",
+                                   report["evaluations_per_second"]))
+    print("{:<24} {:12.3f} ms".format(
+        "wall time/simulated day", report["wall_seconds_per_day"] * 1e3))
+    print("queueing delay (hours)   {:>8} {:>8} {:>8}".format(
+        "mean", "p95", "max"))
+    for state, delay in report["queueing_hours"].items():
+        print("  {:<22} {:8.1f} {:8.1f} {:8.1f}".format(
+            state, delay["mean"], delay["p95"], delay["max"]))
+    print("tank utilisation")
+    for tank, utilisation in report["utilisation"].items():
+        print("  {:<22} {:8.1%}".format(tank, utilisation))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+This module is a program that benchmarks decoding the Date Required
+column of the sales csv file with the cached date decoder of
+sales_ingest against the datetime.strptime path it replaced.
+
+    python date_benchmark.py [--repeat N]
+"""
+import argparse
+from datetime import datetime
+import timeit
+import sales_ingest
+
+SALES_CSV_FILE = "Barnabys_sales_fabriacted_data.csv"
+
+
+def read_dates(file_name: str) -> list:
+    """
+    This reads the Date Required column of a sales csv file.
+    :param file_name: a string with the csv file name.
+    :return: a list of the date strings.
+    """
+    with open(file_name, 'rt', newline='') as csvfile:
+        return [row[sales_ingest.DATE_COLUMN]
+                for row in sales_ingest.read_rows(csvfile)]
+
+
+def strptime_dates(dates: list) -> list:
+    """
+    This decodes the dates the way the ingestion used to.
+    :param dates: a list of the date strings.
+    :return: a list of the date ordinals.
+    """
+    return [datetime.strptime(text.strip(), sales_ingest.DATE_FORMAT)
+            .toordinal() for text in dates]
+
+
+def decoder_dates(dates: list) -> list:
+    """
+    This decodes the dates with a cold date cache.
+    :param dates: a list of the date strings.
+    :return: a list of the date ordinals.
+    """
+    sales_ingest.date_cache.clear()
+    return [sales_ingest.decode_date(text) for text in dates]
+
+
+def main():
+    """
+    This runs the benchmark and prints the best time per date.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--file", default=SALES_CSV_FILE)
+    args = parser.parse_args()
+    dates = read_dates(args.file)
+    if strptime_dates(dates) != decoder_dates(dates):
+        raise SystemExit("The decoder disagrees with strptime.")
+    print("{} dates, {} distinct".format(len(dates), len(set(dates))))
+    results = {}
+    for name, function in (("strptime", strptime_dates),
+                           ("decode_date", decoder_dates)):
+        best = min(timeit.repeat(lambda: function(dates), number=1,
+                                 repeat=args.repeat))
+        results.update({name: best})
+        print("{:<12} {:8.3f} us/date".format(name,
+                                              best / len(dates) * 1e6))
+    print("speed up     {:8.1f}x".format(results["strptime"] /
+                                         results["decode_date"]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""
+This module is a program that benchmarks constructing brewing
+processes: the time to build a gyle and the memory each gyle holds.
+
+    python process_benchmark.py [--gyles N]
+"""
+import argparse
+import time
+import tracemalloc
+from brew_process import BrewingProcess
+
+
+def build(gyles: int) -> list:
+    """
+    This builds brewing processes.
+    :param gyles: an integer of the number of gyles.
+    :return: a list of BrewingProcess objects.
+    """
+    return [BrewingProcess(gyle, "Organic Dunkel", 1000, {}, False,
+                           "start", "start") for gyle in range(gyles)]
+
+
+def main():
+    """
+    This runs the benchmark and prints the time and bytes per gyle.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--gyles", type=int, default=10000)
+    args = parser.parse_args()
+    build(100)
+    started = time.perf_counter()
+    build(args.gyles)
+    seconds = time.perf_counter() - started
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    processes = build(args.gyles)
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print("{} gyles".format(len(processes)))
+    print("{:<16} {:10.2f} us/gyle".format("construction",
+                                           seconds / args.gyles * 1e6))
+    print("{:<16} {:10.0f} bytes/gyle".format(
+        "memory", (after - before) / args.gyles))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+This module is a program that indexes the brewing processes by their
+"beer:gyle:quantity" key, the key the dashboard and the routes already
+use, with secondary indexes by state and by beer. Finding, adding and
+removing a process, and listing the processes in a state or of a beer,
+don't scan the queue. The registry is split into lock stripes by key,
+so threads working on different gyles rarely wait for each other.
+"""
+from itertools import count
+from threading import Lock
+
+STRIPES = 16
+
+
+def process_key(beer_name: str, gyle_no: int, quantity: int) -> str:
+    """
+    This formats the key of a brewing process.
+    :param beer_name: a string containing the name of the beer.
+    :param gyle_no: an integer of the batch number.
+    :param quantity: an integer representing the quantity of the beer.
+    :return: a string such as "Organic Dunkel:42:100".
+    """
+    return beer_name + ":" + str(gyle_no) + ":" + str(quantity)
+
+
+class RegistryStripe(object):
+    """
+    This class contains the processes of one stripe of the registry and
+    the lock guarding them.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.processes = {}
+        self.states = {}
+        self.by_state = {}
+        self.by_beer = {}
+
+
+class ProcessRegistry(object):
+    """
+    This class contains the brewing processes by key, by state and by
+    beer, and iterates them in insertion order. The state of a process
+    is read from its state attribute; update_state must be called
+    whenever it changes. Every method is thread-safe.
+    """
+
+    def __init__(self, stripes: int = STRIPES):
+        self._stripes = [RegistryStripe() for _ in range(stripes)]
+        self._sequence = count()
+
+    @staticmethod
+    def key_of(beer_obj) -> str:
+        """
+        This gets the key of a brewing process.
+        :param beer_obj: a BrewingProcess.
+        :return: a string of the key.
+        """
+        return process_key(beer_obj.bear_name, beer_obj.gyle_no,
+                           beer_obj.quantity)
+
+    def stripe(self, key: str) -> RegistryStripe:
+        """
+        This gets the stripe of a key.
+        :param key: a string of the key.
+        :return: a RegistryStripe.
+        """
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def ordered(self, entries: list) -> list:
+        """
+        This sorts (sequence, process) entries into insertion order.
+        :param entries: a list of (sequence, BrewingProcess) tuples.
+        :return: a list of the BrewingProcess objects.
+        """
+        return [beer_obj for _, beer_obj in sorted(entries,
+                                                   key=lambda e: e[0])]
+
+    def __len__(self):
+        return sum(len(stripe.processes) for stripe in self._stripes)
+
+    def __iter__(self):
+        entries = []
+        for stripe in self._stripes:
+            # an empty stripe is skipped without taking its lock
+            if stripe.processes:
+                with stripe.lock:
+                    entries.extend(stripe.processes.values())
+        return iter(self.ordered(entries))
+
+    def __contains__(self, beer_obj):
+        key = self.key_of(beer_obj)
+        stripe = self.stripe(key)
+        with stripe.lock:
+            entry = stripe.processes.get(key)
+        return entry is not None and entry[1] is beer_obj
+
+    def get(self, key: str):
+        """
+        This gets a brewing process by its key.
+        :param key: a string of the key.
+        :return: the BrewingProcess, or None.
+        """
+        stripe = self.stripe(key)
+        with stripe.lock:
+            entry = stripe.processes.get(key)
+        return entry[1] if entry else None
+
+    def add(self, beer_obj) -> bool:
+        """
+        This adds a brewing process unless one with the same key exists.
+        :param beer_obj: a BrewingProcess.
+        :return: False if a process with the same key already exists.
+        """
+        key = self.key_of(beer_obj)
+        stripe = self.stripe(key)
+        with stripe.lock:
+            if key in stripe.processes:
+                return False
+            entry = (next(self._sequence), beer_obj)
+            stripe.processes.update({key: entry})
+            stripe.states.update({key: beer_obj.state})
+            stripe.by_state.setdefault(beer_obj.state, {}).update(
+                {key: entry})
+            stripe.by_beer.setdefault(beer_obj.bear_name, {}).update(
+                {key: entry})
+        return True
+
+    def remove(self, beer_obj) -> bool:
+        """
+        This removes a brewing process.
+        :param beer_obj: a BrewingProcess.
+        :return: False if the process wasn't in the registry.
+        """
+        key = self.key_of(beer_obj)
+        stripe = self.stripe(key)
+        with stripe.lock:
+            entry = stripe.processes.get(key)
+            if entry is None or entry[1] is not beer_obj:
+                return False
+            del stripe.processes[key]
+            stripe.by_state[stripe.states.pop(key)].pop(key)
+            stripe.by_beer[beer_obj.bear_name].pop(key)
+        return True
+
+    def update_state(self, beer_obj):
+        """
+        This moves a brewing process to the index of its current state.
+        :param beer_obj: a BrewingProcess.
+        """
+        key = self.key_of(beer_obj)
+        stripe = self.stripe(key)
+        with stripe.lock:
+            entry = stripe.processes.get(key)
+            if entry is None or entry[1] is not beer_obj:
+                return
+            previous = stripe.states[key]
+            if previous == beer_obj.state:
+                return
+            stripe.by_state[previous].pop(key)
+            stripe.states.update({key: beer_obj.state})
+            stripe.by_state.setdefault(beer_obj.state, {}).update(
+                {key: entry})
+
+    def in_state(self, state: str) -> list:
+        """
+        This gets the brewing processes in a state.
+        :param state: a string of the state, such as "fermentation".
+        :return: a list of the BrewingProcess objects.
+        """
+        entries = []
+        for stripe in self._stripes:
+            if stripe.processes:
+                with stripe.lock:
+                    entries.extend(stripe.by_state.get(state, {}).values())
+        return self.ordered(entries)
+
+    def state_counts(self) -> dict:
+        """
+        This counts the brewing processes in each state.
+        :return counts: a dictionary {state: number of processes}.
+        """
+        counts = {}
+        for stripe in self._stripes:
+            with stripe.lock:
+                for state, processes in stripe.by_state.items():
+                    counts[state] = counts.get(state, 0) + len(processes)
+        return counts
+
+    def for_beer(self, beer_name: str) -> list:
+        """
+        This gets the brewing processes of a beer.
+        :param beer_name: a string containing the name of the beer.
+        :return: a list of the BrewingProcess objects.
+        """
+        entries = []
+        for stripe in self._stripes:
+            if stripe.processes:
+                with stripe.lock:
+                    entries.extend(
+                        stripe.by_beer.get(beer_name, {}).values())
+        return self.ordered(entries)
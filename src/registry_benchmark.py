@@ -0,0 +1,95 @@
+"""
+This module is a program that stress tests the process registry: worker
+threads create, find, move and remove their own gyles while the engine
+thread evaluates them, and the throughput is printed for each worker
+count, with the registry striped and with a single stripe. Every
+created gyle must be found and removed, so a lost update fails the run.
+
+    python registry_benchmark.py [--gyles N] [--workers 1,2,4,8]
+"""
+import argparse
+import threading
+import time
+import brew_process
+from process_registry import ProcessRegistry, STRIPES
+
+
+def work(worker: int, gyles: int, lost: list):
+    """
+    This creates, finds, moves and removes the gyles of a worker.
+    :param worker: an integer of the worker's number.
+    :param gyles: an integer of the number of gyles of the worker.
+    :param lost: a list the lost gyles are appended to.
+    """
+    for gyle in range(gyles):
+        key = (worker * gyles + gyle, "Organic Dunkel", 100)
+        brew_process.create_process_for_beer(*key)
+        if brew_process.find_process_for_beer(*key) is None:
+            lost.append(key)
+            continue
+        brew_process.move_process_to_next_state(*key)
+        brew_process.remove_process_for_beer(*key)
+        if brew_process.find_process_for_beer(*key) is not None:
+            lost.append(key)
+
+
+def run(workers: int, gyles: int, stripes: int) -> float:
+    """
+    This runs the workers against a new registry with the engine thread
+    evaluating the woken up gyles.
+    :param workers: an integer of the number of worker threads.
+    :param gyles: an integer of the number of gyles per worker.
+    :param stripes: an integer of the number of lock stripes.
+    :return: a float of the gyles handled per second.
+    """
+    brew_process.beers_producer_queue = ProcessRegistry(stripes)
+    stopped = threading.Event()
+    lost = []
+
+    def engine():
+        while not stopped.is_set():
+            brew_process.process_pending_beers(0.01)
+
+    threads = [threading.Thread(target=work, args=(worker, gyles, lost))
+               for worker in range(workers)]
+    engine_thread = threading.Thread(target=engine, daemon=True)
+    engine_thread.start()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    stopped.set()
+    engine_thread.join()
+    if lost or len(brew_process.beers_producer_queue):
+        raise SystemExit("lost updates: {} gyles, {} left".format(
+            len(lost), len(brew_process.beers_producer_queue)))
+    return workers * gyles / seconds
+
+
+def main():
+    """
+    This runs the benchmark and prints the gyles per second.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--gyles", type=int, default=2000,
+                        help="gyles per worker")
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs per worker count, the best is kept")
+    args = parser.parse_args()
+    # the logs and the journal aren't part of the registry's throughput
+    brew_process.errorLogger.disabled = True
+    brew_process.eventLogger.disabled = True
+    print("{:>8} {:>14} {:>14}".format("workers", "striped/s",
+                                       "single/s"))
+    for workers in [int(count) for count in args.workers.split(",")]:
+        print("{:>8} {:>14.0f} {:>14.0f}".format(
+            workers, *[max(run(workers, args.gyles, stripes)
+                           for _ in range(args.repeat))
+                       for stripes in (STRIPES, 1)]))
+
+
+if __name__ == '__main__':
+    main()
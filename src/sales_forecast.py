@@ -0,0 +1,340 @@
+"""
+This module is a program that forecasts the sales of each beer from its
+monthly or weekly time series. Every beer is fitted independently on a
+process pool with each registered model (the average growth rate,
+simple and Holt exponential smoothing and additive Holt-Winters), and
+the model with the lowest one step ahead error is kept. The fits are
+cached per version of the sales store and run in the background, so a
+refit never blocks the thread that asked for it.
+"""
+from concurrent.futures import Future, ProcessPoolExecutor
+from threading import Lock, Thread
+import itertools
+import multiprocessing
+import os
+import numpy as np
+from brew_logger import errorLogger
+from sales_store import SalesStore
+
+# the season length and the number of periods forecast for each kind
+SEASONS = {"month": 12, "week": 52}
+FORECAST_STEPS = {"month": 12, "week": 13}
+
+SMOOTHING_GRID = (0.1, 0.3, 0.5, 0.7, 0.9)
+
+errorLogger = errorLogger()
+
+
+def growth_rate_model(values: np.ndarray, params: dict, season: int,
+                      steps: int) -> tuple:
+    """
+    This applies the average period over period growth rate, as
+    calculate_growth_rate does.
+    :param values: an array of the quantities of a beer.
+    :param params: a dictionary of the parameters (none).
+    :param season: an integer of the season length (unused).
+    :param steps: an integer of the number of periods to forecast.
+    :return: a tuple of the one step ahead predictions (nan where there
+     is none) and the forecast.
+    """
+    previous = values[:-1]
+    growth = np.divide(values[1:] - previous, previous,
+                       out=np.zeros(previous.shape),
+                       where=(previous != 0) & (values[1:] != 0))
+    rate = growth.mean() if len(growth) else 0.0
+    fitted = np.full(len(values), np.nan)
+    fitted[1:] = previous * (1 + rate)
+    forecast = values[-1] * (1 + rate) ** np.arange(1, steps + 1)
+    return fitted, forecast
+
+
+def simple_exponential_model(values: np.ndarray, params: dict,
+                             season: int, steps: int) -> tuple:
+    """
+    This applies simple exponential smoothing.
+    :param values: an array of the quantities of a beer.
+    :param params: a dictionary with the smoothing factor "alpha".
+    :param season: an integer of the season length (unused).
+    :param steps: an integer of the number of periods to forecast.
+    :return: a tuple of the one step ahead predictions (nan where there
+     is none) and the forecast.
+    """
+    alpha = params["alpha"]
+    fitted = np.full(len(values), np.nan)
+    level = values[0]
+    for index in range(1, len(values)):
+        fitted[index] = level
+        level = alpha * values[index] + (1 - alpha) * level
+    return fitted, np.full(steps, level)
+
+
+def holt_model(values: np.ndarray, params: dict, season: int,
+               steps: int) -> tuple:
+    """
+    This applies Holt's linear trend exponential smoothing.
+    :param values: an array of the quantities of a beer.
+    :param params: a dictionary with the smoothing factors "alpha" and
+     "beta".
+    :param season: an integer of the season length (unused).
+    :param steps: an integer of the number of periods to forecast.
+    :return: a tuple of the one step ahead predictions (nan where there
+     is none) and the forecast.
+    """
+    alpha, beta = params["alpha"], params["beta"]
+    fitted = np.full(len(values), np.nan)
+    level, trend = values[0], values[1] - values[0]
+    for index in range(1, len(values)):
+        fitted[index] = level + trend
+        previous_level = level
+        level = alpha * values[index] + (1 - alpha) * (level + trend)
+        trend = beta * (level - previous_level) + (1 - beta) * trend
+    return fitted, level + trend * np.arange(1, steps + 1)
+
+
+def holt_winters_model(values: np.ndarray, params: dict, season: int,
+                       steps: int) -> tuple:
+    """
+    This applies additive Holt-Winters exponential smoothing.
+    :param values: an array of the quantities of a beer.
+    :param params: a dictionary with the smoothing factors "alpha",
+     "beta" and "gamma".
+    :param season: an integer of the season length.
+    :param steps: an integer of the number of periods to forecast.
+    :return: a tuple of the one step ahead predictions (nan where there
+     is none) and the forecast.
+    """
+    alpha, beta, gamma = params["alpha"], params["beta"], params["gamma"]
+    fitted = np.full(len(values), np.nan)
+    level = values[:season].mean()
+    trend = (values[season:2 * season].mean() - level) / season
+    seasonal = list(values[:season] - level)
+    for index in range(season, len(values)):
+        position = index % season
+        fitted[index] = level + trend + seasonal[position]
+        previous_level = level
+        level = alpha * (values[index] - seasonal[position]) + \
+            (1 - alpha) * (level + trend)
+        trend = beta * (level - previous_level) + (1 - beta) * trend
+        seasonal[position] = gamma * (values[index] - level) + \
+            (1 - gamma) * seasonal[position]
+    forecast = [level + trend * step +
+                seasonal[(len(values) + step - 1) % season]
+                for step in range(1, steps + 1)]
+    return fitted, np.array(forecast)
+
+
+def smoothing_grid(*names) -> list:
+    """
+    This gets every combination of smoothing factors.
+    :param names: the names of the smoothing factors.
+    :return: a list of parameter dictionaries.
+    """
+    return [dict(zip(names, factors)) for factors in
+            itertools.product(SMOOTHING_GRID, repeat=len(names))]
+
+
+# {model name: (model function, parameter grid, function of the season
+# length giving the fewest periods the model needs)}
+MODELS = {}
+
+
+def register_model(name: str, model, grid: list, min_periods):
+    """
+    This registers a forecasting model.
+    :param name: a string of the model's name.
+    :param model: a function (values, params, season, steps) returning
+     the one step ahead predictions and the forecast.
+    :param grid: a list of the parameter dictionaries to try.
+    :param min_periods: a function of the season length giving the
+     fewest periods the model can be fitted on.
+    """
+    MODELS.update({name: (model, grid, min_periods)})
+
+
+register_model("growth_rate", growth_rate_model, [{}],
+               lambda season: 2)
+register_model("simple_exponential", simple_exponential_model,
+               smoothing_grid("alpha"), lambda season: 2)
+register_model("holt", holt_model, smoothing_grid("alpha", "beta"),
+               lambda season: 3)
+register_model("holt_winters", holt_winters_model,
+               smoothing_grid("alpha", "beta", "gamma"),
+               lambda season: 2 * season + 1)
+
+
+def mean_squared_error(values: np.ndarray, fitted: np.ndarray,
+                       start: int) -> float:
+    """
+    This calculates the mean squared one step ahead error.
+    :param values: an array of the quantities.
+    :param fitted: an array of the one step ahead predictions.
+    :param start: an integer of the first period compared.
+    :return: a float of the error, or inf if nothing was compared.
+    """
+    errors = values[start:] - fitted[start:]
+    errors = errors[~np.isnan(errors)]
+    return float(np.mean(errors ** 2)) if len(errors) else float("inf")
+
+
+def fit_beer(beer: str, values: np.ndarray, season: int,
+             steps: int) -> dict:
+    """
+    This fits every registered model that has enough periods to the
+    series of a beer and keeps the best one. It runs in a worker
+    process.
+    :param beer: a string representing the beer.
+    :param values: an array of the quantities of the beer.
+    :param season: an integer of the season length.
+    :param steps: an integer of the number of periods to forecast.
+    :return fit: a dictionary with the beer, the selected model, its
+     parameters, its error, the error of each model and the forecast.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    candidates = {}
+    for name, (model, grid, min_periods) in MODELS.items():
+        if len(values) < min_periods(season):
+            continue
+        best = None
+        for params in grid:
+            fitted, forecast = model(values, params, season, steps)
+            error = mean_squared_error(values, fitted, 0)
+            if best is None or error < best[0]:
+                best = (error, params, fitted, forecast)
+        candidates.update({name: best})
+    # the models are compared on the periods every one of them predicts
+    start = max([np.argmax(~np.isnan(fitted))
+                 for _, _, fitted, _ in candidates.values()], default=0)
+    errors = {name: mean_squared_error(values, fitted, start)
+              for name, (_, _, fitted, _) in candidates.items()}
+    if not errors:
+        last = int(values[-1]) if len(values) else 0
+        return {"beer": beer, "model": None, "params": {}, "error": None,
+                "errors": {}, "forecast": [last] * steps}
+    name = min(errors, key=errors.get)
+    _, params, _, forecast = candidates[name]
+    forecast = np.ceil(np.clip(forecast, 0, None)).astype(np.int64)
+    return {"beer": beer, "model": name, "params": params,
+            "error": errors[name], "errors": errors,
+            "forecast": forecast.tolist()}
+
+
+class ForecastEngine(object):
+    """
+    This class fits the forecasting models of every beer of a SalesStore
+    on a process pool and caches the fits per version of the store.
+    """
+
+    def __init__(self, store: SalesStore, workers: int = None):
+        self.store = store
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = None
+        self._lock = Lock()
+        self._fits = {}
+        self._pending = {}
+
+    def executor(self) -> ProcessPoolExecutor:
+        """
+        This gets the process pool, starting it on first use. The
+        workers are spawned, as forking the threaded app could copy a
+        lock another thread holds.
+        :return: a ProcessPoolExecutor.
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def series(self, kind: str) -> tuple:
+        """
+        This gets the time series of every beer.
+        :param kind: a string of the period kind, "month" or "week".
+        :return: a tuple of the period keys and the (period, beer)
+         matrix of quantities.
+        """
+        if kind == "month":
+            return self.store.series.month_matrix()
+        return self.store.series.week_matrix()
+
+    def refit(self, kind: str) -> Future:
+        """
+        This starts fitting every beer on the current version of the
+        sales, unless it is already fitted or being fitted.
+        :param kind: a string of the period kind, "month" or "week".
+        :return: a Future resolving to the fits.
+        """
+        with self._lock:
+            version = self.store.version
+            cached = self._fits.get(kind)
+            if cached is not None and cached["version"] == version:
+                future = Future()
+                future.set_result(cached)
+                return future
+            pending = self._pending.get(kind)
+            if pending is not None and pending[0] == version:
+                return pending[1]
+            future = Future()
+            self._pending.update({kind: (version, future)})
+            keys, matrix = self.series(kind)
+            beers = list(self.store.beers)
+        errorLogger.info("Refitting the %s forecasts of %d beers.", kind,
+                         len(beers))
+        jobs = [self.executor().submit(fit_beer, beer, matrix[:, index],
+                                       SEASONS[kind],
+                                       FORECAST_STEPS[kind])
+                for index, beer in enumerate(beers)]
+        Thread(target=self.collect, args=(kind, version, keys, jobs,
+                                          future), daemon=True).start()
+        return future
+
+    def collect(self, kind: str, version: int, keys: list, jobs: list,
+                future: Future):
+        """
+        This waits for the fits of every beer and caches them.
+        :param kind: a string of the period kind.
+        :param version: an integer of the sales store version fitted.
+        :param keys: a list of the period keys fitted.
+        :param jobs: a list of the futures of the fits.
+        :param future: the Future resolved with the fits.
+        """
+        try:
+            fits = {"version": version, "kind": kind,
+                    "last_period": list(keys[-1]) if keys else None,
+                    "beers": {}}
+            for job in jobs:
+                fit = job.result()
+                fits["beers"].update({fit.pop("beer"): fit})
+        except Exception as error:
+            errorLogger.error("Failed to fit the %s forecasts: %s", kind,
+                              error)
+            with self._lock:
+                self._pending.pop(kind, None)
+            future.set_exception(error)
+            return
+        with self._lock:
+            if self._pending.get(kind, (None, None))[1] is future:
+                self._pending.pop(kind)
+            cached = self._fits.get(kind)
+            if cached is None or cached["version"] <= version:
+                self._fits.update({kind: fits})
+        future.set_result(fits)
+
+    def forecast(self, kind: str) -> dict:
+        """
+        This gets the fits of the current version of the sales, starting
+        a refit in the background when they are missing or out of date.
+        :param kind: a string of the period kind, "month" or "week".
+        :return: a dictionary of the fits, or None while fitting.
+        """
+        future = self.refit(kind)
+        if future.done() and future.exception() is None:
+            return future.result()
+        return None
+
+    def shutdown(self):
+        """
+        This stops the process pool.
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
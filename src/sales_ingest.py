@@ -0,0 +1,207 @@
+"""
+This module is a program that streams invoice rows from a sales csv
+file into a SalesStore. Rows are parsed, validated and aggregated per
+(day, beer) in fixed size chunks, so the memory used while loading is
+bounded by the chunk size and the aggregates rather than by the size
+of the file.
+"""
+from collections import namedtuple
+from datetime import date, datetime
+import calendar
+import csv
+import time
+from brew_logger import errorLogger
+from sales_store import SalesStore
+
+CHUNK_SIZE = 10000
+DATE_FORMAT = "%d-%b-%y"
+# the decoded dates kept before the date cache is cleared
+DATE_CACHE_SIZE = 100000
+
+MONTH_ABBREVIATIONS = {name.lower(): number for number, name in
+                       enumerate(calendar.month_abbr) if name}
+
+# column indexes in the invoice csv file
+DATE_COLUMN = 2
+RECIPE_COLUMN = 3
+GYLE_COLUMN = 4
+QUANTITY_COLUMN = 5
+
+# {date text: date ordinal, or None when the text isn't a valid date}
+date_cache = {}
+
+IngestStats = namedtuple("IngestStats", ["rows", "invalid_rows",
+                                         "records", "seconds",
+                                         "rows_per_second"])
+
+errorLogger = errorLogger()
+
+
+def read_rows(csvfile) -> iter:
+    """
+    This yields the rows of an opened csv file, skipping the header.
+    :param csvfile: an opened csv file.
+    :return: a generator of rows.
+    """
+    csvfile_reader = csv.reader(csvfile)
+    next(csvfile_reader, None)
+    yield from csvfile_reader
+
+
+def parse_date(text: str) -> int:
+    """
+    This parses a "dd-Mon-yy" date, such as "02-Nov-18", without
+    strptime, falling back to strptime for any other layout.
+    :param text: a string of the date.
+    :return: an integer of the date ordinal.
+    :raises ValueError: if the text isn't a valid date.
+    """
+    parts = text.split("-")
+    if len(parts) == 3 and len(parts[2]) == 2 and parts[2].isdigit() \
+            and 0 < len(parts[0]) <= 2 and parts[0].isdigit() \
+            and parts[1].lower() in MONTH_ABBREVIATIONS:
+        year = int(parts[2])
+        # the same pivot as %y: 69-99 are 1969-1999, 00-68 are 2000-2068
+        year += 1900 if year >= 69 else 2000
+        return date(year, MONTH_ABBREVIATIONS[parts[1].lower()],
+                    int(parts[0])).toordinal()
+    return datetime.strptime(text, DATE_FORMAT).toordinal()
+
+
+def decode_date(text: str) -> int:
+    """
+    This decodes a date of the Date Required column into its ordinal,
+    caching the result as invoice files repeat the same dates.
+    :param text: a string of the date.
+    :return: an integer of the date ordinal.
+    :raises ValueError: if the text isn't a valid date.
+    """
+    try:
+        day = date_cache[text]
+    except KeyError:
+        try:
+            day = parse_date(text.strip())
+        except ValueError:
+            day = None
+        if len(date_cache) >= DATE_CACHE_SIZE:
+            date_cache.clear()
+        date_cache[text] = day
+    if day is None:
+        raise ValueError("Invalid date: {}".format(text))
+    return day
+
+
+def parse_row(row: list) -> tuple:
+    """
+    This parses and validates a single invoice row.
+    :param row: a list of the columns of the row.
+    :return: a tuple of the date ordinal, recipe, gyle and quantity, or
+     None if the row is invalid.
+    """
+    try:
+        recipe = row[RECIPE_COLUMN].strip()
+        gyle = int(row[GYLE_COLUMN])
+        quantity = int(row[QUANTITY_COLUMN])
+        day = decode_date(row[DATE_COLUMN])
+    except (IndexError, ValueError):
+        return None
+    if not recipe or quantity < 0:
+        return None
+    return day, recipe, gyle, quantity
+
+
+def parse_chunks(rows, chunk_size: int = CHUNK_SIZE) -> iter:
+    """
+    This parses rows into chunks of valid sales.
+    :param rows: an iterable of csv rows.
+    :param chunk_size: an integer of the number of rows per chunk.
+    :return: a generator of (sales, number of rows read) tuples.
+    """
+    chunk = []
+    read = 0
+    for row in rows:
+        read += 1
+        sale = parse_row(row)
+        if sale is not None:
+            chunk.append(sale)
+        if read == chunk_size:
+            yield chunk, read
+            chunk = []
+            read = 0
+    if read:
+        yield chunk, read
+
+
+def aggregate_chunk(chunk: list) -> dict:
+    """
+    This sums the sales of a chunk per day and beer. The gyle of the
+    first sale of each day and beer is kept.
+    :param chunk: a list of (day, recipe, gyle, quantity) tuples.
+    :return aggregates: a dictionary {(day, recipe): [gyle, quantity]}
+     in order of first appearance.
+    """
+    aggregates = {}
+    for day, recipe, gyle, quantity in chunk:
+        aggregate = aggregates.get((day, recipe))
+        if aggregate is None:
+            aggregates[(day, recipe)] = [gyle, quantity]
+        else:
+            aggregate[1] += quantity
+    return aggregates
+
+
+def ingest_rows(rows, store: SalesStore, new_record=None,
+                chunk_size: int = CHUNK_SIZE) -> IngestStats:
+    """
+    This streams csv rows into the sales store.
+    :param rows: an iterable of csv rows.
+    :param store: a SalesStore the sales are added to.
+    :param new_record: a function called with (recipe, gyle) whenever a
+     new (day, beer) record is created, or None.
+    :param chunk_size: an integer of the number of rows per chunk.
+    :return: an IngestStats of the load.
+    """
+    started = time.perf_counter()
+    total_rows = 0
+    valid_rows = 0
+    records = len(store)
+    for chunk, read in parse_chunks(rows, chunk_size):
+        total_rows += read
+        valid_rows += len(chunk)
+        for (day, recipe), (gyle, quantity) in \
+                aggregate_chunk(chunk).items():
+            if store.add(day, recipe, gyle, quantity) and new_record:
+                new_record(recipe, gyle)
+    seconds = time.perf_counter() - started
+    stats = IngestStats(total_rows, total_rows - valid_rows,
+                        len(store) - records, seconds,
+                        total_rows / seconds if seconds else 0.0)
+    if stats.invalid_rows:
+        errorLogger.warning("Skipped %d invalid sales row(s).",
+                            stats.invalid_rows)
+    errorLogger.info("Ingested %d sales rows into %d records in %.3fs "
+                     "(%.0f rows/s).", stats.rows, stats.records,
+                     stats.seconds, stats.rows_per_second)
+    return stats
+
+
+def ingest_csvfile(file_name: str, store: SalesStore, new_record=None,
+                   chunk_size: int = CHUNK_SIZE) -> IngestStats:
+    """
+    This streams a sales csv file into the sales store.
+    :param file_name: a string with the csv file name.
+    :param store: a SalesStore the sales are added to.
+    :param new_record: a function called with (recipe, gyle) whenever a
+     new (day, beer) record is created, or None.
+    :param chunk_size: an integer of the number of rows per chunk.
+    :return: an IngestStats of the load, or None if the file could not
+     be opened.
+    """
+    try:
+        csvfile = open(file_name, 'rt', newline='')
+    except IOError:
+        errorLogger.error("IOError")
+        return None
+    with csvfile:
+        return ingest_rows(read_rows(csvfile), store, new_record,
+                           chunk_size)
@@ -4,22 +4,37 @@ month or week from past sales. Last year's sale is stored in
 "Barnabys_sales_fabriacted_data.csv". These are the datas that is used
 to predict.
 """
-import csv
-import math
+import calendar
 from datetime import datetime
+from threading import Lock, Thread
+import numpy as np
 from brew_logger import errorLogger, eventLogger
+from sales_forecast import ForecastEngine
+from sales_snapshot import load_sales_csvfile
+from sales_store import SalesStore, DailySalesView
 
-sales_data = {}
-beers = []
+SALES_PER_DAY = "sales_per_day"
+SALES_PER_YEAR = "sales_last_year"
+SALES_PER_WEEK = "Week {wk}"
+SALES_CSV_FILE = "Barnabys_sales_fabriacted_data.csv"
+
+sales_store = SalesStore()
+sales_data = DailySalesView(sales_store, SALES_PER_DAY)
+beers = sales_store.beers
 sales_summary = {}
 months = []
 weeks = []
 
+MONTH_NUMBERS = {name: number for number, name in
+                 enumerate(calendar.month_name) if name}
+
 highest_gyle_number_for_beers = {}
 
-SALES_PER_DAY = "sales_per_day"
-SALES_PER_YEAR = "sales_last_year"
-SALES_PER_WEEK = "Week {wk}"
+forecast_engine = ForecastEngine(sales_store)
+
+# the csv file is loaded on first use rather than at import
+sales_lock = Lock()
+sales_loaded = {"loaded": False}
 
 errorLogger = errorLogger()
 eventLogger = eventLogger()
@@ -29,20 +44,17 @@ def get_recommended_sales() -> dict:
     Getting the recommended sales.
     :return recommended_sales: a dictionary of the recommended sales.
     """
+    ensure_sales_loaded()
     errorLogger.info("Getting the recommended sales.")
     recommended_sales = {}
-    current_month = datetime.now().strftime('%B')
-    current_month_index = months.index(current_month)
-    temp = 0
+    current_month = datetime.now().month
+    # the current month and the next two, wrapping round the year
     for x in range(3):
-        month_prediction = predict_month_beer_qty(months[current_month_index + x])
+        month_prediction = predict_month_beer_qty(
+            period_name("month", (current_month - 1 + x) % 12 + 1))
         for beer in beers:
-            try:
-                if recommended_sales[beer]:
-                    temp = recommended_sales[beer] + month_prediction[beer]
-            except:
-                temp = month_prediction[beer]
-            recommended_sales.update({beer: temp})
+            recommended_sales.update({beer: recommended_sales.get(beer, 0)
+                                      + month_prediction[beer]})
     return recommended_sales
 
 def update_recommended_sales(recommended_sales: dict, beer_name: str, quantity: int):
@@ -63,6 +75,7 @@ def get_periods() -> list:
     This function gets all the period in the csv file.
     :return periods: a list containing all the periods in the csv file.
     """
+    ensure_sales_loaded()
     errorLogger.info("Retrieving all the period group(such as months "
                      "and weeks) that was present in the csv file.")
     periods = []
@@ -78,8 +91,7 @@ def add_bear_name(beer_name: str):
     :param beer_name: a string containing beer's name.
     """
     errorLogger.info("Adding new beer to the beers list.")
-    if beers.count(beer_name) == 0:
-        beers.append(beer_name)
+    sales_store.beer_id(beer_name)
 
 def get_value_by_key(obj: dict, key: str):
     """
@@ -94,114 +106,195 @@ def get_value_by_key(obj: dict, key: str):
         errorLogger.error("The given obj or key doesn't exist.")
         return None
 
-def update_sales_summary(date_obj: datetime, qty: int, beer: str):
+def period_name(kind: str, code: int) -> str:
     """
-    This function updates the sales_summary dictionary.
-    :param date_obj: a datetime of the date of the invoice order.
-    :param qty: an integer representing number of bottle.
-    :param beer: a string representing the beer.
+    This formats the name of a month or week.
+    :param kind: a string of the period kind, "month" or "week".
+    :param code: an integer of the month or ISO week number.
+    :return: a string such as "November" or "Week 44".
+    """
+    if kind == "month":
+        return calendar.month_name[code]
+    return SALES_PER_WEEK.format(wk=code)
+
+def period_series(kind: str) -> tuple:
+    """
+    This gets every month or week from the first to the latest with
+     sales, keyed by (year, period) so the years are kept apart.
+    :param kind: a string of the period kind, "month" or "week".
+    :return: a tuple of the list of (year, month or ISO week) tuples and
+     the (period, beer) matrix of quantities.
+    """
+    if kind == "month":
+        return sales_store.series.month_matrix()
+    return sales_store.series.week_matrix()
+
+def latest_periods(kind: str) -> tuple:
+    """
+    This gets the latest year with sales of every month or week.
+    :param kind: a string of the period kind, "month" or "week".
+    :return: a tuple of the (period, beer) matrix of quantities and a
+     dictionary of {period name: row} in the order of the rows.
+    """
+    keys, totals = period_series(kind)
+    rows = {}
+    for row in np.flatnonzero(totals.any(axis=1)).tolist():
+        name = period_name(kind, keys[row][1])
+        rows.pop(name, None)
+        rows.update({name: row})
+    return totals, rows
+
+def update_period_summary(kind: str, periods: list, names: list):
+    """
+    This updates the months or weeks list, and the sales_summary of some
+     of its periods, to the latest year of each period.
+    :param kind: a string of the period kind, "month" or "week".
+    :param periods: the months or weeks list.
+    :param names: a list of the period names to update.
+    """
+    totals, rows = latest_periods(kind)
+    periods[:] = list(rows)
+    for name in names:
+        row = totals[rows[name]]
+        sales_summary.update({name: {beers[beer]: int(row[beer])
+                                     for beer in np.flatnonzero(row)}})
+
+def period_code(kind: str, name: str) -> int:
+    """
+    This parses the name of a month or week.
+    :param kind: a string of the period kind, "month" or "week".
+    :param name: a string such as "November" or "Week 44".
+    :return: an integer of the month or ISO week number, or 0 if the
+     name isn't one, such as None for a form without a period.
+    """
+    if not isinstance(name, str):
+        return 0
+    if kind == "month":
+        return MONTH_NUMBERS.get(name, 0)
+    try:
+        return int(name.rsplit(" ", 1)[1])
+    except (IndexError, ValueError):
+        return 0
+
+def add_period_sale(kind: str, periods: list, key: tuple,
+                    beer_name: str, quantity: int, latest_year: int):
+    """
+    This adds a sale to the sales_summary of its month or week, and
+     moves the period along the months or weeks list, without summing
+     the other sales again. The summary only holds the latest year of
+     each period, so a sale of an earlier year changes nothing.
+    :param kind: a string of the period kind, "month" or "week".
+    :param periods: the months or weeks list.
+    :param key: a tuple of the (year, month or ISO week) of the sale.
+    :param beer_name: a string representing the beer.
+    :param quantity: an integer representing number of bottle.
+    :param latest_year: an integer of the latest year with sales in the
+     period before the sale, or None.
+    """
+    year, code = key
+    name = period_name(kind, code)
+    if latest_year is not None and year < latest_year:
+        return
+    if latest_year is None or year > latest_year or name not in periods:
+        sales_summary.update({name: {}})
+        if name in periods:
+            periods.remove(name)
+        # the list is in the order of the latest (year, period) of each
+        position = len(periods)
+        for index, other in enumerate(periods):
+            other_code = period_code(kind, other)
+            if (sales_store.series.latest_year(kind, other_code),
+                    other_code) > key:
+                position = index
+                break
+        periods.insert(position, name)
+    summary = sales_summary[name]
+    summary.update({beer_name: summary.get(beer_name, 0) + quantity})
+
+def update_sales_summary():
+    """
+    This function rebuilds the sales_summary dictionary, and the months
+     and weeks lists, from the sales time series. A period is summed
+     over its latest year, as total_month_beers_qty does.
     """
     errorLogger.info("Updating the sales summary list.")
-    # Calculate year sales
-    sale_qty_year = get_value_by_key(sales_summary, SALES_PER_YEAR)
-    if not sale_qty_year:
-        sale_qty_year = 0
-    sale_qty_year = sale_qty_year + qty
-    sales_summary.update({SALES_PER_YEAR: sale_qty_year})
-
-    # Calculate each month sales
-    month = date_obj.strftime('%B')
-    sale_qty_month = get_value_by_key(sales_summary, month)
-    if not sale_qty_month:
-        sales_summary.update({month: {}})
-        sale_qty_month = sales_summary[month]
-        months.append(month)
-    sale_beers_qty_month = get_value_by_key(sale_qty_month, beer)
-    if beer not in sale_qty_month:
-        sale_qty_month.update({beer: 0})
-        sale_beers_qty_month = sale_qty_month[beer]
-    tmp_qty = sale_beers_qty_month + qty
-    sale_qty_month.update({beer: tmp_qty})
-    sales_summary.update({month: sale_qty_month})
-
-    # Calculate each week sales
-    # gets the week number from the date
-    week_no = date_obj.isocalendar()[1]
-    # formatting the week string
-    week = SALES_PER_WEEK.format(wk=week_no)
-    sale_qty_week = get_value_by_key(sales_summary, week)
-    if not sale_qty_week:
-        sales_summary.update({week: {}})
-        sale_qty_week = sales_summary[week]
-        weeks.append(week)
-    sale_beers_qty_week = get_value_by_key(sale_qty_week, beer)
-    if beer not in sale_qty_week:
-        sale_qty_week.update({beer: 0})
-        sale_beers_qty_week = sale_qty_week[beer]
-    tmp_qty = sale_beers_qty_week + qty
-    sale_qty_week.update({beer: tmp_qty})
-    sales_summary.update({week: sale_qty_week})
+    sales_summary.clear()
+    sales_summary.update({SALES_PER_YEAR:
+                          int(sales_store.beer_totals().sum())})
+    for kind, periods in (("month", months), ("week", weeks)):
+        update_period_summary(kind, periods, latest_periods(kind)[1])
+
+def add_sale(date_obj: datetime, beer_name: str, gyle: int,
+             quantity: int):
+    """
+    This adds a sale to the sales store and updates the sales summary
+     and the growth rate models incrementally.
+    :param date_obj: a datetime of the date of the invoice order.
+    :param beer_name: a string representing the beer.
+    :param gyle: an integer of the batch number.
+    :param quantity: an integer representing number of bottle.
+    """
+    ensure_sales_loaded()
+    errorLogger.info("Adding a sale.")
+    previous_version = sales_store.version
+    sale_periods = (("month", (date_obj.year, date_obj.month), months),
+                    ("week", date_obj.isocalendar()[:2], weeks))
+    latest_years = [sales_store.series.latest_year(kind, key[1])
+                    for kind, key, _ in sale_periods]
+    if sales_store.add(date_obj.toordinal(), beer_name, gyle, quantity):
+        update_highest_gyle_number(beer_name, gyle)
+    sales_summary.update({SALES_PER_YEAR: sales_summary.get(
+        SALES_PER_YEAR, 0) + quantity})
+    for (kind, key, periods), latest_year in zip(sale_periods,
+                                                 latest_years):
+        add_period_sale(kind, periods, key, beer_name, quantity,
+                        latest_year)
+        growth_rate_models[kind].add(key, beer_name, previous_version)
+
+def update_highest_gyle_number(beer_name: str, gyle: int):
+    """
+    This records the gyle of the latest sales record of a beer.
+    :param beer_name: a string representing the beer.
+    :param gyle: an integer of the batch number.
+    """
+    highest_gyle_number_for_beers.update({beer_name: gyle})
 
 def load_barnabys_sales_csvfile(file_name: str):
     """
-    This functions open and read the csv file and stores to a formatted
-     dictionary.
+    This functions streams the csv file into the columnar sales store,
+     starting from its on-disk snapshot when there is one.
     :param file_name: a string with the csv file name.
+    :return stats: an IngestStats of the parsed rows, or None if the
+     file could not be opened.
     """
     errorLogger.info("Loading the sales csv file.")
-    # opening csv file
-    try:
-        csvfile = open(file_name, 'rt')
-    except IOError:
-        errorLogger.error("IOError")
-        return None
-    else:
-        with csvfile:
-            # reading the csv file
-            csvfile_reader = csv.reader(csvfile)
-            next(csvfile_reader)
-            for row in csvfile_reader:
-                recipe = row[3].strip()
-                gyle = int(row[4].strip())
-                quantity = int(row[5].strip())
-                # stores the date from the csv file as a datetime
-                # object.
-                date_obj = datetime.strptime(row[2].strip(),
-                                             "%d-%b-%y")
-
-                beers_obj = get_value_by_key(sales_data, date_obj)
-                if not beers_obj:
-                    sales_data.update({date_obj: {}})
-                    beers_obj = sales_data[date_obj]
-
-                beer_key = recipe
-                beer_obj = get_value_by_key(beers_obj, beer_key)
-                if not beer_obj:
-                    beer = {"gyle_number": gyle, "quantity": 0}
-                    beers_obj.update({beer_key: beer})
-                    beer_obj = beers_obj[beer_key]
-                    highest_gyle_number_for_beers.update({beer_key:
-                                                              gyle})
-
-                tmp_qty = beer_obj["quantity"] + quantity
-                beer_obj.update({"quantity": tmp_qty})
-                beers_obj.update({beer_key: beer_obj})
-
-                # Calculate day sales
-                sale_qty_day = get_value_by_key(beers_obj,
-                                                SALES_PER_DAY)
-                if not sale_qty_day:
-                    sale_qty_day = 0
-
-                sale_qty_day = sale_qty_day + quantity
-                beers_obj.update({SALES_PER_DAY: sale_qty_day})
-
-                sales_data.update({date_obj: beers_obj})
-
-                # Calculate year sales
-                update_sales_summary(date_obj, quantity, beer_key)
-
-                add_bear_name(beer_key)
+    stats = load_sales_csvfile(file_name, sales_store,
+                               new_record=update_highest_gyle_number)
+    if stats:
+        update_sales_summary()
+    return stats
+
+def ensure_sales_loaded():
+    """
+    This loads the sales csv file the first time the sales are needed.
+     Concurrent callers wait for the one that is loading it.
+    """
+    if sales_loaded["loaded"]:
+        return
+    with sales_lock:
+        if not sales_loaded["loaded"]:
+            load_barnabys_sales_csvfile(SALES_CSV_FILE)
+            sales_loaded.update({"loaded": True})
+
+def start_sales_warm_up() -> Thread:
+    """
+    This loads the sales csv file on a background thread.
+    :return thread: the started daemon thread.
+    """
+    thread = Thread(target=ensure_sales_loaded, name="sales-warm-up",
+                    daemon=True)
+    thread.start()
+    return thread
 
 def calculate_average(array_obj: list) -> float:
     """
@@ -216,88 +309,250 @@ def calculate_average(array_obj: list) -> float:
     average = average / len(array_obj)  # finding the average
     return average
 
+def period_growth(totals: np.ndarray, present: np.ndarray) -> np.ndarray:
+    """
+    This calculates the growth of each beer between consecutive periods.
+    :param totals: a (period, beer) quantity matrix.
+    :param present: a (period, beer) boolean matrix of the sales.
+    :return: a (period - 1, beer) matrix of growth rates.
+    """
+    previous = totals[:-1]
+    # a period over period growth is 0 when either period has no sales
+    has_growth = present[1:] & present[:-1] & (previous != 0)
+    return np.divide(totals[1:] - previous, previous,
+                     out=np.zeros(previous.shape), where=has_growth)
+
 def calculate_growth_rate(array_obj: list) -> dict:
     """
-    This calculates the growth rate for each period.
+    This calculates the growth rate for each period. The growth is taken
+     between consecutive (year, period) pairs, in the order of time, of
+     the months or weeks in the list and the ones without sales.
     :param array_obj: a list of periods
     :return beer_growth_rate: a dictionary representing the growth rate
      for each period.
     """
+    ensure_sales_loaded()
     errorLogger.info("Calculating the growth rates.")
-    beer_growth_rate = {}
-    for beer in beers:
-        growth = []
-        for index in range(1, len(array_obj)):
-            try:
-                growth_rate = (sales_summary[array_obj[index]][beer] -
-                               sales_summary[array_obj[index - 1]]
-                               [beer]) / \
-                              sales_summary[array_obj[index - 1]][beer]
-                growth.append(growth_rate)
-            except KeyError:
-                errorLogger.error("KeyError")
-                growth.append(0)
-        average_growth = calculate_average(growth)
-        beer_growth_rate.update({beer: round(average_growth, 2)})
-    return beer_growth_rate
-
-def total_beers_qty(period: datetime, beer_qty: dict) -> dict:
-    """
-    This gets the total quantity of beer depending on the date.
-    :param period: a datetime containing the date at which the beers
-     were ordered in the csv file.
-    :param beer_qty: a dictionary where the quantity of beer is stored
-     to.
+    names = set(array_obj)
+    kind = "month" if names & set(MONTH_NUMBERS) else "week"
+    keys, totals = period_series(kind)
+    totals = totals[[row for row, (_, code) in enumerate(keys)
+                     if period_name(kind, code) in names or
+                     not totals[row].any()]]
+    growth = period_growth(totals, totals != 0)
+    average_growth = growth.mean(axis=0) if len(growth) else \
+        np.zeros(len(beers))
+    return {beer: round(float(average_growth[index]), 2)
+            for index, beer in enumerate(beers)}
+
+class GrowthRateModel(object):
+    """
+    This class contains the average period over period growth rate of
+    each beer over every (year, month) or (ISO year, ISO week) of the
+    sales time series. The growth of every pair of consecutive periods
+    is kept, so a new sale only recomputes the pairs around its period.
+    The model is rebuilt in full when the version of the sales store
+    moved on without it, or a sale falls in a period it doesn't have.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.version = None
+        self._keys = []
+        self._positions = {}
+        self._growth = {}
+        self._rates = None
+
+    def rebuild(self):
+        """
+        This rebuilds the growth of every pair of periods.
+        """
+        errorLogger.info("Rebuilding the growth rate model.")
+        self._keys, totals = period_series(self.kind)
+        growth = period_growth(totals, totals != 0)
+        self._positions = {key: index
+                           for index, key in enumerate(self._keys)}
+        self._growth = {beer: growth[:, index].tolist()
+                        for index, beer in enumerate(beers)}
+        self._rates = None
+        self.version = sales_store.version
+
+    def quantity(self, index: int, beer: str) -> int:
+        """
+        This gets the quantity of a beer in a period.
+        :param index: an integer of the position of the period.
+        :param beer: a string representing the beer.
+        :return: an integer of the quantity.
+        """
+        year, code = self._keys[index]
+        if self.kind == "month":
+            totals = sales_store.series.month_totals(code, year)
+        else:
+            totals = sales_store.series.week_totals(code, year)
+        return int(totals[sales_store.beer_id(beer)])
+
+    def pair_growth(self, index: int, beer: str) -> float:
+        """
+        This calculates the growth of a beer from the previous period.
+        :param index: an integer of the position of the period.
+        :param beer: a string representing the beer.
+        :return: a float of the growth rate.
+        """
+        previous = self.quantity(index - 1, beer)
+        current = self.quantity(index, beer)
+        if not previous or not current:
+            return 0.0
+        return (current - previous) / previous
+
+    def add(self, key: tuple, beer: str, previous_version: int):
+        """
+        This updates the model after a sale of a beer was added to the
+        sales store.
+        :param key: a tuple of the (year, month) or (ISO year, ISO week)
+         of the sale.
+        :param beer: a string representing the beer.
+        :param previous_version: an integer of the sales store version
+         before the sale was added.
+        """
+        if self.version != previous_version:
+            return
+        index = self._positions.get(key)
+        if index is None:
+            # a new period, and the empty ones before it, is added by
+            # the rebuild of the next rates
+            return
+        if beer not in self._growth:
+            self._growth.update({beer: [0.0] * (len(self._keys) - 1)})
+        growth = self._growth[beer]
+        for pair in (index, index + 1):
+            if 0 < pair < len(self._keys):
+                growth[pair - 1] = self.pair_growth(pair, beer)
+        self._rates = None
+        self.version = sales_store.version
+
+    def rates(self) -> dict:
+        """
+        This gets the growth rate of each beer.
+        :return beer_growth_rate: a dictionary of the growth rates.
+        """
+        ensure_sales_loaded()
+        if self.version != sales_store.version:
+            self.rebuild()
+        if self._rates is None:
+            self._rates = {}
+            for beer in beers:
+                growth = self._growth[beer]
+                average_growth = sum(growth) / len(growth) if growth \
+                    else 0.0
+                self._rates.update({beer: round(average_growth, 2)})
+        return self._rates
+
+growth_rate_models = {"month": GrowthRateModel("month"),
+                      "week": GrowthRateModel("week")}
+
+def beers_qty(totals: np.ndarray) -> dict:
+    """
+    This formats the total quantity of each beer as a dictionary.
+    :param totals: an array of the quantity for each beer.
     :return beer_qty: a dictionary with the quantity of beer.
     """
-    errorLogger.info("Calculating the current total quantity of beer "
-                     "for a given period.")
-    for beer in beers:
-        if beer not in beer_qty:
-            beer_qty.update({beer: 0})
-        try:
-            tmp_qty = beer_qty[beer] + \
-                      sales_data[period][beer]["quantity"]
-            temp_total = beer_qty["total"] + \
-                         sales_data[period][beer]["quantity"]
-        except KeyError:
-            errorLogger.error("KeyError")
-            tmp_qty = beer_qty[beer] + 0
-            temp_total = beer_qty["total"] + 0
-        beer_qty.update({beer: tmp_qty})
-        beer_qty.update({"total": temp_total})
+    beer_qty = {"total": int(totals.sum())}
+    for index, beer in enumerate(beers):
+        beer_qty.update({beer: int(totals[index])})
     return beer_qty
 
-def total_month_beers_qty(month_name: str) -> dict:
+def total_month_beers_qty(month_name: str, year: int = None) -> dict:
     """
     This gets the total quantity of beers for a given month.
     :param month_name: a string of the given month.
+    :param year: an integer of the year, by default the latest year
+     with sales in that month.
     :return month_beer_qty: a dictionary all beers for a given month.
     """
+    ensure_sales_loaded()
     errorLogger.info("Retrieving the current total quantity of beer "
                      "for given month.")
-    month_beer_qty = {}
-    month_beer_qty.update({"total": 0})
-    for element in sales_data:
-        if element.strftime('%B') == month_name:
-            month_beer_qty = total_beers_qty(element, month_beer_qty)
-    return month_beer_qty
+    month_no = period_code("month", month_name)
+    return beers_qty(sales_store.series.month_totals(month_no, year))
 
-def total_week_beers_qty(week_name: str) -> dict:
+def total_week_beers_qty(week_name: str, year: int = None) -> dict:
     """
     This gets the total quantity of beers for a given week.
     :param week_name: a string of the given week.
+    :param year: an integer of the ISO year, by default the latest year
+     with sales in that week.
     :return week_beer_qty: a dictionary all beers for a given week.
     """
+    ensure_sales_loaded()
     errorLogger.info("Retrieving the current total quantity of beer "
                      "for given week.")
-    week_beer_qty = {}
-    week_beer_qty.update({"total": 0})
-    for element in sales_data:
-        if SALES_PER_WEEK.format(wk=element.isocalendar()[1]) == \
-                week_name:
-            week_beer_qty = total_beers_qty(element, week_beer_qty)
-    return week_beer_qty
+    week_no = period_code("week", week_name)
+    if not week_no:
+        errorLogger.error("Invalid week: %s", week_name)
+    return beers_qty(sales_store.series.week_totals(week_no, year))
+
+def total_rolling_beers_qty(weeks: int) -> dict:
+    """
+    This gets the total quantity of beers over the trailing weeks, such
+     as the last 4, 13 or 52 weeks, ending at the latest week with sales.
+    :param weeks: an integer of the number of weeks.
+    :return rolling_beer_qty: a dictionary all beers for the weeks.
+    """
+    ensure_sales_loaded()
+    errorLogger.info("Retrieving the current total quantity of beer "
+                     "for the last %d weeks.", weeks)
+    return beers_qty(sales_store.series.rolling_totals(weeks))
+
+def total_range_beers_qty(start_date: datetime,
+                          end_date: datetime) -> dict:
+    """
+    This gets the total quantity of beers between two dates.
+    :param start_date: a datetime of the first day of the range.
+    :param end_date: a datetime of the last day of the range, included.
+    :return range_beer_qty: a dictionary all beers for the range.
+    """
+    ensure_sales_loaded()
+    errorLogger.info("Retrieving the current total quantity of beer "
+                     "for given date range.")
+    return beers_qty(sales_store.period_index().date_range_totals(
+        start_date.toordinal(), end_date.toordinal()))
+
+def total_last_days_beers_qty(days: int, end_date: datetime = None) \
+        -> dict:
+    """
+    This gets the total quantity of beers over the last days, such as
+     the last 30 days.
+    :param days: an integer of the number of days.
+    :param end_date: a datetime of the last day, by default the last
+     day with sales.
+    :return range_beer_qty: a dictionary all beers for the days.
+    """
+    ensure_sales_loaded()
+    errorLogger.info("Retrieving the current total quantity of beer "
+                     "for the last %d days.", days)
+    period_index = sales_store.period_index()
+    if end_date is not None:
+        last_day = end_date.toordinal()
+    else:
+        last_day = period_index.last_day() or 0
+    return beers_qty(period_index.date_range_totals(last_day - days + 1,
+                                                    last_day))
+
+def predict_beers_qty(beer_qty: dict, beer_growth_rate: dict) -> dict:
+    """
+    This applies the growth rate of each beer to its quantity.
+    :param beer_qty: a dictionary with the quantity of beer.
+    :param beer_growth_rate: a dictionary of the growth rate of beer.
+    :return beer_qty: a dictionary with the predicted quantity of beer.
+    """
+    quantity = np.array([beer_qty[beer] for beer in beers],
+                        dtype=np.float64)
+    rate = np.array([beer_growth_rate[beer] for beer in beers])
+    predicted = np.ceil(quantity * (1 + rate)).astype(np.int64)
+    for index, beer in enumerate(beers):
+        beer_qty.update({beer: int(predicted[index])})
+    beer_qty.update({"total": int(predicted.sum())})
+    return beer_qty
 
 def predict_month_beer_qty(month_name: str) -> dict:
     """
@@ -307,16 +562,8 @@ def predict_month_beer_qty(month_name: str) -> dict:
     """
     errorLogger.info("Retrieving the predicted total quantity of beer "
                      "for given month.")
-    month_beer_qty = total_month_beers_qty(month_name)
-    beer_month_growth_rate = calculate_growth_rate(months)
-    total = 0
-    for beer in beers:
-        temp_qty = math.ceil(month_beer_qty[beer] *
-                             (1 + beer_month_growth_rate[beer]))
-        total += temp_qty
-        month_beer_qty.update({beer: temp_qty})
-    month_beer_qty.update({"total": total})
-    return month_beer_qty
+    return predict_beers_qty(total_month_beers_qty(month_name),
+                             growth_rate_models["month"].rates())
 
 def predict_week_beer_qty(week_name: str) -> dict:
     """
@@ -326,16 +573,49 @@ def predict_week_beer_qty(week_name: str) -> dict:
     """
     errorLogger.info("Retrieving the predicted total quantity of beer "
                      "for given week.")
-    week_beer_qty = total_week_beers_qty(week_name)
-    beer_week_growth_rate = calculate_growth_rate(weeks)
-    total = 0
-    for beer in beers:
-        temp_qty = math.ceil(week_beer_qty[beer] *
-                             (1 + beer_week_growth_rate[beer]))
-        total += temp_qty
-        week_beer_qty.update({beer: math.ceil(temp_qty)})
-    week_beer_qty.update({"total": total})
-    return week_beer_qty
-
-# loading a csv file
-load_barnabys_sales_csvfile("Barnabys_sales_fabriacted_data.csv")
+    return predict_beers_qty(total_week_beers_qty(week_name),
+                             growth_rate_models["week"].rates())
+
+def predict_all_beers_qty() -> dict:
+    """
+    This predicts the quantity of every beer for every month and week in
+     a single pass over the sales time series.
+    :return forecast: a dictionary with the list of beers, the list of
+     periods, the (period, beer) matrix of predicted quantities as
+     nested lists and the predicted total of each period.
+    """
+    ensure_sales_loaded()
+    errorLogger.info("Predicting the quantity of every beer for every "
+                     "period.")
+    periods = get_periods()
+    # the latest year of each period, as total_month_beers_qty and
+    # total_week_beers_qty use
+    series = sales_store.series
+    totals = np.zeros((len(periods), len(beers)), dtype=np.int64)
+    for row, month in enumerate(months):
+        totals[row] = series.month_totals(MONTH_NUMBERS[month])
+    for row, week in enumerate(weeks, len(months)):
+        totals[row] = series.week_totals(int(week.rsplit(" ", 1)[1]))
+    rate = np.empty(totals.shape)
+    for rows, kind in ((slice(0, len(months)), "month"),
+                       (slice(len(months), len(periods)), "week")):
+        kind_rates = growth_rate_models[kind].rates()
+        rate[rows] = [kind_rates[beer] for beer in beers]
+    predicted = np.ceil(totals * (1 + rate)).astype(np.int64)
+    return {"beers": list(beers), "periods": periods,
+            "quantities": predicted.tolist(),
+            "totals": predicted.sum(axis=1).tolist()}
+
+def forecast_beers_qty(kind: str) -> dict:
+    """
+    This gets the forecast of every beer from the best fitting model of
+     each beer. The models are fitted in the background, so this never
+     waits for them.
+    :param kind: a string of the period kind, "month" or "week".
+    :return forecast: a dictionary of the fits of each beer with their
+     forecast for the periods after the last one with sales, or None
+     while the models are being fitted.
+    """
+    ensure_sales_loaded()
+    errorLogger.info("Retrieving the %s forecast of every beer.", kind)
+    return forecast_engine.forecast(kind)
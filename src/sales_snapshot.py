@@ -0,0 +1,204 @@
+"""
+This module is a program that keeps an on-disk snapshot of a SalesStore
+loaded from a sales csv file. The records are saved as a .npy matrix,
+which is memory mapped on a warm start, next to a json file describing
+the source file (size, mtime and hash of its content). A snapshot is
+used as is while the source file is unchanged, only the rows appended
+since the snapshot are parsed when the file grew, and the whole file is
+parsed again when its earlier content changed.
+"""
+from hashlib import sha256
+import csv
+import io
+import json
+import os
+import numpy as np
+from brew_logger import errorLogger
+from sales_ingest import IngestStats, ingest_rows, read_rows
+from sales_store import SalesStore
+
+SNAPSHOT_DIR = "cache"
+SNAPSHOT_FORMAT = 1
+HASH_BLOCK_SIZE = 1 << 20
+
+errorLogger = errorLogger()
+
+
+def snapshot_paths(file_name: str, snapshot_dir: str) -> tuple:
+    """
+    This gets the paths of the snapshot of a csv file.
+    :param file_name: a string with the csv file name.
+    :param snapshot_dir: a string of the directory of the snapshots.
+    :return: a tuple of the records (.npy) and metadata (.json) paths.
+    """
+    base = os.path.join(snapshot_dir, os.path.basename(file_name))
+    return base + ".npy", base + ".json"
+
+
+def hash_prefix(file_name: str, size: int) -> str:
+    """
+    This hashes the first bytes of a file.
+    :param file_name: a string with the file name.
+    :param size: an integer of the number of bytes to hash.
+    :return: a string of the hex digest, or None if the file is shorter.
+    """
+    digest = sha256()
+    remaining = size
+    with open(file_name, 'rb') as source:
+        while remaining:
+            block = source.read(min(HASH_BLOCK_SIZE, remaining))
+            if not block:
+                return None
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+
+def read_metadata(meta_path: str) -> dict:
+    """
+    This reads the metadata of a snapshot.
+    :param meta_path: a string of the metadata file path.
+    :return: a dictionary of the metadata, or None if it is missing or
+     from another snapshot format.
+    """
+    try:
+        with open(meta_path, 'r') as meta_file:
+            metadata = json.load(meta_file)
+    except (IOError, ValueError):
+        return None
+    if metadata.get("format") != SNAPSHOT_FORMAT:
+        return None
+    return metadata
+
+
+def snapshot_offset(file_name: str, metadata: dict) -> int:
+    """
+    This checks how much of the csv file the snapshot covers.
+    :param file_name: a string with the csv file name.
+    :param metadata: a dictionary of the snapshot's metadata.
+    :return: an integer of the byte offset the snapshot covers, or None
+     if the snapshot can't be used.
+    """
+    stat = os.stat(file_name)
+    size = metadata["size"]
+    if stat.st_size == size and stat.st_mtime_ns == metadata["mtime"]:
+        return size
+    # rows can only be appended after a complete last line
+    if stat.st_size < size or not metadata["newline"]:
+        return None
+    if hash_prefix(file_name, size) != metadata["hash"]:
+        return None
+    return size
+
+
+def save_snapshot(file_name: str, store: SalesStore, snapshot_dir: str):
+    """
+    This saves a snapshot of the sales store for a csv file.
+    :param file_name: a string with the csv file name.
+    :param store: the SalesStore loaded from the csv file.
+    :param snapshot_dir: a string of the directory of the snapshots.
+    """
+    records_path, meta_path = snapshot_paths(file_name, snapshot_dir)
+    stat = os.stat(file_name)
+    with open(file_name, 'rb') as source:
+        newline = True
+        if stat.st_size:
+            source.seek(stat.st_size - 1)
+            newline = source.read(1) == b"\n"
+    metadata = {"format": SNAPSHOT_FORMAT, "size": stat.st_size,
+                "mtime": stat.st_mtime_ns, "newline": newline,
+                "hash": hash_prefix(file_name, stat.st_size),
+                "beers": list(store.beers)}
+    try:
+        os.makedirs(snapshot_dir, exist_ok=True)
+        # written under temporary names so a reader never sees half a
+        # snapshot
+        with open(records_path + ".tmp", 'wb') as records_file:
+            np.save(records_file, store.dump_columns())
+        with open(meta_path + ".tmp", 'w') as meta_file:
+            json.dump(metadata, meta_file)
+        os.replace(records_path + ".tmp", records_path)
+        os.replace(meta_path + ".tmp", meta_path)
+    except OSError:
+        errorLogger.error("Failed to save the sales snapshot of %s",
+                          file_name)
+
+
+def load_snapshot(file_name: str, store: SalesStore,
+                  snapshot_dir: str) -> int:
+    """
+    This restores the sales store from the snapshot of a csv file.
+    :param file_name: a string with the csv file name.
+    :param store: a SalesStore the records are restored into.
+    :param snapshot_dir: a string of the directory of the snapshots.
+    :return: an integer of the byte offset of the csv file the snapshot
+     covers, or None if there is no usable snapshot.
+    """
+    records_path, meta_path = snapshot_paths(file_name, snapshot_dir)
+    metadata = read_metadata(meta_path)
+    if metadata is None:
+        return None
+    offset = snapshot_offset(file_name, metadata)
+    if offset is None:
+        errorLogger.info("The sales snapshot of %s is out of date.",
+                         file_name)
+        return None
+    try:
+        # mapped copy-on-write, so adding to a restored record doesn't
+        # touch the file
+        columns = np.load(records_path, mmap_mode='c')
+    except (IOError, ValueError):
+        return None
+    store.restore_columns(metadata["beers"], columns)
+    return offset
+
+
+def last_gyles(store: SalesStore) -> dict:
+    """
+    This gets the gyle of the latest record of each beer.
+    :param store: a SalesStore.
+    :return: a dictionary {beer: gyle}.
+    """
+    _, beer, gyle, _ = store.columns()
+    last = {}
+    for index in np.unique(beer[::-1], return_index=True)[1]:
+        record = len(beer) - 1 - index
+        last.update({store.beers[beer[record]]: int(gyle[record])})
+    return last
+
+
+def load_sales_csvfile(file_name: str, store: SalesStore,
+                       new_record=None,
+                       snapshot_dir: str = SNAPSHOT_DIR) -> IngestStats:
+    """
+    This loads a sales csv file into the sales store through its
+    snapshot, parsing only the rows the snapshot doesn't cover, and
+    saves the snapshot again when rows were parsed.
+    :param file_name: a string with the csv file name.
+    :param store: an empty SalesStore the sales are added to.
+    :param new_record: a function called with (recipe, gyle) for the
+     latest record of each beer and every new record, or None.
+    :param snapshot_dir: a string of the directory of the snapshots.
+    :return: an IngestStats of the parsed rows, or None if the file
+     could not be opened.
+    """
+    try:
+        source = open(file_name, 'rb')
+    except IOError:
+        errorLogger.error("IOError")
+        return None
+    with source:
+        offset = load_snapshot(file_name, store, snapshot_dir)
+        if offset is not None and new_record:
+            for beer, gyle in last_gyles(store).items():
+                new_record(beer, gyle)
+        source.seek(offset or 0)
+        csvfile = io.TextIOWrapper(source, newline='')
+        if offset:
+            rows = csv.reader(csvfile)
+        else:
+            rows = read_rows(csvfile)
+        stats = ingest_rows(rows, store, new_record)
+    if offset is None or stats.rows:
+        save_snapshot(file_name, store, snapshot_dir)
+    return stats
@@ -0,0 +1,299 @@
+"""
+This module is a program that stores the daily sales of each beer in a
+columnar form. Every (day, beer) pair is kept as one record in typed
+arrays of date ordinals, interned beer ids, gyle numbers and
+quantities, so the sales predictor can aggregate them with vectorized
+reductions instead of walking nested dictionaries.
+"""
+from array import array
+from collections.abc import Mapping
+from datetime import date, datetime
+import numpy as np
+from sales_timeseries import SalesTimeSeries
+
+
+class SalesStore(object):
+    """
+    This class contains the daily sales of each beer as columns.
+    """
+
+    def __init__(self):
+        self.beers = []
+        self._beer_ids = {}
+        self._records = {}
+        # the records restored from a snapshot, possibly memory mapped,
+        # followed by the ones added since
+        self._restored = np.empty((4, 0), dtype=np.int32)
+        self._days = array('i')
+        self._beer_idx = array('i')
+        self._gyles = array('i')
+        self._quantities = array('i')
+        self._columns = None
+        self._period_index = None
+        self.series = SalesTimeSeries()
+        self.version = 0
+
+    def __len__(self):
+        return self._restored.shape[1] + len(self._days)
+
+    def beer_id(self, beer_name: str) -> int:
+        """
+        This interns a beer name and returns its id.
+        :param beer_name: a string containing the beer's name.
+        :return beer_id: an integer of the beer's index in beers.
+        """
+        beer_id = self._beer_ids.get(beer_name)
+        if beer_id is None:
+            beer_id = len(self.beers)
+            self._beer_ids.update({beer_name: beer_id})
+            self.beers.append(beer_name)
+            self.series.grow(len(self.beers))
+        return beer_id
+
+    def records(self) -> dict:
+        """
+        This gets the record of each (day, beer), building the lookup of
+        the restored records the first time it is needed.
+        :return: a dictionary {(day, beer_id): record index}.
+        """
+        if self._records is None:
+            restored = self._restored
+            self._records = dict(zip(zip(restored[0].tolist(),
+                                         restored[1].tolist()),
+                                     range(restored.shape[1])))
+        return self._records
+
+    def add(self, day: int, beer_name: str, gyle: int,
+            quantity: int) -> bool:
+        """
+        This adds a sale to the record of the day and beer.
+        :param day: an integer of the date ordinal of the sale.
+        :param beer_name: a string containing the beer's name.
+        :param gyle: an integer of the batch number.
+        :param quantity: an integer representing number of bottle.
+        :return: True if a new record was created for the day and beer.
+        """
+        beer_id = self.beer_id(beer_name)
+        key = (day, beer_id)
+        record = self.records().get(key)
+        self._columns = None
+        self.series.add(day, beer_id, quantity)
+        self.version += 1
+        restored = self._restored.shape[1]
+        if record is not None and record < restored:
+            if not self._restored.flags.writeable:
+                self._restored = np.array(self._restored)
+            self._restored[3, record] += quantity
+            return False
+        if record is not None:
+            self._quantities[record - restored] += quantity
+            return False
+        self._records.update({key: len(self)})
+        self._days.append(day)
+        self._beer_idx.append(beer_id)
+        self._gyles.append(gyle)
+        self._quantities.append(quantity)
+        return True
+
+    def column(self, row: int) -> np.ndarray:
+        """
+        This gets a column of every record, the restored ones and the
+        ones added since.
+        :param row: an integer of the column, 0 to 3 for the day, beer,
+         gyle and quantity.
+        :return: an int32 array, a view of the restored column when no
+         record was added since.
+        """
+        added = (self._days, self._beer_idx, self._gyles,
+                 self._quantities)[row]
+        if not added:
+            return self._restored[row]
+        return np.concatenate((self._restored[row],
+                               np.array(added, dtype=np.int32)))
+
+    def columns(self) -> tuple:
+        """
+        This gets the records as numpy arrays.
+        :return: a tuple of the day, beer, gyle and quantity arrays.
+        """
+        if self._columns is None:
+            self._columns = (self.column(0), self.column(1),
+                             self.column(2),
+                             self.column(3).astype(np.int64))
+        return self._columns
+
+    def dump_columns(self) -> np.ndarray:
+        """
+        This gets the records as a single matrix, for snapshots.
+        :return: a (4, records) int32 matrix of the day, beer, gyle and
+         quantity columns.
+        """
+        return np.stack([self.column(row) for row in range(4)])
+
+    def restore_columns(self, beers: list, columns: np.ndarray):
+        """
+        This replaces the records with the ones of a snapshot. The
+        columns are kept as they are, so a memory mapped snapshot is
+        only read as the records are used.
+        :param beers: a list of the beer names in id order.
+        :param columns: a (4, records) int32 matrix as returned by
+         dump_columns, possibly memory mapped.
+        """
+        self.beers[:] = beers
+        self._beer_ids = {beer: index for index, beer in enumerate(beers)}
+        self._restored = np.asarray(columns, dtype=np.int32)
+        self._records = None
+        self._days, self._beer_idx, self._gyles, self._quantities = \
+            array('i'), array('i'), array('i'), array('i')
+        self.series = SalesTimeSeries(self.series.windows)
+        self.series.grow(len(beers))
+        self.series.load(self._restored[0], self._restored[1],
+                         self._restored[3])
+        self._columns = None
+        self.version += 1
+
+    def period_index(self):
+        """
+        This gets the period index of the current records, building it
+        again only when sales were added since the last call.
+        :return: a PeriodIndex.
+        """
+        if self._period_index is None or \
+                self._period_index.version != self.version:
+            self._period_index = PeriodIndex(self)
+        return self._period_index
+
+    def beer_totals(self, mask: np.ndarray = None) -> np.ndarray:
+        """
+        This sums the quantity of each beer over the selected records.
+        :param mask: a boolean array selecting records, or None for all.
+        :return: an array of the quantity for each beer.
+        """
+        _, beer, _, quantity = self.columns()
+        if mask is not None:
+            beer = beer[mask]
+            quantity = quantity[mask]
+        return np.bincount(beer, weights=quantity,
+                           minlength=len(self.beers)).astype(np.int64)
+
+    def day_records(self, day: int) -> list:
+        """
+        This gets the records that belong to a day.
+        :param day: an integer of the date ordinal.
+        :return: a list of the record indexes in insertion order.
+        """
+        records = self.records()
+        return [records[(day, beer_id)]
+                for beer_id in range(len(self.beers))
+                if (day, beer_id) in records]
+
+    def record(self, index: int) -> tuple:
+        """
+        This gets a single record.
+        :param index: an integer of the record's index.
+        :return: a tuple of the beer name, gyle and quantity.
+        """
+        restored = self._restored.shape[1]
+        if index < restored:
+            beer_id, gyle, quantity = self._restored[1:, index].tolist()
+        else:
+            index -= restored
+            beer_id, gyle, quantity = (self._beer_idx[index],
+                                       self._gyles[index],
+                                       self._quantities[index])
+        return self.beers[beer_id], gyle, quantity
+
+    def days(self) -> list:
+        """
+        This gets every day with sales in order of first appearance.
+        :return: a list of date ordinals.
+        """
+        days, first = np.unique(self.columns()[0], return_index=True)
+        return days[np.argsort(first)].tolist()
+
+
+class PeriodIndex(object):
+    """
+    This class contains the per beer cumulative sums of the sales over
+    the sorted days of a SalesStore, so the total of any date range is
+    a difference of two rows.
+    """
+
+    def __init__(self, store: SalesStore):
+        self.version = store.version
+        day, beer, _, quantity = store.columns()
+        n_beers = len(store.beers)
+        self.days = np.unique(day)
+        position = np.searchsorted(self.days, day)
+        daily = np.bincount(position * n_beers + beer, weights=quantity,
+                            minlength=len(self.days) * n_beers)
+        self.cumulative = np.zeros((len(self.days) + 1, n_beers),
+                                   dtype=np.int64)
+        np.cumsum(daily.astype(np.int64).reshape(-1, n_beers), axis=0,
+                  out=self.cumulative[1:])
+
+    def range_totals(self, start: int, end: int) -> np.ndarray:
+        """
+        This sums the quantity of each beer over a range of the sorted
+        days.
+        :param start: an integer of the first day position.
+        :param end: an integer one past the last day position.
+        :return: an array of the quantity for each beer.
+        """
+        return self.cumulative[end] - self.cumulative[start]
+
+    def date_range_totals(self, first_day: int,
+                          last_day: int) -> np.ndarray:
+        """
+        This sums the quantity of each beer between two dates.
+        :param first_day: an integer of the first date ordinal.
+        :param last_day: an integer of the last date ordinal, included.
+        :return: an array of the quantity for each beer.
+        """
+        start = np.searchsorted(self.days, first_day, side='left')
+        end = np.searchsorted(self.days, last_day, side='right')
+        return self.range_totals(start, max(start, end))
+
+    def last_day(self) -> int:
+        """
+        This gets the last day with sales.
+        :return: an integer of the date ordinal, or None if empty.
+        """
+        if not len(self.days):
+            return None
+        return int(self.days[-1])
+
+
+class DailySalesView(Mapping):
+    """
+    This class is a read-only view of a SalesStore shaped like the
+    original sales dictionary: {datetime: {beer: {"gyle_number",
+    "quantity"}, "sales_per_day": int}}.
+    """
+
+    def __init__(self, store: SalesStore, sales_per_day_key: str):
+        self._store = store
+        self._sales_per_day_key = sales_per_day_key
+
+    def __getitem__(self, key):
+        if not isinstance(key, (date, datetime)):
+            raise KeyError(key)
+        records = self._store.day_records(key.toordinal())
+        if not records:
+            raise KeyError(key)
+        day_obj = {}
+        total = 0
+        for index in sorted(records):
+            beer, gyle, quantity = self._store.record(index)
+            day_obj.update({beer: {"gyle_number": gyle,
+                                   "quantity": quantity}})
+            total += quantity
+        day_obj.update({self._sales_per_day_key: total})
+        return day_obj
+
+    def __iter__(self):
+        for day in self._store.days():
+            yield datetime.fromordinal(day)
+
+    def __len__(self):
+        return len(self._store.days())
@@ -0,0 +1,299 @@
+"""
+This module is a program that keeps the sales of each beer as a time
+series keyed by (year, month) and by (ISO year, ISO week), so several
+years of history don't collapse into the same month or week. Trailing
+window totals over the latest weeks, such as the last 4, 13 and 52
+weeks, are kept up to date in constant time per appended sale.
+"""
+from datetime import date
+import numpy as np
+
+# the trailing windows, in weeks, kept up to date on every sale
+ROLLING_WINDOWS = (4, 13, 52)
+
+# date(1970, 1, 1).toordinal(), used to turn ordinals into datetime64
+EPOCH_ORDINAL = 719163
+
+
+def week_of(day: int) -> int:
+    """
+    This gets the week of a date ordinal as a count of weeks, so
+    consecutive weeks have consecutive numbers.
+    :param day: an integer of the date ordinal.
+    :return: an integer of the week, counted from ordinal 1 (a Monday).
+    """
+    return (day - 1) // 7
+
+
+def iso_week_monday(year: int, week: int) -> int:
+    """
+    This gets the Monday of an ISO week.
+    :param year: an integer of the ISO year.
+    :param week: an integer of the ISO week number.
+    :return: an integer of the date ordinal of the Monday, or None if
+     the year has no such week.
+    """
+    if year is None or not 0 < week <= 53:
+        return None
+    # the 4th of January is always in the first ISO week
+    fourth = date(year, 1, 4)
+    monday = fourth.toordinal() - fourth.weekday() + (week - 1) * 7
+    if date.fromordinal(monday).isocalendar()[:2] != (year, week):
+        return None
+    return monday
+
+
+def pad(quantities: list, size: int) -> list:
+    """
+    This pads a list of per beer quantities with zeros for the beers
+    that were added after it was created.
+    :param quantities: a list of quantities indexed by beer id.
+    :param size: an integer of the number of beers.
+    :return quantities: the same list, padded in place.
+    """
+    if len(quantities) < size:
+        quantities.extend([0] * (size - len(quantities)))
+    return quantities
+
+
+class SalesTimeSeries(object):
+    """
+    This class contains the quantity of each beer per (year, month) and
+    per week, and the totals of the trailing windows ending at the
+    latest week with sales.
+    """
+
+    def __init__(self, windows: tuple = ROLLING_WINDOWS):
+        self.windows = tuple(windows)
+        self.n_beers = 0
+        self.latest_week = None
+        self._months = {}
+        self._weeks = {}
+        self._latest_year = {}
+        self._rolling = {weeks: [] for weeks in self.windows}
+
+    def grow(self, n_beers: int):
+        """
+        This makes room for new beers in the totals.
+        :param n_beers: an integer of the number of beers.
+        """
+        self.n_beers = max(self.n_beers, n_beers)
+
+    def add(self, day: int, beer_id: int, quantity: int):
+        """
+        This appends a sale to its month, its week and the trailing
+        windows that include its week.
+        :param day: an integer of the date ordinal of the sale.
+        :param beer_id: an integer of the beer's id.
+        :param quantity: an integer representing number of bottle.
+        """
+        self.grow(beer_id + 1)
+        day_obj = date.fromordinal(day)
+        week = week_of(day)
+        iso_year, iso_week = day_obj.isocalendar()[:2]
+        for key, year in ((("month", day_obj.month), day_obj.year),
+                          (("week", iso_week), iso_year)):
+            if self._latest_year.get(key, year) <= year:
+                self._latest_year[key] = year
+        month = self._months.setdefault((day_obj.year, day_obj.month), [])
+        pad(month, beer_id + 1)[beer_id] += quantity
+        pad(self._weeks.setdefault(week, []), beer_id + 1)[beer_id] += \
+            quantity
+        self.advance(week)
+        for weeks, totals in self._rolling.items():
+            if week > self.latest_week - weeks:
+                pad(totals, beer_id + 1)[beer_id] += quantity
+
+    def load(self, days: np.ndarray, beer_ids: np.ndarray,
+             quantities: np.ndarray):
+        """
+        This replaces the totals with the ones of columns of sales, such
+        as a restored snapshot. The sales are grouped by month and week
+        in numpy, so the result is the same as adding them one by one,
+        without a Python loop over the sales.
+        :param days: an array of the date ordinals of the sales.
+        :param beer_ids: an array of the beer ids.
+        :param quantities: an array of the quantities.
+        """
+        self.latest_week = None
+        self._months, self._weeks, self._latest_year = {}, {}, {}
+        self._rolling = {weeks: [] for weeks in self.windows}
+        if not len(days):
+            return
+        days = np.asarray(days, dtype=np.int64)
+        beer_ids = np.asarray(beer_ids, dtype=np.int64)
+        self.grow(int(beer_ids.max()) + 1)
+        months = (days - EPOCH_ORDINAL).astype('datetime64[D]') \
+            .astype('datetime64[M]').astype(np.int64)
+        buckets = {}
+        for kind, codes in (("month", months), ("week", (days - 1) // 7)):
+            keys, rows = np.unique(codes, return_inverse=True)
+            totals = np.zeros((len(keys), self.n_beers), dtype=np.int64)
+            np.add.at(totals, (rows, beer_ids), quantities)
+            buckets.update({kind: (keys.tolist(), totals)})
+        keys, totals = buckets["month"]
+        for key, bucket in zip(keys, totals.tolist()):
+            year, month = key // 12 + 1970, key % 12 + 1
+            self._months.update({(year, month): bucket})
+            if self._latest_year.get(("month", month), year) <= year:
+                self._latest_year[("month", month)] = year
+        keys, totals = buckets["week"]
+        for week, bucket in zip(keys, totals.tolist()):
+            self._weeks.update({week: bucket})
+            iso_year, iso_week = \
+                date.fromordinal(week * 7 + 1).isocalendar()[:2]
+            if self._latest_year.get(("week", iso_week), iso_year) <= \
+                    iso_year:
+                self._latest_year[("week", iso_week)] = iso_year
+        self.latest_week = keys[-1]
+        for weeks in self.windows:
+            self._rolling[weeks] = totals[np.asarray(keys) >
+                                          self.latest_week - weeks] \
+                .sum(axis=0).tolist()
+
+    def advance(self, week: int):
+        """
+        This moves the trailing windows on to end at a week, taking out
+        the weeks that drop out of them. Every week drops out of a
+        window once, so the cost is constant per week.
+        :param week: an integer of the week of the latest sale.
+        """
+        if self.latest_week is None:
+            self.latest_week = week
+            return
+        if week <= self.latest_week:
+            return
+        for weeks, totals in self._rolling.items():
+            first = self.latest_week - weeks + 1
+            for dropped in range(first,
+                                 min(self.latest_week, week - weeks) + 1):
+                for beer_id, quantity in \
+                        enumerate(self._weeks.get(dropped, ())):
+                    totals[beer_id] -= quantity
+        self.latest_week = week
+
+    def totals(self, quantities) -> np.ndarray:
+        """
+        This formats per beer quantities as an array of every beer.
+        :param quantities: a list of quantities indexed by beer id, or
+         None.
+        :return: an array of the quantity for each beer.
+        """
+        totals = np.zeros(self.n_beers, dtype=np.int64)
+        if quantities:
+            totals[:len(quantities)] = quantities
+        return totals
+
+    def latest_year(self, kind: str, period: int) -> int:
+        """
+        This gets the latest year with sales in a month or week.
+        :param kind: a string of the period kind, "month" or "week".
+        :param period: an integer of the month or ISO week number.
+        :return: an integer of the year, or None if it has no sales.
+        """
+        return self._latest_year.get((kind, period))
+
+    def month_totals(self, month: int, year: int = None) -> np.ndarray:
+        """
+        This sums the quantity of each beer over a month.
+        :param month: an integer of the month number.
+        :param year: an integer of the year, by default the latest year
+         with sales in that month.
+        :return: an array of the quantity for each beer.
+        """
+        if year is None:
+            year = self.latest_year("month", month)
+        return self.totals(self._months.get((year, month)))
+
+    def week_totals(self, week: int, year: int = None) -> np.ndarray:
+        """
+        This sums the quantity of each beer over an ISO week.
+        :param week: an integer of the ISO week number.
+        :param year: an integer of the ISO year, by default the latest
+         year with sales in that week.
+        :return: an array of the quantity for each beer.
+        """
+        if year is None:
+            year = self.latest_year("week", week)
+        monday = iso_week_monday(year, week)
+        if monday is None:
+            return self.totals(None)
+        return self.totals(self._weeks.get(week_of(monday)))
+
+    def rolling_totals(self, weeks: int) -> np.ndarray:
+        """
+        This sums the quantity of each beer over the trailing weeks
+        ending at the latest week with sales.
+        :param weeks: an integer of the number of weeks, such as 4, 13
+         or 52. Windows that aren't kept up to date are summed from the
+         weekly totals.
+        :return: an array of the quantity for each beer.
+        """
+        if weeks in self._rolling:
+            return self.totals(self._rolling[weeks])
+        totals = self.totals(None)
+        if self.latest_week is not None:
+            for week in range(self.latest_week - weeks + 1,
+                              self.latest_week + 1):
+                quantities = self._weeks.get(week)
+                if quantities:
+                    totals[:len(quantities)] += quantities
+        return totals
+
+    def month_keys(self) -> list:
+        """
+        This gets every month with sales in order.
+        :return: a sorted list of (year, month) tuples.
+        """
+        return sorted(self._months)
+
+    def week_keys(self) -> list:
+        """
+        This gets every week with sales in order.
+        :return: a sorted list of (ISO year, ISO week) tuples.
+        """
+        return [date.fromordinal(week * 7 + 1).isocalendar()[:2]
+                for week in sorted(self._weeks)]
+
+    def matrix(self, buckets: dict, keys: list) -> np.ndarray:
+        """
+        This gathers the quantities of some buckets as a matrix.
+        :param buckets: a dictionary of per beer quantities.
+        :param keys: a list of the bucket keys, in order.
+        :return: a (bucket, beer) matrix of quantities.
+        """
+        matrix = np.zeros((len(keys), self.n_beers), dtype=np.int64)
+        for row, key in enumerate(keys):
+            quantities = buckets.get(key)
+            if quantities:
+                matrix[row, :len(quantities)] = quantities
+        return matrix
+
+    def month_matrix(self) -> tuple:
+        """
+        This gets every month from the first to the latest with sales,
+        including the months without sales.
+        :return: a tuple of the list of (year, month) tuples and the
+         (month, beer) matrix of quantities.
+        """
+        if not self._months:
+            return [], self.matrix({}, [])
+        first, last = min(self._months), max(self._months)
+        keys = [divmod(month, 12) for month in
+                range(first[0] * 12 + first[1] - 1,
+                      last[0] * 12 + last[1])]
+        keys = [(year, month + 1) for year, month in keys]
+        return keys, self.matrix(self._months, keys)
+
+    def week_matrix(self) -> tuple:
+        """
+        This gets every week from the first to the latest with sales,
+        including the weeks without sales.
+        :return: a tuple of the list of (ISO year, ISO week) tuples and
+         the (week, beer) matrix of quantities.
+        """
+        if not self._weeks:
+            return [], self.matrix({}, [])
+        weeks = list(range(min(self._weeks), self.latest_week + 1))
+        return ([date.fromordinal(week * 7 + 1).isocalendar()[:2]
+                 for week in weeks], self.matrix(self._weeks, weeks))
@@ -0,0 +1,81 @@
+"""
+This module is a program that benchmarks the sharded engine: every site
+runs in a shard process of its own with the brewhouse's tanks, and a
+thread per site brews batches of gyles from start to finish on it. The
+aggregate gyles per second is printed for each number of sites.
+
+    python shard_benchmark.py [--sites 1,2,4] [--batches N] [--batch N]
+"""
+import argparse
+import threading
+import time
+import brew_process_dict
+from brew_shard import start_shards
+
+
+def brew(shard, batches: int, batch: int):
+    """
+    This brews batches of gyles from start to finish on a shard.
+    :param shard: a BrewShard.
+    :param batches: an integer of the number of batches.
+    :param batch: an integer of the number of gyles per batch.
+    """
+    for number in range(batches):
+        gyles = [(number * batch + gyle, "Organic Dunkel", 100)
+                 for gyle in range(batch)]
+        shard.call("create", gyles)
+        moving = gyles
+        while moving:
+            results = shard.call("move", moving)
+            moving = [gyle for gyle, result in zip(moving, results)
+                      if result is not None and
+                      result.get("state") != "finish"]
+        shard.call("remove", gyles)
+
+
+def run(sites: int, batches: int, batch: int) -> float:
+    """
+    This brews on every site at once.
+    :param sites: an integer of the number of sites.
+    :param batches: an integer of the number of batches per site.
+    :param batch: an integer of the number of gyles per batch.
+    :return: a float of the aggregate gyles per second.
+    """
+    shards = start_shards({"site-{}".format(site): brew_process_dict.TANKS
+                           for site in range(sites)})
+    try:
+        # a warm-up batch, once the shard processes are up
+        for shard in shards.values():
+            brew(shard, 1, batch)
+        threads = [threading.Thread(target=brew,
+                                    args=(shard, batches, batch))
+                   for shard in shards.values()]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sites * batches * batch / (time.perf_counter() - started)
+    finally:
+        for shard in shards.values():
+            shard.stop()
+
+
+def main():
+    """
+    This runs the benchmark and prints the gyles per second.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sites", default="1,2,4")
+    parser.add_argument("--batches", type=int, default=200)
+    parser.add_argument("--batch", type=int, default=5,
+                        help="gyles per batch, fewer than the fermenters")
+    args = parser.parse_args()
+    print("{:>6} {:>12}".format("sites", "gyles/s"))
+    for sites in [int(count) for count in args.sites.split(",")]:
+        print("{:>6} {:>12.0f}".format(sites, run(sites, args.batches,
+                                                  args.batch)))
+
+
+if __name__ == '__main__':
+    main()
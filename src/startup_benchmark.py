@@ -0,0 +1,66 @@
+"""
+This module is a program that benchmarks the start up of the web
+server. Every run imports app in a fresh python process and reports the
+import time and the latency from the start of the import to the end of
+the first request to the home page.
+
+    python startup_benchmark.py [--runs N] [--warm-up]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+
+def measure(warm_up: bool) -> dict:
+    """
+    This imports app and serves its first request.
+    :param warm_up: True to start the warm-up thread after the import.
+    :return: a dictionary of the timings in seconds.
+    """
+    started = time.perf_counter()
+    import app
+    imported = time.perf_counter()
+    if warm_up:
+        app.start_warm_up()
+    client = app.app.test_client()
+    response = client.get('/home')
+    served = time.perf_counter()
+    return {"import": imported - started,
+            "first_request": served - imported,
+            "import_to_first_request": served - started,
+            "status": response.status_code}
+
+
+def main():
+    """
+    This runs the benchmark and prints the median timings.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--warm-up", action="store_true")
+    parser.add_argument("--child", action="store_true",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        print(json.dumps(measure(args.warm_up)))
+        return
+    command = [sys.executable, __file__, "--child"]
+    if args.warm_up:
+        command.append("--warm-up")
+    runs = []
+    for _ in range(args.runs):
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    print("{:<24} {}".format("status", ", ".join(
+        str(run["status"]) for run in runs)))
+    for key in ("import", "first_request", "import_to_first_request"):
+        print("{:<24} {:8.1f} ms".format(
+            key, statistics.median(run[key] for run in runs) * 1000))
+
+
+if __name__ == '__main__':
+    main()
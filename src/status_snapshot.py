@@ -0,0 +1,97 @@
+"""
+This module is a program that publishes read-only, versioned copies of
+the status of the brewhouse: the tanks, the processes and the stock. A
+writer changes its state and either publishes a frozen copy of it
+straight away, or marks the copy stale for the next reader to build
+again. A copy and its version are swapped in with one assignment, so a
+reader gets a consistent view without taking a lock, and a reader that
+saw the version already can skip its work.
+"""
+
+
+class FrozenDict(dict):
+    """
+    This class contains a dictionary that can't be changed. It is still
+    a dict, so the templates render it, jsonify serialises it and the
+    shards pickle it as one.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("A status snapshot is read-only.")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+def freeze(value):
+    """
+    This copies a value deeply into dictionaries and tuples that can't
+    be changed.
+    :param value: a value, such as a dictionary of dictionaries.
+    :return: the frozen copy.
+    """
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class VersionedSnapshot(object):
+    """
+    This class contains the last published copy of some state and its
+    version, and the version of the state itself, which the writers
+    increase on every change. A stale copy is built again by calling
+    build under the lock of the state, which the writers must hold.
+    """
+
+    def __init__(self, build=None, lock=None):
+        self._build = build
+        self._lock = lock
+        self.version = 0
+        self._current = (0, FrozenDict())
+
+    def publish(self, value):
+        """
+        This publishes a frozen copy of the state.
+        :param value: the state, such as a dictionary.
+        """
+        self.version += 1
+        self._current = (self.version, freeze(value))
+
+    def publish_item(self, key, value):
+        """
+        This publishes a copy of the state with one item changed. The
+        other items are shared with the last copy, as they didn't change.
+        :param key: the key of the item, such as a tank's name.
+        :param value: the item's value.
+        """
+        copy = FrozenDict(self._current[1])
+        dict.__setitem__(copy, key, freeze(value))
+        self.version += 1
+        self._current = (self.version, copy)
+
+    def invalidate(self):
+        """
+        This marks the copy stale, for the next reader to build again.
+        """
+        self.version += 1
+
+    def read(self) -> tuple:
+        """
+        This gets the copy of the state. A stale copy is built again,
+        under the lock, once for every reader waiting for it.
+        :return: a tuple of the version and the frozen copy.
+        """
+        current = self._current
+        if current[0] == self.version or self._build is None:
+            return current
+        with self._lock:
+            current = self._current
+            if current[0] != self.version:
+                current = (self.version, freeze(self._build()))
+                self._current = current
+        return current
@@ -0,0 +1,100 @@
+"""
+This module is a program that benchmarks the tank allocator on
+synthetic brewhouses of hundreds or thousands of vessels: the free-tank
+pool against the linear scan of every tank it replaced. Random gyles
+take and release tanks with about half of the vessels busy, and the
+allocations per second are printed for each size.
+
+    python tank_benchmark.py [--tanks 100,1000,10000] [--operations N]
+"""
+import argparse
+import random
+import time
+from tank_pool import TankPool
+
+CAPABILITIES = (["fermenter"], ["conditioner"], ["fermenter",
+                                                 "conditioner"])
+
+
+def build_tanks(count: int, seed: int = 0) -> dict:
+    """
+    This builds a synthetic brewhouse.
+    :param count: an integer of the number of tanks.
+    :param seed: an integer seeding the volumes and capabilities.
+    :return: a dictionary of the tanks, in the layout of TANKS.
+    """
+    draw = random.Random(seed)
+    return {"tank-{}".format(index): {
+        "volume": draw.choice((500, 680, 800, 1000, 1500, 2000)),
+        "capability": list(draw.choice(CAPABILITIES)),
+        "used_capacity": 0} for index in range(count)}
+
+
+def scan(tanks: dict, capability: str, volume: float) -> str:
+    """
+    This takes the first free tank big enough, scanning every tank, as
+    get_tank_for_capability used to.
+    :param tanks: a dictionary of the tanks.
+    :param capability: a string of the capability.
+    :param volume: a float of the volume needed.
+    :return: a string of the tank's name, or None.
+    """
+    for tank in tanks:
+        if capability in tanks[tank]["capability"]:
+            if volume <= tanks[tank]["volume"] and \
+                    tanks[tank]["used_capacity"] == 0:
+                tanks[tank]["used_capacity"] = volume
+                return tank
+    return None
+
+
+def run(tanks: dict, operations: int, use_pool: bool) -> float:
+    """
+    This takes and releases tanks at random.
+    :param tanks: a dictionary of the tanks.
+    :param operations: an integer of the number of allocations.
+    :param use_pool: True to allocate from a TankPool, False to scan.
+    :return: a float of the allocations per second.
+    """
+    draw = random.Random(1)
+    pool = TankPool(tanks) if use_pool else None
+    busy = []
+    requests = [(draw.choice(("fermenter", "conditioner")),
+                 draw.choice((250, 400, 500, 750))) for _ in
+                range(operations)]
+    started = time.perf_counter()
+    for capability, volume in requests:
+        if pool is not None:
+            tank = pool.take(capability, volume)
+            if tank is not None:
+                tanks[tank]["used_capacity"] = volume
+        else:
+            tank = scan(tanks, capability, volume)
+        if tank is not None:
+            busy.append(tank)
+        # about half of the vessels stay busy
+        if len(busy) > len(tanks) // 2 or tank is None and busy:
+            released = busy.pop(draw.randrange(len(busy)))
+            tanks[released]["used_capacity"] = 0
+            if pool is not None:
+                pool.give(released)
+    return operations / (time.perf_counter() - started)
+
+
+def main():
+    """
+    This runs the benchmark and prints the allocations per second.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tanks", default="100,1000,10000")
+    parser.add_argument("--operations", type=int, default=20000)
+    args = parser.parse_args()
+    print("{:>8} {:>14} {:>14}".format("tanks", "pool/s", "scan/s"))
+    for count in [int(size) for size in args.tanks.split(",")]:
+        print("{:>8} {:>14.0f} {:>14.0f}".format(
+            count, run(build_tanks(count), args.operations, True),
+            run(build_tanks(count), args.operations, False)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+This module is a program that keeps the free tanks of each capability
+ordered by volume. Allocating finds the smallest free tank that is big
+enough with a binary search, instead of scanning every tank, and of
+the tanks of that volume the one with the fewest capabilities, so a
+fermenter-only tank is taken before one a conditioning gyle could use.
+Releasing a tank returns it to the pool of each of its capabilities.
+"""
+from bisect import bisect_left, insort
+
+
+class TankPool(object):
+    """
+    This class contains, for each capability, the free tanks as a list
+    of (volume, capabilities, order, name) tuples sorted by volume, then
+    by the number of capabilities. Tanks alike are taken in the order of
+    the tanks dictionary, as the linear scan did. The caller must hold
+    the engine lock.
+    """
+
+    def __init__(self, tanks: dict):
+        self.tanks = tanks
+        self._free = {}
+        self._entries = {}
+        self.rebuild()
+
+    def rebuild(self):
+        """
+        This builds the pools again from the tanks dictionary, for when
+        it was replaced or changed outside the pool.
+        """
+        self._free = {}
+        self._entries = {}
+        for order, (name, spec) in enumerate(self.tanks.items()):
+            self._entries.update({name: (spec["volume"],
+                                         len(spec["capability"]), order,
+                                         name)})
+            for capability in spec["capability"]:
+                self._free.setdefault(capability, [])
+            if spec["used_capacity"] == 0:
+                self.give(name)
+
+    def is_free(self, name: str) -> bool:
+        """
+        This checks that a tank is in the pools.
+        :param name: a string of the tank's name.
+        :return: True if the tank is free.
+        """
+        capabilities = self.tanks[name]["capability"]
+        if not capabilities:
+            return False
+        free = self._free[capabilities[0]]
+        entry = self._entries[name]
+        index = bisect_left(free, entry)
+        return index < len(free) and free[index] == entry
+
+    def take(self, capability: str, volume: float) -> str:
+        """
+        This takes the smallest free tank of a capability that holds a
+        volume, and the least versatile of those, out of every pool.
+        :param capability: a string of the capability, such as
+         "fermenter".
+        :param volume: a float of the volume needed.
+        :return: a string of the tank's name, or None if none is free.
+        """
+        free = self._free.get(capability)
+        if not free:
+            return None
+        index = bisect_left(free, (volume,))
+        if index == len(free):
+            return None
+        name = free[index][-1]
+        entry = self._entries[name]
+        for tank_capability in self.tanks[name]["capability"]:
+            pool = self._free[tank_capability]
+            del pool[bisect_left(pool, entry)]
+        return name
+
+    def give(self, name: str):
+        """
+        This returns a tank to the pool of each of its capabilities.
+        Returning a free tank does nothing.
+        :param name: a string of the tank's name.
+        """
+        if self.is_free(name):
+            return
+        entry = self._entries[name]
+        for capability in self.tanks[name]["capability"]:
+            insort(self._free.setdefault(capability, []), entry)
+
+    def free_count(self, capability: str) -> int:
+        """
+        This counts the free tanks of a capability.
+        :param capability: a string of the capability.
+        :return: an integer of the number of free tanks.
+        """
+        return len(self._free.get(capability, ()))
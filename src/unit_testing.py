@@ -1,18 +1,44 @@
 """
 This module is a program carries out unit testing.
 """
+import asyncio
+import os
+import pickle
+import random
+import tempfile
+import threading
 import unittest
-from datetime import datetime
+from datetime import datetime, date
 from time import strptime
 
+import numpy as np
+
+import brew_engine
+import brew_logger
+import brew_metrics
 import brew_process
+import brew_process_dict
+import brew_scheduler
+import brew_shard
+import brew_simulator
+import sales_ingest
+import sales_forecast
 import sales_predictor
+import sales_snapshot
+import sales_store
+import sales_timeseries
+import status_snapshot
+import tank_pool
 
 
 class TestSalesPredictor(unittest.TestCase):
     """
     TestSalesPredictor
     """
+    @classmethod
+    def setUpClass(cls):
+        sales_predictor.ensure_sales_loaded()
+
     def test_months_list(self):
         """
         test_months_list
@@ -92,6 +118,70 @@ class TestSalesPredictor(unittest.TestCase):
             self.assertGreater(monthly_growth_rate[beer], 0)
             self.assertGreater(weekly_growth_rate[beer], 0)
 
+    def test_incremental_growth_rate(self):
+        """
+        test_incremental_growth_rate
+        :return:
+        """
+        models = sales_predictor.growth_rate_models
+        for kind in models:
+            models[kind].rates()
+        store = sales_predictor.sales_store
+        # the sale is taken out again, so the other tests see the csv
+        names = list(store.beers)
+        columns = store.dump_columns()
+        gyles = dict(sales_predictor.highest_gyle_number_for_beers)
+        try:
+            last_date = max(sales_predictor.sales_data)
+            sales_predictor.add_sale(last_date, sales_predictor.beers[0],
+                                     0, 1)
+            for kind, periods in (("month", sales_predictor.months),
+                                  ("week", sales_predictor.weeks)):
+                self.assertEqual(models[kind].version, store.version)
+                growth_rate = sales_predictor.calculate_growth_rate(
+                    periods)
+                rates = models[kind].rates()
+                for beer in sales_predictor.beers:
+                    self.assertAlmostEqual(rates[beer], growth_rate[beer],
+                                           delta=0.01)
+        finally:
+            store.restore_columns(names, columns)
+            sales_predictor.update_sales_summary()
+            sales_predictor.highest_gyle_number_for_beers.clear()
+            sales_predictor.highest_gyle_number_for_beers.update(gyles)
+
+    def test_missing_period(self):
+        """
+        test_missing_period
+        :return:
+        """
+        for period in (None, "", "Week", 44):
+            for total in (sales_predictor.total_month_beers_qty(period),
+                          sales_predictor.total_week_beers_qty(period)):
+                self.assertEqual(set(total.values()), {0})
+        self.assertEqual(sales_predictor.predict_week_beer_qty(None)
+                         ["total"], 0)
+
+    def test_date_range_totals(self):
+        """
+        test_date_range_totals
+        :return:
+        """
+        sales_data = sales_predictor.sales_data
+        start_date = datetime(2019, 1, 10)
+        end_date = datetime(2019, 3, 20)
+        range_qty = sales_predictor.total_range_beers_qty(start_date,
+                                                          end_date)
+        total = sum(sales_data[date]["sales_per_day"]
+                    for date in sales_data
+                    if start_date <= date <= end_date)
+        self.assertEqual(range_qty["total"], total)
+        last_date = max(sales_data)
+        last_qty = sales_predictor.total_last_days_beers_qty(30)
+        total = sum(sales_data[date]["sales_per_day"]
+                    for date in sales_data
+                    if (last_date - date).days < 30)
+        self.assertEqual(last_qty["total"], total)
 
     def test_sales_predictions(self):
         """
@@ -107,11 +197,283 @@ class TestSalesPredictor(unittest.TestCase):
                 self.assertGreaterEqual(predict_month[element],
                                         current_month[element])
 
+    def test_batch_predictions(self):
+        """
+        test_batch_predictions
+        :return:
+        """
+        forecast = sales_predictor.predict_all_beers_qty()
+        self.assertEqual(forecast["periods"],
+                         sales_predictor.get_periods())
+        for row, period in enumerate(forecast["periods"]):
+            if period in sales_predictor.months:
+                predicted = sales_predictor.predict_month_beer_qty(period)
+            else:
+                predicted = sales_predictor.predict_week_beer_qty(period)
+            self.assertEqual(forecast["totals"][row], predicted["total"])
+            for column, beer in enumerate(forecast["beers"]):
+                self.assertEqual(forecast["quantities"][row][column],
+                                 predicted[beer])
+
+    def test_recommended_sales(self):
+        """
+        test_recommended_sales
+        :return:
+        """
+        recommended_sales = sales_predictor.get_recommended_sales()
+        self.assertEqual(sorted(recommended_sales),
+                         sorted(sales_predictor.beers))
+        for beer in recommended_sales:
+            self.assertGreaterEqual(recommended_sales[beer], 0)
+
+
+class TestSalesTimeSeries(unittest.TestCase):
+    """
+    TestSalesTimeSeries
+    """
+    def test_years_kept_apart(self):
+        """
+        test_years_kept_apart
+        :return:
+        """
+        series = sales_timeseries.SalesTimeSeries()
+        series.add(date(2018, 10, 29).toordinal(), 0, 5)
+        series.add(date(2019, 10, 30).toordinal(), 1, 7)
+        self.assertEqual(series.month_totals(10).tolist(), [0, 7])
+        self.assertEqual(series.month_totals(10, 2018).tolist(), [5, 0])
+        self.assertEqual(series.week_totals(44).tolist(), [0, 7])
+        self.assertEqual(series.week_totals(44, 2018).tolist(), [5, 0])
+        self.assertEqual(series.month_keys(), [(2018, 10), (2019, 10)])
+        self.assertEqual(series.week_keys(), [(2018, 44), (2019, 44)])
+
+    def test_rolling_totals(self):
+        """
+        test_rolling_totals
+        :return:
+        """
+        generator = random.Random(7)
+        series = sales_timeseries.SalesTimeSeries()
+        series.grow(3)
+        first_day = date(2017, 1, 1).toordinal()
+        sales = []
+        for day in range(first_day, first_day + 1200, 3):
+            # some sales arrive late, up to 60 days after their day
+            sale_day = day - generator.choice((0, 0, 0, 20, 60))
+            sale = (sale_day, generator.randrange(3),
+                    generator.randrange(1, 50))
+            series.add(*sale)
+            sales.append(sale)
+            latest = max(sales_timeseries.week_of(sale[0])
+                         for sale in sales)
+            for weeks in (4, 13, 52, 8):
+                expected = [0, 0, 0]
+                for sale_day, beer_id, quantity in sales:
+                    if latest - weeks < \
+                            sales_timeseries.week_of(sale_day):
+                        expected[beer_id] += quantity
+                self.assertEqual(series.rolling_totals(weeks).tolist(),
+                                 expected)
+
+    def test_load_columns(self):
+        """
+        test_load_columns
+        :return:
+        """
+        generator = random.Random(11)
+        first_day = date(2017, 12, 20).toordinal()
+        sales = [(first_day + generator.randrange(800),
+                  generator.randrange(3), generator.randrange(1, 50))
+                 for _ in range(2000)]
+        added = sales_timeseries.SalesTimeSeries()
+        for sale in sales:
+            added.add(*sale)
+        loaded = sales_timeseries.SalesTimeSeries()
+        loaded.load(*map(np.array, zip(*sales)))
+        self.assertEqual(loaded.month_keys(), added.month_keys())
+        self.assertEqual(loaded.week_keys(), added.week_keys())
+        self.assertEqual(loaded.month_matrix()[1].tolist(),
+                         added.month_matrix()[1].tolist())
+        self.assertEqual(loaded.week_matrix()[1].tolist(),
+                         added.week_matrix()[1].tolist())
+        for month in range(1, 13):
+            self.assertEqual(loaded.month_totals(month).tolist(),
+                             added.month_totals(month).tolist())
+        for week in range(1, 54):
+            self.assertEqual(loaded.week_totals(week).tolist(),
+                             added.week_totals(week).tolist())
+        for weeks in (4, 13, 52, 8):
+            self.assertEqual(loaded.rolling_totals(weeks).tolist(),
+                             added.rolling_totals(weeks).tolist())
+
+
+class TestSalesForecast(unittest.TestCase):
+    """
+    TestSalesForecast
+    """
+    def test_seasonal_model_selected(self):
+        """
+        test_seasonal_model_selected
+        :return:
+        """
+        season = [10, 20, 40, 80, 40, 20]
+        values = np.array([quantity + year * 5 for year in range(4)
+                           for quantity in season])
+        fit = sales_forecast.fit_beer("Organic Dunkel", values, 6, 6)
+        self.assertEqual(fit["model"], "holt_winters")
+        self.assertEqual(len(fit["forecast"]), 6)
+        self.assertEqual(fit["forecast"].index(max(fit["forecast"])), 3)
+
+    def test_engine_refit(self):
+        """
+        test_engine_refit
+        :return:
+        """
+        store = sales_store.SalesStore()
+        first_day = date(2019, 1, 7).toordinal()
+        for week in range(20):
+            store.add(first_day + week * 7, "Organic Dunkel", 1,
+                      100 + week)
+            store.add(first_day + week * 7, "Organic Pilsner", 2, 50)
+        engine = sales_forecast.ForecastEngine(store, workers=2)
+        try:
+            fits = engine.refit("week").result(timeout=60)
+            self.assertEqual(fits["version"], store.version)
+            self.assertEqual(sorted(fits["beers"]), sorted(store.beers))
+            for fit in fits["beers"].values():
+                self.assertIn(fit["model"], sales_forecast.MODELS)
+                self.assertEqual(len(fit["forecast"]),
+                                 sales_forecast.FORECAST_STEPS["week"])
+            self.assertIs(engine.forecast("week"), fits)
+            store.add(first_day + 140, "Organic Dunkel", 1, 120)
+            self.assertIsNot(engine.refit("week").result(timeout=60),
+                             fits)
+        finally:
+            engine.shutdown()
+
+
+class TestSalesStore(unittest.TestCase):
+    """
+    TestSalesStore
+    """
+    def test_daily_sales_view(self):
+        """
+        test_daily_sales_view
+        :return:
+        """
+        store = sales_store.SalesStore()
+        day = date(2019, 3, 1).toordinal()
+        self.assertTrue(store.add(day, "Organic Dunkel", 7, 10))
+        self.assertFalse(store.add(day, "Organic Dunkel", 8, 5))
+        self.assertTrue(store.add(day + 40, "Organic Pilsner", 9, 3))
+        self.assertEqual(len(store), 2)
+        self.assertEqual(store.beer_totals().tolist(), [15, 3])
+        view = sales_store.DailySalesView(store, "sales_per_day")
+        self.assertEqual(view[datetime.fromordinal(day)],
+                         {"Organic Dunkel": {"gyle_number": 7,
+                                             "quantity": 15},
+                          "sales_per_day": 15})
+
+
+class TestSalesIngest(unittest.TestCase):
+    """
+    TestSalesIngest
+    """
+    def test_ingest_rows(self):
+        """
+        test_ingest_rows
+        :return:
+        """
+        rows = [["1", "A", "02-Nov-18", "Organic Dunkel", "90", "12"],
+                ["2", "B", "02-Nov-18", "Organic Dunkel", "91", "9"],
+                ["3", "C", "31-Feb-18", "Organic Dunkel", "92", "1"],
+                ["4", "D", "02-Nov-18", "Organic Pilsner", "x", "1"],
+                ["5", "E", "02-Nov-18", "Organic Dunkel", "93", "4"],
+                ["6", "F", "03-Nov-18", "Organic Pilsner", "94", "2"]]
+        store = sales_store.SalesStore()
+        new_records = []
+        stats = sales_ingest.ingest_rows(
+            rows, store, lambda beer, gyle: new_records.append(gyle),
+            chunk_size=2)
+        self.assertEqual(stats.rows, 6)
+        self.assertEqual(stats.invalid_rows, 2)
+        self.assertEqual(stats.records, 2)
+        self.assertEqual(new_records, [90, 94])
+        view = sales_store.DailySalesView(store, "sales_per_day")
+        self.assertEqual(view[datetime(2018, 11, 2)]["Organic Dunkel"],
+                         {"gyle_number": 90, "quantity": 25})
+
+    def test_decode_date(self):
+        """
+        test_decode_date
+        :return:
+        """
+        for text in ("02-Nov-18", "2-nov-18", " 31-Dec-99 ", "01-Jan-00",
+                     "29-Feb-20"):
+            self.assertEqual(sales_ingest.decode_date(text),
+                             datetime.strptime(text.strip(), "%d-%b-%y")
+                             .toordinal())
+        for text in ("31-Feb-18", "02-Nox-18", "02-Nov-2018", ""):
+            with self.assertRaises(ValueError):
+                sales_ingest.decode_date(text)
+
+
+class TestSalesSnapshot(unittest.TestCase):
+    """
+    TestSalesSnapshot
+    """
+    def test_snapshot_reload(self):
+        """
+        test_snapshot_reload
+        :return:
+        """
+        header = "Invoice,Customer,Date Required,Recipe,Gyle,Qty\n"
+        rows = ["1,A,02-Nov-18,Organic Dunkel,90,12\n",
+                "2,B,03-Nov-18,Organic Pilsner,91,9\n"]
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            file_name = os.path.join(snapshot_dir, "sales.csv")
+            with open(file_name, 'w') as csvfile:
+                csvfile.write(header + "".join(rows))
+
+            def load():
+                store = sales_store.SalesStore()
+                gyles = {}
+                stats = sales_snapshot.load_sales_csvfile(
+                    file_name, store,
+                    lambda beer, gyle: gyles.update({beer: gyle}),
+                    snapshot_dir)
+                view = sales_store.DailySalesView(store,
+                                                  "sales_per_day")
+                return stats, dict(view.items()), gyles
+
+            cold = load()
+            self.assertEqual(cold[0].rows, 2)
+            warm = load()
+            self.assertEqual(warm[0].rows, 0)
+            self.assertEqual(warm[1:], cold[1:])
+            with open(file_name, 'a') as csvfile:
+                csvfile.write("3,C,02-Nov-18,Organic Dunkel,92,3\n")
+            appended = load()
+            self.assertEqual(appended[0].rows, 1)
+            self.assertEqual(appended[1][datetime(2018, 11, 2)]
+                             ["sales_per_day"], 15)
+            with open(file_name, 'w') as csvfile:
+                csvfile.write(header + rows[1] +
+                              rows[0].replace(",12", ",120"))
+            changed = load()
+            self.assertEqual(changed[0].rows, 2)
+            self.assertEqual(changed[2], {"Organic Dunkel": 90,
+                                          "Organic Pilsner": 91})
+
 
 class TestBrewProcess(unittest.TestCase):
     """
     TestBrewProcess
     """
+    @classmethod
+    def setUpClass(cls):
+        # the handlers the app runs with, whichever test runs first
+        brew_logger.configure_logging()
+
     def test_tank(self):
         """
         test_tank
@@ -129,6 +491,324 @@ class TestBrewProcess(unittest.TestCase):
             for element in tanks[tank]["capability"]:
                 self.assertTrue(element, str)
 
+    def test_event_driven_engine(self):
+        """
+        test_event_driven_engine
+        :return:
+        """
+        key = (300, "Organic Dunkel", 100)
+        brew_process.create_process_for_beer(*key)
+        beer_obj = brew_process.find_process_for_beer(*key)
+        self.assertEqual(brew_process.process_pending_beers(0), 1)
+        self.assertEqual(beer_obj.state, "start")
+        # nothing was woken up, so nothing is evaluated
+        self.assertEqual(brew_process.process_pending_beers(0), 0)
+        for state in ("hot_brew", "fermentation", "conditioning",
+                      "finish"):
+            future = brew_process.move_process_to_next_state(*key)
+            self.assertFalse(future.done())
+            brew_process.process_pending_beers(0)
+            self.assertEqual(beer_obj.state, state)
+            if state != "finish":
+                self.assertEqual(future.result(0),
+                                 {"applied": True, "state": state})
+            self.assertEqual(brew_process.find_processes_in_state(state),
+                             [beer_obj])
+        self.assertIn(beer_obj, brew_process.find_processes_for_beer(
+            "Organic Dunkel"))
+        future = brew_process.move_process_to_next_state(*key)
+        brew_process.process_pending_beers(0)
+        self.assertEqual(future.result(0),
+                         {"applied": False, "state": "finish"})
+        tanks = brew_process.tank_status()
+        for stage in ("fermentation", "conditioning"):
+            self.assertEqual(tanks[beer_obj.process_tanks[stage]
+                                   ["tank_name"]]["used_capacity"], 0)
+        brew_process.remove_process_for_beer(*key)
+        self.assertIsNone(brew_process.find_process_for_beer(*key))
+        self.assertEqual(brew_process.find_processes_in_state("finish"),
+                         [])
+
+    def test_metrics(self):
+        """
+        test_metrics
+        :return:
+        """
+        key = (302, "Organic Dunkel", 100)
+        before = brew_metrics.snapshot()
+        brew_process.create_process_for_beer(*key)
+        brew_process.process_pending_beers(0)
+        brew_process.move_process_to_next_state(*key)
+        brew_process.process_pending_beers(0)
+        with brew_process.lock:
+            self.assertIsNone(brew_process_dict.allocate_tank(
+                "fermentation", 100000))
+        after = brew_metrics.snapshot()
+        self.assertEqual(after["brew_processes"]["hot_brew"],
+                         before["brew_processes"].get("hot_brew", 0) + 1)
+
+        def count(snapshot, name, label):
+            return sum(snapshot[name].get(label, ([0], 0))[0])
+
+        for name, label in (("brew_time_in_state_seconds", "start"),
+                            ("brew_transition_latency_seconds",
+                             "hot_brew")):
+            self.assertEqual(count(after, name, label),
+                             count(before, name, label) + 1)
+        self.assertGreater(count(after, "brew_engine_tick_seconds",
+                                 "engine"),
+                           count(before, "brew_engine_tick_seconds",
+                                 "engine"))
+        self.assertEqual(
+            after["brew_tank_allocation_failures_total"]["fermentation"],
+            before["brew_tank_allocation_failures_total"].get(
+                "fermentation", 0) + 1)
+        text = brew_metrics.render({"test": after})
+        self.assertIn("# TYPE brew_time_in_state_seconds histogram", text)
+        self.assertIn('brew_processes{site="test",state="hot_brew"}', text)
+        self.assertIn('brew_transition_latency_seconds_bucket{site="test",'
+                      'state="hot_brew",le="+Inf"}', text)
+        beer_obj = brew_process.find_process_for_beer(*key)
+        brew_process.remove_process_for_beer(*key)
+        brew_process_dict.release_tank(
+            beer_obj.process_tanks["fermentation"]["tank_name"])
+
+    def test_shared_transition_table(self):
+        """
+        test_shared_transition_table
+        :return:
+        """
+        beer_obj = brew_process.BrewingProcess(301, "Organic Dunkel", 100,
+                                               {}, False, "start", "start")
+        self.assertFalse(hasattr(beer_obj, "__dict__"))
+        # triggers of other states are ignored
+        self.assertFalse(beer_obj.finish_process())
+        # a failed condition goes through 'incomplete' back to 'start'
+        self.assertTrue(beer_obj.hot_brew_process())
+        self.assertEqual((beer_obj.state, beer_obj.prev_state,
+                          beer_obj.cur_state), ("start", "start", "start"))
+        self.assertEqual(beer_obj.process_tanks,
+                         {"hot_brew": {"tank_name": "Kettle"}})
+        beer_obj.set_move_next()
+        self.assertTrue(beer_obj.hot_brew_process())
+        self.assertEqual((beer_obj.state, beer_obj.cur_state,
+                          beer_obj.is_allocate),
+                         ("hot_brew", "hot_brew", False))
+
+    def test_batch_operations(self):
+        """
+        test_batch_operations
+        :return:
+        """
+        gyles = [(400 + gyle, "Organic Dunkel", 100) for gyle in range(3)]
+        journal = "BarnabysBrewhouseEventsLog"
+        with self.assertLogs(journal, level="CRITICAL") as logs:
+            created = brew_process.create_processes_for_beers(
+                gyles + gyles[:1])
+        self.assertEqual(len(created), 3)
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(brew_process.process_pending_beers(0), 3)
+        with self.assertLogs(journal, level="CRITICAL") as logs:
+            futures = brew_process.move_processes_to_next_state(
+                gyles + [(499, "Organic Dunkel", 100)])
+            self.assertIsNone(futures[-1])
+            brew_process.process_pending_beers(0)
+        self.assertEqual([future.result(0) for future in futures[:-1]],
+                         [{"applied": True, "state": "hot_brew"}] * 3)
+        # one record for the batch of moves, and one for the fermenters
+        # the engine pass allocated
+        self.assertEqual(len([record for record in logs.records
+                              if record.getMessage().startswith(
+                                  "@state")]), 2)
+        fermenters = [beer_obj.process_tanks["fermentation"]["tank_name"]
+                      for beer_obj in created]
+        with self.assertLogs(journal, level="CRITICAL") as logs:
+            removed = brew_process.remove_processes_for_beers(gyles)
+        self.assertEqual(removed, created)
+        self.assertEqual(len(logs.records), 1)
+        self.assertEqual(len(brew_process.beers_producer_queue), 0)
+        for tank_name in fermenters:
+            brew_process_dict.release_tank(tank_name)
+
+    def test_concurrent_registry(self):
+        """
+        test_concurrent_registry
+        :return:
+        """
+        # a thread-safety test: no update is lost and a gyle created by
+        # every worker is created once. The throughput of the striped
+        # registry against a single lock is measured by
+        # registry_benchmark.py, not here.
+        lost = []
+        duplicates = []
+
+        def work(worker):
+            for gyle in range(200):
+                key = (1000 + worker * 200 + gyle, "Organic Dunkel", 100)
+                brew_process.create_process_for_beer(*key)
+                # every worker also creates the same shared gyle
+                brew_process.create_process_for_beer(900, "Red Helles",
+                                                     worker + 1)
+                brew_process.create_process_for_beer(900, "Red Helles", 1)
+                if brew_process.find_process_for_beer(*key) is None:
+                    lost.append(key)
+                brew_process.remove_process_for_beer(*key)
+                if brew_process.find_process_for_beer(*key) is not None:
+                    lost.append(key)
+            duplicates.append(
+                brew_process.find_process_for_beer(900, "Red Helles", 1))
+
+        threads = [threading.Thread(target=work, args=(worker,))
+                   for worker in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(lost, [])
+        self.assertEqual(len(set(map(id, duplicates))), 1)
+        self.assertEqual(len(brew_process.find_processes_for_beer(
+            "Red Helles")), 8)
+        for worker in range(8):
+            brew_process.remove_process_for_beer(900, "Red Helles",
+                                                 worker + 1)
+        self.assertEqual(len(brew_process.beers_producer_queue), 0)
+        self.assertEqual(brew_process.pending_processes, {})
+
+    def test_async_engine(self):
+        """
+        test_async_engine
+        :return:
+        """
+        key = (301, "Organic Dunkel", 100)
+        engine = brew_engine.AsyncBrewEngine()
+
+        async def scenario():
+            task = asyncio.ensure_future(engine.run())
+            events = engine.subscribe()
+            created = asyncio.ensure_future(events.__anext__())
+            await asyncio.sleep(0)
+            self.assertEqual(await engine.create(*key),
+                             "Organic Dunkel:301:100")
+            self.assertEqual((await created)["event"], "created")
+            self.assertEqual(await engine.advance(*key),
+                             {"applied": True, "state": "hot_brew"})
+            self.assertEqual(await events.__anext__(),
+                             {"key": "Organic Dunkel:301:100",
+                              "state": "hot_brew", "event": "state"})
+            # a tank is awaited until one is released
+            taken = []
+            while True:
+                with brew_process.lock:
+                    tank_name = brew_process_dict.allocate_tank(
+                        "fermentation", 100)
+                if not tank_name:
+                    break
+                taken.append(tank_name)
+            queue = brew_process_dict.tank_waiters["fermenter"]
+            waiters = []
+            for _ in range(2):
+                waiters.append(asyncio.ensure_future(engine.allocate(
+                    "fermentation", 100)))
+                # the allocation is queued from the loop's executor
+                for _ in range(100):
+                    if len(queue) == len(waiters):
+                        break
+                    await asyncio.sleep(0.01)
+                self.assertEqual(len(queue), len(waiters))
+            self.assertFalse(any(waiter.done() for waiter in waiters))
+            # a release wakes the first waiter only
+            brew_process_dict.release_tank(taken[0])
+            self.assertEqual(await waiters[0], taken[0])
+            self.assertFalse(waiters[1].done())
+            waiters[1].cancel()
+            for _ in range(100):
+                if not queue:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(queue, {})
+            for tank_name in taken:
+                brew_process_dict.release_tank(tank_name)
+            beer_obj = brew_process.find_process_for_beer(*key)
+            await engine.remove(*key)
+            self.assertEqual((await events.__anext__())["event"],
+                             "removed")
+            # the fermenter the gyle got in hot_brew
+            brew_process_dict.release_tank(
+                beer_obj.process_tanks["fermentation"]["tank_name"])
+            await events.aclose()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(scenario())
+        self.assertIsNone(brew_process.find_process_for_beer(*key))
+        self.assertNotIn(engine.on_process_event,
+                         brew_process.process_listeners)
+
+    def test_simulator(self):
+        """
+        test_simulator
+        :return:
+        """
+        registry = brew_process.beers_producer_queue
+        stock = dict(brew_process_dict.beer_stock)
+        recipes = [("Organic Dunkel", 1000), ("Organic Red Helles", 400)]
+        # a gyle every 30 days never waits for a tank
+        report = brew_simulator.simulate(10, 30 * 24, recipes=recipes)
+        self.assertEqual(report["finished"], 10)
+        self.assertGreater(report["evaluations"], 0)
+        for delay in report["queueing_hours"].values():
+            self.assertEqual(delay["max"], 0)
+        # a gyle every day waits for a fermenter
+        report = brew_simulator.simulate(30, 24, recipes=recipes)
+        self.assertEqual(report["finished"], 30)
+        self.assertGreater(report["queueing_hours"]["hot_brew"]["max"], 0)
+        for utilisation in report["utilisation"].values():
+            self.assertTrue(0 <= utilisation <= 1)
+        self.assertIs(brew_process.beers_producer_queue, registry)
+        self.assertEqual(brew_process_dict.beer_stock, stock)
+        for tank in brew_process_dict.TANKS.values():
+            self.assertEqual(tank["used_capacity"], 0)
+
+    def test_status_snapshot(self):
+        """
+        test_status_snapshot
+        :return:
+        """
+        versions = brew_process.status_versions()
+        tanks = brew_process.tank_status()
+        status = brew_process.status_process_for_beer()
+        # nothing changed, so nothing is copied again
+        self.assertIs(brew_process.tank_status(), tanks)
+        self.assertIs(brew_process.status_process_for_beer(), status)
+        with self.assertRaises(TypeError):
+            tanks["Albert"]["used_capacity"] = 1
+        key = (500, "Organic Pilsner", 100)
+        brew_process.create_process_for_beer(*key)
+        brew_process.process_pending_beers(0)
+        brew_process.move_process_to_next_state(*key)
+        brew_process.process_pending_beers(0)
+        new_versions = brew_process.status_versions()
+        self.assertGreater(new_versions["tanks"], versions["tanks"])
+        self.assertGreater(new_versions["processes"],
+                           versions["processes"])
+        self.assertEqual(new_versions["stock"], versions["stock"])
+        beer_key = brew_process.process_key(key[1], key[0], key[2])
+        new_status = brew_process.status_process_for_beer()
+        tank_name = new_status[beer_key]["process_tank"]["fermentation"][
+            "tank_name"]
+        # the copies already read don't change
+        self.assertNotIn(beer_key, status)
+        self.assertEqual(tanks[tank_name]["used_capacity"], 0)
+        self.assertEqual(brew_process.tank_status()[tank_name]
+                         ["used_capacity"], 50)
+        copied = pickle.loads(pickle.dumps(new_status))
+        self.assertIsInstance(copied, status_snapshot.FrozenDict)
+        self.assertEqual(copied, new_status)
+        brew_process.remove_process_for_beer(*key)
+        brew_process_dict.release_tank(tank_name)
+        self.assertNotIn(beer_key, brew_process.status_process_for_beer())
+
     def test_tank_allocation(self):
         """
         test_tank_allocation
@@ -190,5 +870,242 @@ class TestBrewProcess(unittest.TestCase):
                              "bottling")
 
 
+    def test_tank_assignment(self):
+        """
+        test_tank_assignment
+        :return:
+        """
+        # every tank is busy
+        taken = []
+        with brew_process.lock:
+            for _ in range(3):
+                taken.append(brew_process.allocate_tank("fermentation",
+                                                        1800))
+            for stage in ("conditioning", "fermentation"):
+                tank_name = brew_process.allocate_tank(stage, 2)
+                while tank_name:
+                    taken.append(tank_name)
+                    tank_name = brew_process.allocate_tank(stage, 2)
+        gyles = [(400, "Organic Pilsner", 100),
+                 (402, "Organic Red Helles", 100),
+                 (403, "Organic Dunkel", 100),
+                 (401, "Organic Dunkel", 1800)]
+        for gyle in gyles:
+            brew_process.create_process_for_beer(*gyle)
+            brew_process.start_process_for_beers()
+            brew_process.move_process_to_next_state(*gyle)
+            brew_process.start_process_for_beers()
+            brew_process.start_process_for_beers()
+        small, medium, last, large = [
+            brew_process.find_process_for_beer(*gyle) for gyle in gyles]
+        waiters = brew_process_dict.tank_waiters
+        self.assertEqual(list(waiters["fermenter"]),
+                         [small, medium, last, large])
+        # only the 1000 litre tanks hold the large gyle, so it takes Albert
+        # though the small ones waited longer
+        brew_process_dict.release_tank("Albert")
+        self.assertEqual(large.process_tanks["fermentation"]["tank_name"],
+                         "Albert")
+        self.assertEqual(list(waiters["fermenter"]), [small, medium, last])
+        # the small gyles fit as tightly, so the one that waited longest
+        # goes first
+        brew_process_dict.release_tank("R2D2")
+        self.assertEqual(small.process_tanks["fermentation"]["tank_name"],
+                         "R2D2")
+        brew_process.move_process_to_next_state(*gyles[0])
+        brew_process.start_process_for_beers()
+        brew_process.start_process_for_beers()
+        # fermenting hands R2D2 over
+        self.assertEqual(small.state, "fermentation")
+        self.assertEqual(medium.process_tanks["fermentation"]["tank_name"],
+                         "R2D2")
+        self.assertEqual(list(waiters["conditioner"]), [small])
+        # the gyle waiting for a conditioner goes first, though the other
+        # waited longer
+        brew_process_dict.release_tank("Camilla")
+        self.assertEqual(small.process_tanks["conditioning"]["tank_name"],
+                         "Camilla")
+        self.assertEqual(waiters["conditioner"], {})
+        self.assertEqual(list(waiters["fermenter"]), [last])
+        brew_process.remove_processes_for_beers(gyles)
+        for tank_name in taken:
+            brew_process_dict.release_tank(tank_name)
+
+
+class TestTankPool(unittest.TestCase):
+    """
+    TestTankPool
+    """
+    def test_best_fit(self):
+        """
+        test_best_fit
+        :return:
+        """
+        tanks = {"Large": {"volume": 1000, "capability": ["fermenter"],
+                           "used_capacity": 0},
+                 "Shared": {"volume": 800,
+                            "capability": ["fermenter", "conditioner"],
+                            "used_capacity": 0},
+                 "Small": {"volume": 500, "capability": ["conditioner"],
+                           "used_capacity": 0},
+                 "Busy": {"volume": 800, "capability": ["fermenter"],
+                          "used_capacity": 400}}
+        pool = tank_pool.TankPool(tanks)
+        self.assertEqual(pool.free_count("fermenter"), 2)
+        # the smallest tank that is big enough
+        self.assertEqual(pool.take("fermenter", 600), "Shared")
+        # taken out of every pool it belongs to
+        self.assertEqual(pool.free_count("conditioner"), 1)
+        self.assertIsNone(pool.take("conditioner", 600))
+        self.assertEqual(pool.take("conditioner", 100), "Small")
+        pool.give("Shared")
+        pool.give("Shared")
+        self.assertEqual(pool.free_count("conditioner"), 1)
+        self.assertEqual(pool.take("conditioner", 600), "Shared")
+        self.assertEqual(pool.take("fermenter", 900), "Large")
+        self.assertIsNone(pool.take("fermenter", 1))
+        self.assertIsNone(pool.take("bottling", 1))
+        # of the tanks alike, the one with the fewest capabilities
+        tanks["Busy"]["used_capacity"] = 0
+        pool.give("Shared")
+        pool.give("Busy")
+        self.assertEqual(pool.take("fermenter", 600), "Busy")
+
+
+class TestBrewScheduler(unittest.TestCase):
+    """
+    TestBrewScheduler
+    """
+    def test_schedule(self):
+        """
+        test_schedule
+        :return:
+        """
+        self.assertEqual(brew_scheduler.gyle_quantity(
+            brew_process_dict.TANKS), 1360)
+        tanks = {"Fermenter": {"volume": 800, "capability": ["fermenter"],
+                               "used_capacity": 0},
+                 "Conditioner": {"volume": 680,
+                                 "capability": ["conditioner"],
+                                 "used_capacity": 0},
+                 "Shared": {"volume": 1000,
+                            "capability": ["fermenter", "conditioner"],
+                            "used_capacity": 0}}
+        horizons = [(500, {"Organic Pilsner": 1600,
+                           "Organic Dunkel": 400}),
+                    (2000, {"Organic Pilsner": 1000})]
+        plan = brew_scheduler.schedule(horizons, tanks, quantity=1360,
+                                       busy_until={"Shared": 100},
+                                       gyle_numbers={"Organic Pilsner": 5})
+        self.assertEqual(plan["unscheduled"], [])
+        self.assertEqual([(gyle["beer_name"], gyle["gyle_no"],
+                           gyle["quantity"], gyle["due"])
+                          for gyle in plan["gyles"]],
+                         [("Organic Pilsner", 6, 800, 500),
+                          ("Organic Dunkel", 1, 400, 500),
+                          ("Organic Pilsner", 7, 800, 500),
+                          ("Organic Pilsner", 8, 1000, 2000)])
+        for gyle in plan["gyles"]:
+            stages = gyle["stages"]
+            self.assertEqual([stage["stage"] for stage in stages],
+                             ["hot_brew", "fermentation", "conditioning",
+                              "bottling"])
+            self.assertGreaterEqual(stages[0]["start"], 0)
+            for before, after in zip(stages, stages[1:]):
+                self.assertEqual(before["end"], after["start"])
+            for stage in stages[1:3]:
+                self.assertGreaterEqual(tanks[stage["tank"]]["volume"],
+                                        gyle["quantity"] * 0.5)
+            self.assertEqual(gyle["late"], stages[-1]["end"] > gyle["due"])
+        for tank, bars in plan["tanks"].items():
+            starts = 100 if tank == "Shared" else 0
+            for bar in sorted(bars, key=lambda bar: bar["start"]):
+                self.assertGreaterEqual(bar["start"], starts)
+                starts = bar["end"]
+        dated = brew_scheduler.gantt(plan, datetime(2019, 10, 1))
+        self.assertEqual(dated["start"], "2019-10-01T00:00")
+        self.assertEqual(dated["gyles"][0]["stages"][0]["end"],
+                         "2019-10-01T08:00")
+        # no tank holds a gyle of 1200 litres
+        plan = brew_scheduler.schedule([(500, {"Organic Pilsner": 2400})],
+                                       tanks, quantity=2400)
+        self.assertEqual([gyle["quantity"] for gyle in plan["unscheduled"]],
+                         [2400])
+        # without a conditioner no gyle can be brewed
+        with self.assertRaises(ValueError):
+            brew_scheduler.schedule([(500, {"Organic Pilsner": 100})],
+                                    {"Fermenter": tanks["Fermenter"]})
+
+class TestBrewShard(unittest.TestCase):
+    """
+    TestBrewShard
+    """
+    def setUp(self):
+        # a shard restores its site from the journal of earlier runs
+        journal = brew_logger.site_journal("test-site")
+        if os.path.exists(journal):
+            os.remove(journal)
+
+    def test_shard_process(self):
+        """
+        test_shard_process
+        :return:
+        """
+        tanks = {"Albert": {"volume": 1000,
+                            "capability": ["fermenter", "conditioner"],
+                            "used_capacity": 0}}
+        shard = brew_shard.start_shards({"test-site": tanks})["test-site"]
+        try:
+            gyle = (1, "Organic Dunkel", 100)
+            self.assertEqual(shard.call("create", [gyle, gyle]),
+                             ["Organic Dunkel:1:100"])
+            states = [shard.call("move", [gyle])[0]["state"]
+                      for _ in range(4)]
+            self.assertEqual(states, ["hot_brew", "fermentation",
+                                      "conditioning", "bottling"])
+            self.assertEqual(shard.call("move", [gyle]),
+                             [{"applied": False, "state": "finish"}])
+            status = shard.call("status")
+            # the shard has its own tanks, stock and processes
+            self.assertEqual(list(status["tanks"]), ["Albert"])
+            self.assertEqual(status["stock"], {"Organic Dunkel": 100})
+            self.assertEqual(shard.call("move", [(2, "Organic Dunkel",
+                                                  100)]), [None])
+            self.assertEqual(shard.call("remove", [gyle]),
+                             ["Organic Dunkel:1:100"])
+            with self.assertRaises(RuntimeError):
+                shard.call("create", [("Organic Dunkel",)])
+        finally:
+            shard.stop()
+        self.assertIsNone(brew_process.find_process_for_beer(*gyle))
+
+    def test_shard_restart(self):
+        """
+        test_shard_restart
+        :return:
+        """
+        tanks = {"Albert": {"volume": 1000,
+                            "capability": ["fermenter", "conditioner"],
+                            "used_capacity": 0}}
+        gyle = (1, "Organic Dunkel", 100)
+        shard = brew_shard.start_shards({"test-site": tanks})["test-site"]
+        try:
+            shard.call("create", [gyle])
+            self.assertEqual(shard.call("move", [gyle]),
+                             [{"applied": True, "state": "hot_brew"}])
+        finally:
+            shard.stop()
+        shard.start()
+        try:
+            status = shard.call("status")
+            self.assertEqual(list(status["processes"]),
+                             ["Organic Dunkel:1:100"])
+            self.assertEqual(status["tanks"]["Albert"]["used_capacity"], 50)
+            self.assertEqual(shard.call("move", [gyle]),
+                             [{"applied": True, "state": "fermentation"}])
+        finally:
+            shard.stop()
+
+
 if __name__ == '__main__':
     unittest.main()